@@ -3,13 +3,21 @@ The command line interface for the autograder.
 
 @author Kevin Wilson - khwilson@gmail.com
 """
+import collections
 import getpass
+import json
+import os
 import sys
 
 import click
 
-from . import setup_app, web
-from .queues import local as queues
+from . import ratelimit, setup_app, storage, web
+from .queues import get_queue
+from .utils import chunked
+
+
+# How many imported submissions are queued at a time
+IMPORT_BATCH_SIZE = 100
 
 
 @click.group()
@@ -32,6 +40,11 @@ def web_group():
 @click.option('--debug/--no-debug', default=False, help="Should we start the app in debug mode?")
 def start(debug, host, port):
     """ Start the webserver """
+    from . import models
+    if models.results_column_is_text():
+        click.echo("The results column predates compressed results; run "
+                   "`autograder db setup` to convert it", err=True)
+        sys.exit(1)
     web.app.run(debug=debug, host=host, port=port)
 
 
@@ -62,16 +75,14 @@ def project():
     pass
 
 
-@project.command('add')
-@click.argument('username')
-@click.argument('name')
-@click.argument('payload')
-@click.argument('executable')
-@click.option('--password', '-p', nargs=1, type=str, default=None)
-def add_project(username, name, payload, executable, password):
-    from . import models
+def check_password(user, password):
+    """ Prompt for the user's password until it is right, if the one given isn't.
+
+    :param models.User user: The user
+    :param str|None password: The password given on the command line
+    :raises ValueError: If the password is wrong three times
+    """
     attempts = 0
-    user = models.db.session.query(models.User).filter(models.User.username == username).first()
     while not user.check_password(password or '') and attempts < 3:
         password = getpass.getpass()
         if password and user.check_password(password):
@@ -81,11 +92,48 @@ def add_project(username, name, payload, executable, password):
     if attempts == 3:
         raise ValueError("Too many attempts at password")
 
-    project_key = queues.make_worker(payload, executable)
-    models.Project.add_project(name, executable, user, project_key=project_key)
+
+@project.command('add')
+@click.argument('username')
+@click.argument('name')
+@click.argument('payload')
+@click.argument('executable')
+@click.option('--password', '-p', nargs=1, type=str, default=None)
+def add_project(username, name, payload, executable, password):
+    from . import models
+    user = models.db.session.query(models.User).filter(models.User.username == username).first()
+    check_password(user, password)
+
+    project_key = get_queue().make_worker(payload, executable)
+    models.Project.add_project(name, executable, user, project_key=project_key,
+                               payload_digest=storage.file_digest(payload))
     click.echo("Project added with key {}".format(project_key))
 
 
+@project.command('update-payload')
+@click.argument('username')
+@click.argument('name')
+@click.argument('payload')
+@click.option('--password', '-p', nargs=1, type=str, default=None)
+def update_payload(username, name, payload, password):
+    """ Replace the payload of a project. Only the project's creator may. """
+    from . import models
+    user = models.db.session.query(models.User).filter(models.User.username == username).first()
+    check_password(user, password)
+
+    project = models.Project.get_project_by_name(name)
+    if not project:
+        click.echo("Project {} does not exist".format(name), err=True)
+        sys.exit(1)
+
+    if project.creator_id != user.id:
+        click.echo("User {} did not create project {}".format(username, name), err=True)
+        sys.exit(1)
+
+    get_queue().make_worker(payload, project.executable, project_key=project.project_key)
+    click.echo("Payload updated for project {}".format(name))
+
+
 @cli.group('submissions')
 def submit_group():
     pass
@@ -95,9 +143,10 @@ def submit_group():
 @click.argument('username')
 @click.argument('project_name')
 @click.argument('code_directory')
-@click.password_option
+@click.password_option()
 def submit_code(username, project_name, code_directory, password):
-    from . import models, queues
+    """ Submit code and wait for it to be graded """
+    from . import models
     user = models.User.get_user_by_name(username)
     if not user:
         click.echo("User {} doesn't exist".format(username), err=True)
@@ -112,9 +161,110 @@ def submit_code(username, project_name, code_directory, password):
         click.echo("Project {} does not exist".format(project_name), err=True)
         sys.exit(1)
 
-    submission = queues.submit_code(user, project, code_directory)
-    models.db.session.add(submission)
-    models.db.commit()
+    queue = get_queue()
+    try:
+        ratelimit.admit(user, project)
+        submission = queue.submit_code(user, project, code_directory)
+    except (ratelimit.RateLimited, ValueError) as e:
+        click.echo(str(e), err=True)
+        sys.exit(1)
+
+    click.echo("Submitted with key {}".format(submission.submission_key))
+    queue.poll()
+    models.db.session.refresh(submission)
+    click.echo(json.dumps(submission.results))
+
+
+@submit_group.command('import')
+@click.argument('project_name')
+@click.argument('directory')
+@click.option('--processes', '-j', nargs=1, type=int, default=None,
+              help="How many processes to archive code with. Defaults to the number of CPUs.")
+def import_submissions(project_name, directory, processes):
+    """ Import a directory of student work.
+
+    Every entry of DIRECTORY is submitted on behalf of the user it is named after. An
+    entry may be a directory, a zip file or a lone file; any extension is dropped from
+    the name of a file to find its user. Users with more than one entry are skipped.
+    """
+    from . import models
+    project = models.Project.get_project_by_name(project_name)
+    if not project:
+        click.echo("Project {} does not exist".format(project_name), err=True)
+        sys.exit(1)
+
+    entries_by_user = collections.defaultdict(list)
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        username = name if os.path.isdir(path) else os.path.splitext(name)[0]
+        entries_by_user[username].append(name)
+
+    codes = {}
+    for username, names in sorted(entries_by_user.items()):
+        if len(names) > 1:
+            click.echo("Skipping {}: more than one entry ({})".format(username, ', '.join(names)),
+                       err=True)
+        else:
+            codes[username] = os.path.join(directory, names[0])
+
+    users = models.User.get_users_by_name(list(codes))
+    assignments = models.Assignment.get_assignments_for_users(users.values(), project)
+    to_push = []
+    for username in sorted(codes):
+        user = users.get(username)
+        if not user:
+            click.echo("Skipping {}: no such user".format(username), err=True)
+        elif user.id not in assignments:
+            click.echo("Skipping {}: not assigned {}".format(username, project_name), err=True)
+        else:
+            to_push.append(user)
+
+    pushed = storage.push_many([codes[assigned.username] for assigned in to_push],
+                               processes=processes)
+    entries = []
+    for user, (archive_digest, error) in zip(to_push, pushed):
+        if error:
+            click.echo("Skipping {}: {}".format(user.username, error), err=True)
+        else:
+            entries.append((user.id, assignments[user.id].id, archive_digest))
+
+    submissions = models.Submission.add_submissions(entries,
+                                                    payload_digest=project.payload_digest)
+    queue = get_queue()
+    for batch in chunked(submissions, IMPORT_BATCH_SIZE):
+        queue.submit_many(project, batch)
+    click.echo("Imported {} submissions".format(len(submissions)))
+    queue.poll()
+
+
+@cli.group('queue')
+def queue_group():
+    pass
+
+
+@queue_group.command('reap')
+@click.option('--dry-run', is_flag=True, default=False,
+              help="Only list the stuck submissions and what would be done with them")
+@click.option('--timeout', '-t', nargs=1, type=int, default=None,
+              help="Seconds a submission may wait for results before it is checked")
+@click.option('--max-attempts', nargs=1, type=int, default=None,
+              help="Times a stuck submission is queued again before it is failed")
+def reap(dry_run, timeout, max_attempts):
+    """ Retry or fail submissions which have waited too long for results. With the
+    local backend, tasks queued by another process (such as the web server) are left
+    alone while that process is running. """
+    from . import reaper
+    report = reaper.reap(timeout=timeout, max_attempts=max_attempts, dry_run=dry_run)
+    for entry in report:
+        click.echo("{}  {}  submitted {:%Y-%m-%d %H:%M:%S}  attempts {}  {}: {}".format(
+            entry.submission_key, entry.project_name, entry.submitted_at, entry.attempts,
+            entry.status, entry.action if not dry_run else 'would be ' + entry.action))
+    counts = collections.Counter(entry.action for entry in report)
+    click.echo("{} stuck submissions: {} {}, {} {}, {} still waiting".format(
+        len(report), counts[reaper.RETRIED], 'to retry' if dry_run else 'retried',
+        counts[reaper.FAILED], 'to fail' if dry_run else 'failed', counts[reaper.WAITING]))
+    if not dry_run:
+        get_queue().poll()
 
 
 @cli.group('db')
@@ -124,7 +274,7 @@ def db():
 
 @db.command('setup')
 @click.option('--recreate/--keep',
-              help="Recreate the entire database or merely insert missing tables",
+              help="Recreate the entire database or merely insert missing tables and indexes",
               default=False)
 def setup_db(recreate):
     from autograder import models as m
@@ -133,5 +283,46 @@ def setup_db(recreate):
     m.create_all()
 
 
+@db.command('migrate-archives')
+def migrate_archives():
+    """ Move archives stored by submission key into the content-addressed store """
+    from autograder import models as m
+    click.echo("Moved {} archives".format(m.migrate_archives()))
+
+
+@db.command('migrate-results')
+def migrate_results():
+    """ Compress results stored before results were compressed """
+    from autograder import models as m
+    click.echo("Compressed the results of {} submissions".format(m.migrate_results()))
+
+
+@db.command('backfill-results')
+def backfill_results():
+    """ Record the test cases of submissions graded before they were recorded """
+    from autograder import models as m
+    click.echo("Read the results of {} submissions".format(m.backfill_submission_results()))
+
+
+@db.command('rebuild-summaries')
+def rebuild_summaries():
+    """ Recompute the latest and best submission of every user on every assignment """
+    from autograder import models as m
+    click.echo("Rebuilt {} summaries".format(m.SubmissionSummary.rebuild_summaries()))
+
+
+@db.command('check-summaries')
+def check_summaries():
+    """ Check the latest and best submission summaries against the submissions """
+    from autograder import models as m
+    problems = m.SubmissionSummary.check_summaries()
+    for user_id, assignment_id, field, expected, actual in problems:
+        click.echo("User {} on assignment {}: {} should be {} but is {}".format(
+            user_id, assignment_id, field or 'summary', expected, actual), err=True)
+    if problems:
+        sys.exit(1)
+    click.echo("All summaries are consistent")
+
+
 def main():
     return cli(obj={})
@@ -19,22 +19,101 @@ class Config:
         self.local_config = LocalConfig(d['local']) if 'local' in d else LocalConfig.get_default()
         self.submissions_directory = d['submissions_directory']
         self.holding_directory = d['holding_directory']
+        self.result_cache = ResultCacheConfig(d.get('result_cache', {}))
+        self.queue_backend = d.get('queue_backend', 'local')
+        self.ingest = IngestConfig(d.get('ingest', {}))
+        self.rate_limit = RateLimitConfig(d.get('rate_limit', {}))
+        self.reaper = ReaperConfig(d.get('reaper', {}))
+        self.downloads = DownloadConfig(d.get('downloads', {}))
 
 
 class IronConfig:
     def __init__(self, d):
         self.project_id = d['project_id']
+        self.token = d.get('token')
+        self.host = d.get('host')
+        self.port = d.get('port')
+        self.protocol = d.get('protocol')
 
 
 class LocalConfig:
     def __init__(self, d):
         self.payload_directory = d['payload_directory']
+        self.processes = d.get('processes')
+        self.timeout = d.get('timeout', 60)
+        self.sandbox = SandboxConfig(d.get('sandbox', {}))
+        self.payload_cache = PayloadCacheConfig(d.get('payload_cache', {}))
+        self.warm = WarmConfig(d.get('warm', {}))
 
     @staticmethod
     def get_default():
         return LocalConfig({'payload_directory': '.'})
 
 
+class SandboxConfig:
+    def __init__(self, d):
+        self.cpu_time = d.get('cpu_time', 60)
+        self.memory_mb = d.get('memory_mb', 512)
+        # Only enforced through the cgroup's pids.max, so only with a cgroup_root
+        self.max_processes = d.get('max_processes')
+        self.max_output_kb = d.get('max_output_kb', 1024)
+        self.cgroup_root = d.get('cgroup_root')
+
+
+class WarmConfig:
+    def __init__(self, d):
+        self.enabled = d.get('enabled', False)
+        self.preload = d.get('preload', [])
+        self.max_tasks = d.get('max_tasks', 100)
+        self.interpreters = d.get('interpreters', ['python'])
+
+
+class PayloadCacheConfig:
+    def __init__(self, d):
+        self.enabled = d.get('enabled', True)
+        self.directory = d.get('directory')
+        self.max_mb = d.get('max_mb', 1024)
+
+
+class ResultCacheConfig:
+    def __init__(self, d):
+        self.enabled = d.get('enabled', True)
+        self.max_size = d.get('max_size', 10000)
+        self.ttl = d.get('ttl')
+
+
+class IngestConfig:
+    def __init__(self, d):
+        self.enabled = d.get('enabled', True)
+        self.max_batch = d.get('max_batch', 100)
+        self.max_delay = d.get('max_delay', 0.05)
+        self.timeout = d.get('timeout', 30)
+
+
+class RateLimitConfig:
+    def __init__(self, d):
+        self.enabled = d.get('enabled', False)
+        self.store = d.get('store', 'memory')
+        self.user_per_minute = d.get('user_per_minute', 6)
+        self.user_burst = d.get('user_burst', 10)
+        self.project_per_minute = d.get('project_per_minute', 600)
+        self.project_burst = d.get('project_burst', 1000)
+
+
+class DownloadConfig:
+    def __init__(self, d):
+        self.offload = d.get('offload')
+        self.accel_prefix = d.get('accel_prefix', '/_submissions/')
+
+
+class ReaperConfig:
+    def __init__(self, d):
+        self.timeout = d.get('timeout', 600)
+        self.max_attempts = d.get('max_attempts', 3)
+        self.batch_size = d.get('batch_size', 100)
+        self.interval = d.get('interval')
+
+
 def load_config(f):
     """ Return a config specified in a yaml contained in f. Verify that it is valid.
 
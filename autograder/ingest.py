@@ -0,0 +1,120 @@
+"""
+Ingestion of grading results posted by workers. Rather than each request to
+/worker/results committing on its own, requests hand their results to a single
+writer thread which flushes whatever has arrived in one transaction. A request
+is only acknowledged once the transaction holding its results has committed.
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+import logging
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from .config import get_config
+from . import models
+
+
+logger = logging.getLogger(__name__)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class IngestError(Exception):
+    """ Raised when results could not be stored in time """
+    pass
+
+
+class _PendingResults(object):
+    """ Results waiting to be flushed and the means of telling the poster how it went """
+
+    def __init__(self, info, results):
+        self.info = info
+        self.results = results
+        self.flushed = threading.Event()
+        self.error = None
+
+
+class ResultWriter(object):
+    """
+    A thread which writes posted results to the submissions table in batches.
+    It flushes as soon as it has `max_batch` results or, failing that, once the
+    oldest waiting results have waited `max_delay` seconds.
+    """
+
+    def __init__(self, max_batch=100, max_delay=0.05):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='result-writer')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def post(self, info, results, timeout=None):
+        """ Queue results for a submission and wait for them to be committed.
+
+        :param models.SubmissionInfo info: The submission
+        :param dict results: Its results
+        :param float|None timeout: The most seconds to wait
+        :raises IngestError: If the results were not committed in time or the
+            transaction failed
+        """
+        pending = _PendingResults(info, results)
+        self._queue.put(pending)
+        if not pending.flushed.wait(timeout):
+            raise IngestError("Timed out waiting for results to be stored")
+        if pending.error:
+            raise IngestError(pending.error)
+
+    def _take_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self.max_delay
+        try:
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                batch.append(self._queue.get(timeout=remaining))
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                models.Submission.store_results([(pending.info, pending.results)
+                                                 for pending in batch])
+            except Exception as e:
+                logger.exception("Could not store a batch of %d results", len(batch))
+                for pending in batch:
+                    pending.error = "Could not store results: {}".format(e)
+            finally:
+                models.db.session.remove()
+            for pending in batch:
+                pending.flushed.set()
+
+
+def get_writer():
+    """ Return the writer results are ingested through, starting it if necessary.
+
+    :return: The writer or None if results are written by each request instead
+    :rtype: ResultWriter|None
+    """
+    global _writer
+    ingest_config = get_config().ingest
+    if not ingest_config.enabled:
+        return None
+    with _writer_lock:
+        if _writer is None:
+            _writer = ResultWriter(max_batch=ingest_config.max_batch,
+                                   max_delay=ingest_config.max_delay)
+            _writer.start()
+    return _writer
@@ -3,43 +3,155 @@ Object models and relations for the autograder.
 
 @author Kevin Wilson - khwilson@gmail.com
 """
+import collections
 from datetime import datetime, timedelta
+import hashlib
+import hmac
 import json
+import os
 import uuid
+import warnings
+import zlib
 
 from flask.ext.login import UserMixin
-from sqlalchemy.types import TypeDecorator, VARCHAR
+import sqlalchemy
+from sqlalchemy.types import TypeDecorator
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from . import db
-from .utils import random_project_key, random_token
+from . import db, storage
+from .config import get_config
+from .utils import LRUCache, chunked, random_project_key, random_token
 
 
 SALT_LENGTH = 100
 PW_HASH_METHOD = 'pbkdf2:sha1:1000'
 
+# Worker tokens are long random strings, so they are hashed with a keyed
+# digest rather than a slow password hash
+TOKEN_HASH_METHOD = 'hmac-sha256'
+
 ONE_YEAR = timedelta(365)
 
+# The most bound parameters put into a single IN clause (SQLite allows 999)
+MAX_IN_CLAUSE = 500
+
+# How many submissions `Submission.get_submission_info` remembers, and for how long
+SUBMISSION_CACHE_SIZE = 4096
+SUBMISSION_CACHE_TTL = 300
+
+_submission_cache = LRUCache(maxsize=SUBMISSION_CACHE_SIZE, ttl=SUBMISSION_CACHE_TTL)
+
+# The first byte of results encoded by `encode_results`. Results stored as plain JSON
+# always start with a printable character.
+RESULTS_FORMAT = b'\x01'
+
+# The outcomes of posting results with `Submission.post_results_many`
+POSTED = 'posted'
+NOT_FOUND = 'not found'
+BAD_TOKEN = 'bad token'
+
+# Where the outcomes of authorization checks are remembered in the session's info.
+# Flask-SQLAlchemy discards the session at the end of each request, so they are
+# only remembered for the length of a request.
+PERMISSION_CACHE_KEY = 'autograder.permissions'
+
+
+def has_membership(model, user_id, unit_id):
+    """ Check whether a user has a row in a membership table (`Teacher` or
+    `Registration`) for a unit. This is a single EXISTS query on the table's
+    (user_id, unit_id) index, and its outcome is cached for the rest of the session.
+
+    :param type model: The membership model
+    :param int user_id: The id of the user
+    :param int unit_id: The id of the unit
+    :return: Whether the user is a member of the unit
+    :rtype: bool
+    """
+    cache = db.session.info.setdefault(PERMISSION_CACHE_KEY, {})
+    key = (model.__tablename__, user_id, unit_id)
+    if key not in cache:
+        query = (db.session.query(model.id)
+                 .filter(model.user_id == user_id, model.unit_id == unit_id))
+        cache[key] = db.session.query(query.exists()).scalar()
+    return cache[key]
+
+
+def forget_permissions():
+    """ Forget the cached outcomes of authorization checks in this session. """
+    db.session.info.pop(PERMISSION_CACHE_KEY, None)
+
 
-class JSONEncodedDict(TypeDecorator):
-    """Represents an immutable structure as a json-encoded string.
+def hash_token(token):
+    """ Hash a worker token with HMAC-SHA256 keyed on the configured secret key.
 
-    Ganked from the SQLAlchemy docs. To use, specify a string length, just like
-    for a VARCHAR, e.g.::
-        JSONEncodedDict(255)
+    :param str token: The token to hash
+    :return: The hash, prefixed with `TOKEN_HASH_METHOD`
+    :rtype: str
     """
+    key = get_config().secret_key.encode('utf-8')
+    digest = hmac.new(key, token.encode('utf-8'), hashlib.sha256).hexdigest()
+    return '{}${}'.format(TOKEN_HASH_METHOD, digest)
+
+
+def check_token_hash(token_hash, token):
+    """ Check a worker token against a hash made by `hash_token`. Hashes made with
+    `PW_HASH_METHOD` (from before tokens had their own scheme) are also accepted.
+
+    :param str token_hash: The stored hash
+    :param str token: The token to check
+    :return: Whether the token matches the hash
+    :rtype: bool
+    """
+    if token_hash.startswith(TOKEN_HASH_METHOD + '$'):
+        return hmac.compare_digest(str(token_hash), hash_token(token))
+    return check_password_hash(token_hash, token)
+
+
+def encode_results(results):
+    """ Encode the results of grading as compact JSON compressed with zlib.
+
+    :param dict|None results: The results
+    :return: The encoding, prefixed with `RESULTS_FORMAT`
+    :rtype: bytes|None
+    """
+    if results is None:
+        return None
+    data = json.dumps(results, separators=(',', ':')).encode('utf-8')
+    return RESULTS_FORMAT + zlib.compress(data)
+
+
+def decode_results(data):
+    """ Decode results encoded by `encode_results`. Results stored as plain JSON
+    before they were compressed are decoded too.
+
+    :param bytes|None data: The encoded results
+    :return: The results
+    :rtype: dict|None
+    """
+    if data is None:
+        return None
+    if data[:1] == RESULTS_FORMAT:
+        data = zlib.decompress(data[1:])
+    return json.loads(data.decode('utf-8'))
+
 
-    impl = VARCHAR
+class EncodedResults(TypeDecorator):
+    """ Holds the bytes made by `encode_results` in a binary column. Rows written as
+    JSON text before results were compressed come back as UTF-8 bytes, so that
+    `decode_results` can read those too.
+    """
 
-    def process_bind_param(self, value, dialect):
-        if value is not None:
-            value = json.dumps(value)
-        return value
+    impl = sqlalchemy.LargeBinary
 
-    def process_result_value(self, value, dialect):
-        if value is not None:
-            value = json.loads(value)
-        return value
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if value is None or isinstance(value, bytes):
+                return value
+            if isinstance(value, sqlalchemy.util.text_type):
+                return value.encode('utf-8')
+            # The buffers or memoryviews DBAPIs return for binary columns
+            return bytes(value)
+        return process
 
 
 class User(db.Model, UserMixin):
@@ -48,7 +160,7 @@ class User(db.Model, UserMixin):
     __tablename__ = 'users'
 
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.Unicode(100))
+    username = db.Column(db.Unicode(100), index=True, unique=True)
     pw_hash = db.Column(db.String(200))
     active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime)
@@ -79,14 +191,31 @@ class User(db.Model, UserMixin):
     def get_user_by_name(username):
         return db.session.query(User).filter(User.username == username).first()
 
+    @staticmethod
+    def get_users_by_name(usernames):
+        """ Look up many users at once.
+
+        :param list[str] usernames: The usernames to look up
+        :return: The users which exist, keyed by username
+        :rtype: dict[str, User]
+        """
+        users = {}
+        for chunk in chunked(usernames, MAX_IN_CLAUSE):
+            for user in db.session.query(User).filter(User.username.in_(chunk)):
+                users[user.username] = user
+        return users
+
 
 class Teacher(db.Model):
     """ This model represents all the users who have teacher powers in a class """
     __tablename__ = 'teachers'
+    __table_args__ = (
+        db.Index('ix_teachers_user_id_unit_id', 'user_id', 'unit_id', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey(User.id))
-    unit_id = db.Column(db.Integer, db.ForeignKey("units.id"))
+    unit_id = db.Column(db.Integer, db.ForeignKey("units.id"), index=True)
 
     @staticmethod
     def add_teacher(user, unit):
@@ -100,8 +229,20 @@ class Teacher(db.Model):
         teacher = Teacher(user_id=user.id, unit_id=unit.id)
         db.session.add(teacher)
         db.session.commit()
+        forget_permissions()
         return teacher
 
+    @staticmethod
+    def is_teacher(user, unit_id):
+        """ Check whether a user is a teacher in a unit.
+
+        :param User user: The user
+        :param int unit_id: The id of the unit
+        :return: Whether the user is a teacher in the unit
+        :rtype: bool
+        """
+        return has_membership(Teacher, user.id, unit_id)
+
 
 class Unit(db.Model):
     """ This model represents a class, but we can't call it a class because reserved words """
@@ -109,7 +250,7 @@ class Unit(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     description = db.Column(db.String(255))
-    creator_id = db.Column(db.Integer, db.ForeignKey(User.id))
+    creator_id = db.Column(db.Integer, db.ForeignKey(User.id), index=True)
     created_at = db.Column(db.DateTime)
 
     registrations = db.relationship("Registration", backref="unit")
@@ -139,6 +280,7 @@ class Unit(db.Model):
         teacher = Teacher(user_id=creator.id, unit_id=unit.id)
         db.session.add(teacher)
         db.session.commit()
+        forget_permissions()
 
         return unit
 
@@ -147,10 +289,13 @@ class Registration(db.Model):
     """ This model represents a user/unit pair """
 
     __tablename__ = 'registrations'
+    __table_args__ = (
+        db.Index('ix_registrations_user_id_unit_id', 'user_id', 'unit_id', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey(User.id))
-    unit_id = db.Column(db.Integer, db.ForeignKey(Unit.id))
+    unit_id = db.Column(db.Integer, db.ForeignKey(Unit.id), index=True)
 
     @staticmethod
     def add_registration(user, unit):
@@ -165,8 +310,20 @@ class Registration(db.Model):
         reg = Registration(user_id=user.id, unit_id=unit.id)
         db.session.add(reg)
         db.session.commit()
+        forget_permissions()
         return reg
 
+    @staticmethod
+    def is_registered(user, unit_id):
+        """ Check whether a user is registered in a unit.
+
+        :param User user: The user
+        :param int unit_id: The id of the unit
+        :return: Whether the user is registered in the unit
+        :rtype: bool
+        """
+        return has_membership(Registration, user.id, unit_id)
+
 
 class Assignment(db.Model):
     """ A model which represents a project/unit pair """
@@ -175,9 +332,10 @@ class Assignment(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     due_date = db.Column(db.DateTime)
-    unit_id = db.Column(db.Integer, db.ForeignKey(Unit.id))
-    assigner_id = db.Column(db.Integer, db.ForeignKey(User.id))
-    project_id = db.Column(db.Integer, db.ForeignKey("projects.id"))
+    unit_id = db.Column(db.Integer, db.ForeignKey(Unit.id), index=True)
+    assigner_id = db.Column(db.Integer, db.ForeignKey(User.id), index=True)
+    project_id = db.Column(db.Integer, db.ForeignKey("projects.id"), index=True)
+    max_submissions = db.Column(db.Integer, nullable=True)
 
     assigner = db.relationship("User")
     project = db.relationship("Project")
@@ -200,6 +358,13 @@ class Assignment(db.Model):
         self.due_date = due_date or datetime.utcnow() + ONE_YEAR
         self.max_submissions = max_submissions
 
+    def limits_submissions(self):
+        """ Whether there is a limit on how many times each user may submit this assignment
+
+        :rtype: bool
+        """
+        return self.max_submissions is not None and self.max_submissions >= 0
+
     @staticmethod
     def add_assignment(assigner, unit, project, due_date=None, max_submissions=-1):
         """
@@ -215,7 +380,7 @@ class Assignment(db.Model):
         :rtype: Assignment
         :raises ValueError: If the assigner is not a teacher in the passed unit
         """
-        if not any(teacher.id == assigner.id for teacher in unit.teachers):
+        if not Teacher.is_teacher(assigner, unit.id):
             raise ValueError("Only a teacher may assign a project to a unit")
         assignment = Assignment(assigner.id, unit.id, project.id,
                                 due_date=due_date, max_submissions=max_submissions)
@@ -223,6 +388,45 @@ class Assignment(db.Model):
         db.session.commit()
         return assignment
 
+    @staticmethod
+    def get_assignments_for_users(users, project):
+        """ Find the assignment of a project for many users at once. See
+        `get_assignment_for_user`.
+
+        :param list[User] users: The users who would submit the project
+        :param Project project: The project being submitted
+        :return: The assignment with the latest due date for each user who has been
+            assigned the project, keyed by user id
+        :rtype: dict[int, Assignment]
+        """
+        assignments = {}
+        for chunk in chunked([user.id for user in users], MAX_IN_CLAUSE):
+            rows = (db.session.query(Registration.user_id, Assignment)
+                    .join(Assignment, Assignment.unit_id == Registration.unit_id)
+                    .filter(Registration.user_id.in_(chunk),
+                            Assignment.project_id == project.id)
+                    .order_by(Assignment.due_date))
+            for user_id, assignment in rows:
+                assignments[user_id] = assignment
+        return assignments
+
+    @staticmethod
+    def get_assignment_for_user(user, project):
+        """ Find the assignment of a project in one of the units the user is registered in.
+
+        :param User user: The user who would submit the project
+        :param Project project: The project being submitted
+        :return: The assignment with the latest due date, or None if the user has not
+            been assigned the project
+        :rtype: Assignment|None
+        """
+        return (db.session.query(Assignment)
+                .join(Registration, Registration.unit_id == Assignment.unit_id)
+                .filter(Registration.user_id == user.id,
+                        Assignment.project_id == project.id)
+                .order_by(Assignment.due_date.desc())
+                .first())
+
 
 class Project(db.Model):
     """ A model representing a project that can be assigned to a unit """
@@ -230,30 +434,41 @@ class Project(db.Model):
     __tablename__ = 'projects'
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(255))
+    name = db.Column(db.String(255), index=True, unique=True)
     executable = db.Column(db.String(255))
-    project_key = db.Column(db.String(36))
+    project_key = db.Column(db.String(36), index=True, unique=True)
+    payload_digest = db.Column(db.String(64), nullable=True)
     created_at = db.Column(db.DateTime)
-    creator_id = db.Column(db.Integer, db.ForeignKey(User.id))
+    creator_id = db.Column(db.Integer, db.ForeignKey(User.id), index=True)
 
     creator = db.relationship("User")
 
-    def __init__(self, name, executable, creator_id, project_key):
+    def __init__(self, name, executable, creator_id, project_key, payload_digest=None):
         self.name = name
         self.executable = executable
         self.project_key = project_key
+        self.payload_digest = payload_digest
         self.creator_id = creator_id
         self.created_at = datetime.utcnow()
 
     @staticmethod
-    def add_project(name, executable, creator, project_key=None):
+    def add_project(name, executable, creator, project_key=None, payload_digest=None):
         project_key = project_key or random_project_key()
         project = Project(name=name, executable=executable,
-                          creator_id=creator.id, project_key=project_key)
+                          creator_id=creator.id, project_key=project_key,
+                          payload_digest=payload_digest)
         db.session.add(project)
         db.session.commit()
         return project
 
+    def update_payload(self, payload_digest):
+        """ Record that a new payload was uploaded for this project.
+
+        :param str payload_digest: The SHA-256 digest of the new payload
+        """
+        self.payload_digest = payload_digest
+        db.session.commit()
+
     @staticmethod
     def get_project_by_name(name):
         return db.session.query(Project).filter(Project.name == name).first()
@@ -266,32 +481,74 @@ class Project(db.Model):
 class Submission(db.Model):
 
     __tablename__ = 'submissions'
+    __table_args__ = (
+        db.Index('ix_submissions_user_id_assignment_id', 'user_id', 'assignment_id'),
+        # For finding submissions which have waited too long for results
+        db.Index('ix_submissions_results_at_submitted_at', 'results_at', 'submitted_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     submitted_at = db.Column(db.DateTime)
     user_id = db.Column(db.Integer, db.ForeignKey(User.id))
-    assignment_id = db.Column(db.Integer, db.ForeignKey(Assignment.id))
-    submission_key = db.Column(db.String(36))
+    assignment_id = db.Column(db.Integer, db.ForeignKey(Assignment.id), index=True)
+    submission_key = db.Column(db.String(36), index=True, unique=True)
     token_hash = db.Column(db.String(200))
+    archive_digest = db.Column(db.String(64), nullable=True, index=True)
+    payload_digest = db.Column(db.String(64), nullable=True)
+    # See `scheduling.get_priority`
+    priority = db.Column(db.Integer, nullable=True)
+    # The id of the submission's task with the backend, if it has one
+    task_id = db.Column(db.String(64), nullable=True)
+    # How many times the submission has been queued again after getting stuck
+    attempts = db.Column(db.Integer, nullable=True)
 
     results_at = db.Column(db.DateTime, nullable=True)
-    results = db.Column(JSONEncodedDict(65535), nullable=True)
+    encoded_results = db.Column('results', EncodedResults, nullable=True)
 
     user = db.relationship("User")
     assignment = db.relationship("Assignment")
 
-    def __init__(self, user_id, assignment_id, token):
+    def __init__(self, user_id, assignment_id, token, submission_key=None, archive_digest=None,
+                 payload_digest=None):
         self.submitted_at = datetime.utcnow()
-        self.submission_key = str(uuid.uuid4())
+        self.submission_key = submission_key or str(uuid.uuid4())
         self.user_id = user_id
         self.assignment_id = assignment_id
-        self.token_hash = generate_password_hash(token, salt_length=SALT_LENGTH,
-                                                 method=PW_HASH_METHOD)
+        self.token_hash = hash_token(token)
+        self.archive_digest = archive_digest
+        self.payload_digest = payload_digest
         self.results_at = None
         self.results = None
 
     @staticmethod
-    def add_submission(user, assignment, token=None):
+    def _reserve(user, assignment):
+        if not Registration.is_registered(user, assignment.unit_id):
+            raise ValueError("A user may only submit an assignment they've been assigned")
+        SubmissionSummary.ensure_summaries([(user.id, assignment.id)])
+        if not SubmissionSummary.reserve_submission(user.id, assignment):
+            max_submissions = assignment.max_submissions
+            db.session.rollback()
+            raise SubmissionLimitError(
+                "A user may only submit this assignment {} times".format(max_submissions))
+
+    @staticmethod
+    def reserve_submission(user, assignment):
+        """ Check that a user may submit an assignment and count the submission against
+        its `max_submissions` before any work is done on the submitted code. Pass
+        `reserved=True` to `add_submission` once the code is stored, or release the
+        reservation with `SubmissionSummary.release_submission` if it can't be.
+
+        :param User user: The user submitting
+        :param Assignment assignment: The assignment the user is submitting
+        :raises ValueError: If the user has not been assigned the given assignment
+        :raises SubmissionLimitError: If the user has no submissions left
+        """
+        Submission._reserve(user, assignment)
+        db.session.commit()
+
+    @staticmethod
+    def add_submission(user, assignment, token=None, submission_key=None, archive_digest=None,
+                       payload_digest=None, reserved=False):
         """ Add a submission. Note that every submission needs a token so that the
         autograder can post results. If you do not supply a token, then a random one
         will be generated.
@@ -299,33 +556,974 @@ class Submission(db.Model):
         :param User user: The user submitting
         :param Assignment assignment: The assignment the user is submitting
         :param str|None token: The token used to submit results of the submission
+        :param str|None submission_key: The key of the submission. If not specified,
+            a random one is generated.
+        :param str|None archive_digest: The SHA-256 digest of the submitted archive
+        :param str|None payload_digest: The SHA-256 digest of the payload the submission
+            is graded with
+        :param bool reserved: Whether the submission was already checked and counted
+            by `reserve_submission`
         :return: The Submission object and token
         :rtype: Submission, str
         :raises ValueError: If the user has not been assigned the given assignment
+        :raises SubmissionLimitError: If the user has no submissions left
         """
         if not token:
             token = random_token()
 
-        if (len(user.registrations) == 0 or
-                not any(assignment.unit_id == reg.unit_id for reg in user.registrations)):
-            raise ValueError("A user may only submit an assignment they've been assigned")
-
-        submission = Submission(user.id, assignment.id, token=token)
+        if not reserved:
+            Submission._reserve(user, assignment)
+        submission = Submission(user.id, assignment.id, token=token,
+                                submission_key=submission_key, archive_digest=archive_digest,
+                                payload_digest=payload_digest)
         db.session.add(submission)
+        db.session.flush()
+        SubmissionSummary.record_submissions([submission], reserved=True)
         db.session.commit()
         return submission, token
 
+    @staticmethod
+    def add_submissions(entries, payload_digest=None):
+        """ Add many submissions in a single transaction, each with a random token.
+        Unlike `add_submission`, the caller is responsible for checking that each
+        user has been assigned their assignment, and `max_submissions` is not enforced.
+
+        :param list[(int, int, str)] entries: The user id, assignment id and archive
+            digest of each submission
+        :param str|None payload_digest: The SHA-256 digest of the payload the
+            submissions are graded with
+        :return: The Submission objects and their tokens, in the order of `entries`
+        :rtype: list[(Submission, str)]
+        """
+        SubmissionSummary.ensure_summaries({(user_id, assignment_id)
+                                            for user_id, assignment_id, _ in entries})
+        created = []
+        for user_id, assignment_id, archive_digest in entries:
+            token = random_token()
+            submission = Submission(user_id, assignment_id, token=token,
+                                    archive_digest=archive_digest,
+                                    payload_digest=payload_digest)
+            created.append((submission, token))
+        db.session.add_all([new for new, _ in created])
+        db.session.flush()
+        SubmissionSummary.record_submissions([new for new, _ in created])
+        db.session.commit()
+        return created
+
+    @staticmethod
+    def get_submission_by_key(submission_key):
+        return (db.session.query(Submission)
+                .filter(Submission.submission_key == submission_key)
+                .first())
+
+    @staticmethod
+    def get_submission_info(submission_key):
+        """ Look up the immutable fields of a submission. These are cached in process
+        until the submission's results are posted, so a worker fetching code and then
+        posting results for the same key only hits the database once.
+
+        :param str submission_key: The key of the submission
+        :return: The submission's info or None if there is no such submission
+        :rtype: SubmissionInfo|None
+        """
+        return Submission.get_submission_infos([submission_key]).get(submission_key)
+
+    @staticmethod
+    def get_submission_infos(submission_keys):
+        """ Look up the immutable fields of many submissions. Those which are not cached
+        are fetched with as few queries as possible and then cached.
+
+        :param list[str] submission_keys: The keys of the submissions
+        :return: The info of each submission which exists, by key
+        :rtype: dict[str, SubmissionInfo]
+        """
+        infos = {}
+        missing = []
+        for submission_key in submission_keys:
+            info = _submission_cache.get(submission_key)
+            if info is None:
+                missing.append(submission_key)
+            else:
+                infos[submission_key] = info
+
+        for chunk in chunked(missing, MAX_IN_CLAUSE):
+            rows = (db.session.query(Submission.id, Submission.submission_key,
+                                     Submission.token_hash, Submission.archive_digest,
+                                     Submission.submitted_at, Submission.priority,
+                                     Assignment.unit_id)
+                    .join(Assignment, Assignment.id == Submission.assignment_id)
+                    .filter(Submission.submission_key.in_(chunk)))
+            for row in rows:
+                info = SubmissionInfo(row.id, row.submission_key, row.token_hash,
+                                      storage.archive_path(row.submission_key,
+                                                           row.archive_digest),
+                                      row.archive_digest, row.submitted_at, row.priority,
+                                      row.unit_id)
+                _submission_cache.set(row.submission_key, info)
+                infos[row.submission_key] = info
+        return infos
+
+    @staticmethod
+    def get_graded_duplicate(project, archive_digest, payload_digest):
+        """ Find the latest graded submission of a byte-identical archive to a project
+        which was graded with a byte-identical payload.
+
+        :param Project project: The project the archive was submitted to
+        :param str archive_digest: The digest of the archive
+        :param str payload_digest: The digest of the payload
+        :return: The submission or None if the archive has not been graded
+        :rtype: Submission|None
+        """
+        if payload_digest is None:
+            return None
+        return (db.session.query(Submission)
+                .join(Assignment, Assignment.id == Submission.assignment_id)
+                .filter(Submission.archive_digest == archive_digest,
+                        Submission.payload_digest == payload_digest,
+                        Assignment.project_id == project.id,
+                        Submission.results_at.isnot(None))
+                .order_by(Submission.results_at.desc())
+                .first())
+
+    @staticmethod
+    def store_results(entries):
+        """ Store the results of many submissions with one executemany UPDATE in a
+        single transaction, without loading the submissions.
+
+        :param list[(SubmissionInfo, dict)] entries: Submissions whose tokens have
+            already been checked and their results. If a submission appears more than
+            once, its last results are the ones stored.
+        """
+        # A worker retrying a post can land the same submission in a batch twice
+        by_id = collections.OrderedDict()
+        for info, results in entries:
+            by_id.pop(info.id, None)
+            by_id[info.id] = (info, results)
+        entries = list(by_id.values())
+
+        table = Submission.__table__
+        new_results_at = sqlalchemy.bindparam('new_results_at', type_=table.c.results_at.type)
+        new_results = sqlalchemy.bindparam('new_results', type_=table.c.results.type)
+        statement = (table.update()
+                     .where(table.c.id == sqlalchemy.bindparam('submission_id'))
+                     .values(results_at=new_results_at, results=new_results))
+        now = datetime.utcnow()
+        try:
+            db.session.execute(statement, [
+                {'submission_id': info.id, 'new_results_at': now,
+                 'new_results': encode_results(results)}
+                for info, results in entries])
+            SubmissionResult.replace_results([(info.id, results) for info, results in entries])
+            SubmissionSummary.record_results([(info.id, results) for info, results in entries])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for info, _ in entries:
+            _submission_cache.pop(info.submission_key)
+
+    @staticmethod
+    def post_results_many(entries):
+        """ Post the results of many submissions, as workers would one at a time, but
+        with a single UPDATE statement and a single commit.
+
+        :param list[(str, str, dict)] entries: The submission key, the token presented
+            for it and its results
+        :return: The outcome of each entry, in order: `POSTED`, `NOT_FOUND` if there is
+            no such submission or `BAD_TOKEN` if the token is wrong
+        :rtype: list[str]
+        """
+        infos = Submission.get_submission_infos([key for key, _, _ in entries])
+        statuses = []
+        to_store = []
+        for submission_key, token, results in entries:
+            info = infos.get(submission_key)
+            if info is None:
+                statuses.append(NOT_FOUND)
+            elif not info.check_token(token):
+                statuses.append(BAD_TOKEN)
+            else:
+                statuses.append(POSTED)
+                to_store.append((info, results))
+        if to_store:
+            Submission.store_results(to_store)
+        return statuses
+
+    @staticmethod
+    def record_task_ids(entries):
+        """ Record the backend tasks of many submissions with one executemany UPDATE.
+
+        :param list[(int, str)] entries: The submission id and task id of each submission
+        """
+        if not entries:
+            return
+        table = Submission.__table__
+        db.session.execute(table.update()
+                           .where(table.c.id == sqlalchemy.bindparam('submission_id'))
+                           .values(task_id=sqlalchemy.bindparam('new_task_id')),
+                           [{'submission_id': submission_id, 'new_task_id': task_id}
+                            for submission_id, task_id in entries])
+        db.session.commit()
+
+    @staticmethod
+    def get_stuck_submissions(submitted_before, limit=100):
+        """ Find the oldest submissions which have been waiting for results since before
+        a cutoff, along with their projects. This is a range scan of the
+        (results_at, submitted_at) index.
+
+        :param datetime submitted_before: The cutoff
+        :param int limit: The most submissions to return
+        :return: The submissions and their projects, oldest first
+        :rtype: list[(Submission, Project)]
+        """
+        return (db.session.query(Submission, Project)
+                .join(Assignment, Assignment.id == Submission.assignment_id)
+                .join(Project, Project.id == Assignment.project_id)
+                .filter(Submission.results_at.is_(None),
+                        Submission.submitted_at < submitted_before)
+                .order_by(Submission.submitted_at)
+                .limit(limit)
+                .all())
+
+    def renew_token(self):
+        """ Give the submission a new token, so that it can be queued again, and count
+        the attempt. Whatever holds the old token can no longer post results.
+
+        :return: The new token
+        :rtype: str
+        """
+        token = random_token()
+        self.token_hash = hash_token(token)
+        self.attempts = (self.attempts or 0) + 1
+        db.session.commit()
+        _submission_cache.pop(self.submission_key)
+        return token
+
+    def _get_results(self):
+        encoded = self.encoded_results
+        decoded = self.__dict__.get('_decoded_results')
+        if decoded is None or decoded[0] is not encoded:
+            decoded = (encoded, decode_results(encoded))
+            self.__dict__['_decoded_results'] = decoded
+        return decoded[1]
+
+    def _set_results(self, results):
+        self.encoded_results = encode_results(results)
+        self.__dict__['_decoded_results'] = (self.encoded_results, results)
+
+    # The results are only decoded when first read, so loading many submissions
+    # doesn't pay to decode results nobody looks at
+    results = db.synonym('encoded_results', descriptor=property(_get_results, _set_results))
+
+    @property
+    def archive(self):
+        """ The path to the submission's archive """
+        return storage.archive_path(self.submission_key, self.archive_digest)
+
     def check_token(self, token):
-        return check_password_hash(self.token_hash, token)
+        """ Check the token a worker presented. If the stored hash predates
+        `TOKEN_HASH_METHOD`, it is upgraded in place once the token checks out.
+
+        :param str token: The token to check
+        :return: Whether the token is correct
+        :rtype: bool
+        """
+        if not check_token_hash(self.token_hash, token):
+            return False
+        if not self.token_hash.startswith(TOKEN_HASH_METHOD + '$'):
+            self.token_hash = hash_token(token)
+            db.session.commit()
+            _submission_cache.pop(self.submission_key)
+        return True
 
     def post_results(self, results):
         self.results_at = datetime.utcnow()
         self.results = results
+        SubmissionResult.replace_results([(self.id, results)])
+        SubmissionSummary.record_results([(self.id, results)])
+        db.session.commit()
+        _submission_cache.pop(self.submission_key)
+
+
+class SubmissionResult(db.Model):
+    """ The outcome of one test case of a graded submission. These are copied out of
+    the `tests` list of a submission's results when they are posted, so that
+    gradebooks can be aggregated in SQL rather than by decoding every submission's
+    results.
+    """
+
+    __tablename__ = 'submission_results'
+    __table_args__ = (
+        db.Index('ix_submission_results_submission_id_name', 'submission_id', 'name'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    submission_id = db.Column(db.Integer, db.ForeignKey(Submission.id), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    passed = db.Column(db.Boolean, nullable=False)
+    score = db.Column(db.Float, nullable=True)
+    duration = db.Column(db.Float, nullable=True)
+
+    submission = db.relationship("Submission")
+
+    @staticmethod
+    def parse_results(results):
+        """ Pull the test cases out of a submission's results. Graders report them as
+        a `tests` list of objects with a `name`, whether the test `passed`, and
+        optionally the `score` it earned and its `duration` in seconds.
+
+        :param dict|None results: The results of the submission
+        :return: The name, passed, score and duration of each test case which has a name
+        :rtype: list[(str, bool, float|None, float|None)]
+        """
+        tests = (results or {}).get('tests')
+        if not isinstance(tests, list):
+            return []
+        parsed = []
+        for test in tests:
+            if isinstance(test, dict) and test.get('name') is not None:
+                parsed.append((u'{}'.format(test['name'])[:255], bool(test.get('passed')),
+                               _to_float(test.get('score')), _to_float(test.get('duration'))))
+        return parsed
+
+    @staticmethod
+    def replace_results(entries):
+        """ Replace the test case rows of many submissions in the current transaction.
+        The caller is responsible for committing.
+
+        :param list[(int, dict)] entries: The id of each submission and its results
+        """
+        table = SubmissionResult.__table__
+        submission_ids = [submission_id for submission_id, _ in entries]
+        for chunk in chunked(submission_ids, MAX_IN_CLAUSE):
+            db.session.execute(table.delete().where(table.c.submission_id.in_(chunk)))
+        rows = [{'submission_id': submission_id, 'name': name, 'passed': passed,
+                 'score': score, 'duration': duration}
+                for submission_id, results in entries
+                for name, passed, score, duration in SubmissionResult.parse_results(results)]
+        if rows:
+            db.session.execute(table.insert(), rows)
+
+    @staticmethod
+    def get_best_scores(assignment):
+        """ Find each user's best total score over their submissions of an assignment.
+
+        :param Assignment assignment: The assignment
+        :return: The best score of each user who has a graded submission, by user id
+        :rtype: dict[int, float]
+        """
+        totals = (db.session.query(SubmissionResult.submission_id.label('submission_id'),
+                                   sqlalchemy.func.sum(SubmissionResult.score).label('total'))
+                  .join(Submission, Submission.id == SubmissionResult.submission_id)
+                  .filter(Submission.assignment_id == assignment.id)
+                  .group_by(SubmissionResult.submission_id)
+                  .subquery())
+        rows = (db.session.query(Submission.user_id, sqlalchemy.func.max(totals.c.total))
+                .join(totals, totals.c.submission_id == Submission.id)
+                .group_by(Submission.user_id))
+        return {user_id: best for user_id, best in rows}
+
+    @staticmethod
+    def get_pass_rates(assignment):
+        """ Find the fraction of graded submissions of an assignment which passed each test.
+
+        :param Assignment assignment: The assignment
+        :return: The pass rate of each test, by name
+        :rtype: dict[str, float]
+        """
+        passed = sqlalchemy.func.sum(sqlalchemy.case([(SubmissionResult.passed, 1)], else_=0))
+        rows = (db.session.query(SubmissionResult.name, passed, sqlalchemy.func.count())
+                .join(Submission, Submission.id == SubmissionResult.submission_id)
+                .filter(Submission.assignment_id == assignment.id)
+                .group_by(SubmissionResult.name))
+        return {name: float(passes) / total for name, passes, total in rows}
+
+    @staticmethod
+    def total_score(results):
+        """ Add up the scores of the test cases in a submission's results, as SQL's SUM
+        would over their rows.
+
+        :param dict|None results: The results of the submission
+        :return: The total or None if no test case has a score
+        :rtype: float|None
+        """
+        scores = [score for _, _, score, _ in SubmissionResult.parse_results(results)
+                  if score is not None]
+        return sum(scores) if scores else None
+
+
+class SubmissionSummary(db.Model):
+    """ The number of submissions each user has made to an assignment, their latest
+    submission and their best scoring one. Rows are kept up to date in the same
+    transaction as submissions are added and results are posted, so teacher views
+    don't have to group the whole submissions table. Ties for the best score go to
+    the later submission.
+    """
+
+    __tablename__ = 'submission_summaries'
+    __table_args__ = (
+        db.Index('ix_submission_summaries_user_id_assignment_id', 'user_id', 'assignment_id',
+                 unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), nullable=False)
+    assignment_id = db.Column(db.Integer, db.ForeignKey(Assignment.id), nullable=False,
+                              index=True)
+    submission_count = db.Column(db.Integer, nullable=False, default=0)
+    latest_submission_id = db.Column(db.Integer, db.ForeignKey(Submission.id), nullable=True)
+    latest_submitted_at = db.Column(db.DateTime, nullable=True)
+    best_submission_id = db.Column(db.Integer, db.ForeignKey(Submission.id), nullable=True)
+    best_score = db.Column(db.Float, nullable=True)
+
+    user = db.relationship("User")
+    assignment = db.relationship("Assignment")
+    latest_submission = db.relationship("Submission", foreign_keys=[latest_submission_id])
+    best_submission = db.relationship("Submission", foreign_keys=[best_submission_id])
+
+    # The columns compared by `check_summaries`
+    FIELDS = ('submission_count', 'latest_submission_id', 'latest_submitted_at',
+              'best_submission_id', 'best_score')
+
+    @staticmethod
+    def ensure_summaries(pairs):
+        """ Make sure there are summary rows for some (user, assignment) pairs, so that
+        later changes to them are plain UPDATEs. Missing rows are inserted and committed
+        right away; a row inserted by someone else in the meantime is left alone.
+
+        :param iterable[(int, int)] pairs: The user ids and assignment ids
+        """
+        pairs = set(pairs)
+        existing = set(SubmissionSummary.get_submission_counts(pairs))
+        missing = [{'user_id': user_id, 'assignment_id': assignment_id, 'submission_count': 0}
+                   for user_id, assignment_id in sorted(pairs - existing)]
+        if not missing:
+            return
+        table = SubmissionSummary.__table__
+        try:
+            db.session.execute(table.insert(), missing)
+            db.session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            # Someone else inserted some of them, so insert the rest one at a time
+            db.session.rollback()
+            for row in missing:
+                try:
+                    db.session.execute(table.insert(), row)
+                    db.session.commit()
+                except sqlalchemy.exc.IntegrityError:
+                    db.session.rollback()
+
+    @staticmethod
+    def get_submission_counts(pairs):
+        """ Look up how many submissions users have made to assignments.
+
+        :param iterable[(int, int)] pairs: The user ids and assignment ids
+        :return: The submission count of each pair which has a summary
+        :rtype: dict[(int, int), int]
+        """
+        pairs = set(pairs)
+        counts = {}
+        # Each pair may add a user id and an assignment id to the query
+        for chunk in chunked(sorted(pairs), MAX_IN_CLAUSE // 2):
+            rows = (db.session.query(SubmissionSummary.user_id,
+                                     SubmissionSummary.assignment_id,
+                                     SubmissionSummary.submission_count)
+                    .filter(SubmissionSummary.user_id.in_({user_id for user_id, _ in chunk}),
+                            SubmissionSummary.assignment_id.in_(
+                                {assignment_id for _, assignment_id in chunk})))
+            counts.update(((user_id, assignment_id), count)
+                          for user_id, assignment_id, count in rows
+                          if (user_id, assignment_id) in pairs)
+        return counts
+
+    @staticmethod
+    def reserve_submission(user_id, assignment):
+        """ Count a submission a user is about to make, in the current transaction,
+        unless they have already used up the assignment's `max_submissions`. The
+        check and the increment are a single conditional UPDATE of the summary row,
+        so concurrent submissions cannot both take the last one. The summary row
+        must already exist; see `ensure_summaries`.
+
+        :param int user_id: The id of the user
+        :param Assignment assignment: The assignment
+        :return: Whether the submission was counted
+        :rtype: bool
+        """
+        table = SubmissionSummary.__table__
+        statement = (table.update()
+                     .where(table.c.user_id == user_id)
+                     .where(table.c.assignment_id == assignment.id)
+                     .values(submission_count=table.c.submission_count + 1))
+        if assignment.limits_submissions():
+            statement = statement.where(table.c.submission_count < assignment.max_submissions)
+        return db.session.execute(statement).rowcount == 1
+
+    @staticmethod
+    def release_submission(user_id, assignment_id):
+        """ Uncount a submission reserved with `reserve_submission` which was never made,
+        and commit.
+
+        :param int user_id: The id of the user
+        :param int assignment_id: The id of the assignment
+        """
+        table = SubmissionSummary.__table__
+        db.session.execute(table.update()
+                           .where(table.c.user_id == user_id)
+                           .where(table.c.assignment_id == assignment_id)
+                           .where(table.c.submission_count > 0)
+                           .values(submission_count=table.c.submission_count - 1))
+        db.session.commit()
+
+    @staticmethod
+    def record_submissions(submissions, reserved=False):
+        """ Count new submissions in their summaries, in the current transaction. The
+        summary rows must already exist; see `ensure_summaries`.
+
+        :param list[Submission] submissions: The submissions, which have been flushed
+        :param bool reserved: Whether the submissions were already counted by
+            `reserve_submission`, so only their latest submission needs updating
+        """
+        by_pair = collections.OrderedDict()
+        for submission in submissions:
+            by_pair.setdefault((submission.user_id, submission.assignment_id),
+                               []).append(submission)
+
+        table = SubmissionSummary.__table__
+        is_later = sqlalchemy.or_(table.c.latest_submission_id.is_(None),
+                                  table.c.latest_submission_id < sqlalchemy.bindparam('latest_id'))
+        statement = (table.update()
+                     .where(table.c.user_id == sqlalchemy.bindparam('pair_user_id'))
+                     .where(table.c.assignment_id == sqlalchemy.bindparam('pair_assignment_id'))
+                     .values(submission_count=table.c.submission_count +
+                             sqlalchemy.bindparam('added'),
+                             latest_submission_id=sqlalchemy.case(
+                                 [(is_later, sqlalchemy.bindparam('latest_id'))],
+                                 else_=table.c.latest_submission_id),
+                             latest_submitted_at=sqlalchemy.case(
+                                 [(is_later, sqlalchemy.bindparam(
+                                     'latest_at', type_=table.c.latest_submitted_at.type))],
+                                 else_=table.c.latest_submitted_at)))
+        rows = []
+        for (user_id, assignment_id), added in by_pair.items():
+            latest = max(added, key=lambda submission: submission.id)
+            rows.append({'pair_user_id': user_id, 'pair_assignment_id': assignment_id,
+                         'added': 0 if reserved else len(added), 'latest_id': latest.id,
+                         'latest_at': latest.submitted_at})
+        if rows:
+            db.session.execute(statement, rows)
+
+    @staticmethod
+    def record_results(entries):
+        """ Consider newly posted results for the best submission of their summaries, in
+        the current transaction.
+
+        :param list[(int, dict)] entries: The id of each submission and its results
+        """
+        table = SubmissionSummary.__table__
+        submissions = Submission.__table__
+        submission_id = sqlalchemy.bindparam('submission_id')
+        score = sqlalchemy.bindparam('score', type_=table.c.best_score.type)
+        of_submission = (lambda column: sqlalchemy.select([column])
+                         .where(submissions.c.id == submission_id).as_scalar())
+        statement = (table.update()
+                     .where(table.c.user_id == of_submission(submissions.c.user_id))
+                     .where(table.c.assignment_id == of_submission(submissions.c.assignment_id))
+                     .where(sqlalchemy.or_(table.c.best_score.is_(None),
+                                           table.c.best_score < score,
+                                           sqlalchemy.and_(table.c.best_score == score,
+                                                           table.c.best_submission_id <
+                                                           submission_id)))
+                     .values(best_submission_id=submission_id, best_score=score))
+        rows = []
+        for entry_id, results in entries:
+            total = SubmissionResult.total_score(results)
+            if total is not None:
+                rows.append({'submission_id': entry_id, 'score': total})
+        if rows:
+            db.session.execute(statement, rows)
+
+    @staticmethod
+    def compute_summaries():
+        """ Work out what every summary should hold from the submissions and their
+        test case rows.
+
+        :return: The fields of each summary, by (user id, assignment id)
+        :rtype: dict[(int, int), dict]
+        """
+        summaries = {}
+        counts = (db.session.query(Submission.user_id, Submission.assignment_id,
+                                   sqlalchemy.func.count().label('submission_count'),
+                                   sqlalchemy.func.max(Submission.id).label('latest_id'))
+                  .group_by(Submission.user_id, Submission.assignment_id)
+                  .subquery())
+        rows = (db.session.query(counts, Submission.submitted_at)
+                .join(Submission, Submission.id == counts.c.latest_id))
+        for user_id, assignment_id, count, latest_id, latest_at in rows:
+            summaries[(user_id, assignment_id)] = {
+                'submission_count': count, 'latest_submission_id': latest_id,
+                'latest_submitted_at': latest_at, 'best_submission_id': None, 'best_score': None}
+
+        totals = (db.session.query(Submission.user_id, Submission.assignment_id, Submission.id,
+                                   sqlalchemy.func.sum(SubmissionResult.score))
+                  .join(SubmissionResult, SubmissionResult.submission_id == Submission.id)
+                  .group_by(Submission.id, Submission.user_id, Submission.assignment_id))
+        for user_id, assignment_id, submission_id, total in totals:
+            summary = summaries[(user_id, assignment_id)]
+            if total is not None and (summary['best_score'] is None or
+                                      (total, submission_id) > (summary['best_score'],
+                                                                summary['best_submission_id'])):
+                summary['best_score'] = total
+                summary['best_submission_id'] = submission_id
+        return summaries
+
+    @staticmethod
+    def rebuild_summaries():
+        """ Replace every summary with one computed from scratch.
+
+        :return: The number of summaries
+        :rtype: int
+        """
+        summaries = SubmissionSummary.compute_summaries()
+        db.session.query(SubmissionSummary).delete(synchronize_session=False)
+        rows = [dict(fields, user_id=user_id, assignment_id=assignment_id)
+                for (user_id, assignment_id), fields in summaries.items()]
+        if rows:
+            db.session.execute(SubmissionSummary.__table__.insert(), rows)
+        db.session.commit()
+        return len(rows)
+
+    @staticmethod
+    def check_summaries():
+        """ Compare every summary with one computed from scratch.
+
+        :return: The user id, assignment id, field, expected value and actual value of
+            each discrepancy. A missing or extra summary is reported with a field of None.
+        :rtype: list[(int, int, str|None, object, object)]
+        """
+        expected = SubmissionSummary.compute_summaries()
+        problems = []
+        for summary in db.session.query(SubmissionSummary):
+            pair = (summary.user_id, summary.assignment_id)
+            fields = expected.pop(pair, None)
+            if fields is None:
+                if summary.submission_count:
+                    problems.append(pair + (None, None, summary.submission_count))
+                continue
+            for field in SubmissionSummary.FIELDS:
+                if fields[field] != getattr(summary, field):
+                    problems.append(pair + (field, fields[field], getattr(summary, field)))
+        for pair, fields in sorted(expected.items()):
+            problems.append(pair + (None, fields['submission_count'], None))
+        return problems
+
+
+class RateLimitBucket(db.Model):
+    """ A token bucket shared by every process admitting submissions. See `ratelimit`. """
+
+    __tablename__ = 'rate_limit_buckets'
+
+    key = db.Column(db.String(64), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+    @staticmethod
+    def take(key, rate, burst, now):
+        """ Take a token from a bucket, creating it full if it doesn't exist. Refilling
+        the bucket and taking the token are a single conditional UPDATE, so concurrent
+        processes can't both take the last token.
+
+        :param str key: The bucket's key
+        :param float rate: How many tokens the bucket gains a second
+        :param float burst: The most tokens the bucket holds
+        :param float now: The current time in seconds since the epoch
+        :return: Whether a token was taken, and if not, the tokens in the bucket now
+        :rtype: (bool, float)
+        """
+        table = RateLimitBucket.__table__
+        now = sqlalchemy.literal(now, type_=db.Float)
+        # Time never runs backwards, even if another process's clock is ahead of ours
+        elapsed = sqlalchemy.case([(table.c.updated_at < now, now - table.c.updated_at)],
+                                  else_=0)
+        refilled = table.c.tokens + elapsed * rate
+        tokens = sqlalchemy.case([(refilled > burst, burst)], else_=refilled)
+        statement = (table.update()
+                     .where(table.c.key == key)
+                     .where(tokens >= 1)
+                     .values(tokens=tokens - 1, updated_at=sqlalchemy.case(
+                         [(table.c.updated_at < now, now)], else_=table.c.updated_at)))
+        while True:
+            if db.session.execute(statement).rowcount == 1:
+                db.session.commit()
+                return True, None
+            remaining = (db.session.query(tokens.label('tokens'))
+                         .filter(table.c.key == key)
+                         .scalar())
+            if remaining is not None:
+                db.session.rollback()
+                return False, remaining
+            try:
+                db.session.execute(table.insert(), {'key': key, 'tokens': burst - 1,
+                                                    'updated_at': now.value})
+                db.session.commit()
+                return True, None
+            except sqlalchemy.exc.IntegrityError:
+                # Someone else created it in the meantime, so take from theirs
+                db.session.rollback()
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SubmissionLimitError(ValueError):
+    """ Raised when a user has used up their submissions to an assignment """
+    pass
+
+
+class DuplicateKeysWarning(UserWarning):
+    """ Warned when a unique index cannot be created because of existing duplicates """
+    pass
+
+
+class SubmissionInfo(collections.namedtuple('SubmissionInfo',
+                                            ['id', 'submission_key', 'token_hash', 'archive',
+                                             'archive_digest', 'submitted_at', 'priority',
+                                             'unit_id'])):
+    """ The fields of a submission which never change once it is created """
+
+    def check_token(self, token):
+        """ Check the token a worker presented against this submission.
+
+        :param str token: The token to check
+        :return: Whether the token is correct
+        :rtype: bool
+        """
+        if self.token_hash.startswith(TOKEN_HASH_METHOD + '$'):
+            return check_token_hash(self.token_hash, token)
+        # Let the full model upgrade the legacy hash
+        return Submission.query.get(self.id).check_token(token)
+
+    def post_results(self, results):
+        """ Post the results of grading this submission with a single UPDATE, without
+        loading the submission.
+
+        :param dict results: The results
+        """
+        Submission.store_results([(self, results)])
+
+
+def find_duplicate_keys(index, limit=5):
+    """ Find values which appear more than once in the columns of an index.
+
+    :param sqlalchemy.Index index: The index
+    :param int limit: The most duplicated values to return
+    :return: The duplicated values and how many rows have each
+    :rtype: list[(tuple, int)]
+    """
+    columns = list(index.columns)
+    count = sqlalchemy.func.count()
+    rows = db.engine.execute(
+        sqlalchemy.select(columns + [count])
+        .group_by(*columns)
+        .having(count > 1)
+        .limit(limit))
+    return [(tuple(row)[:-1], tuple(row)[-1]) for row in rows]
+
+
+def create_indexes():
+    """ Create the indexes declared on the models which are missing from tables
+    that already exist. `db.create_all` only creates indexes alongside new tables.
+
+    A unique index is skipped with a `DuplicateKeysWarning` if the table already
+    holds duplicates, rather than failing partway through. Once the duplicates are
+    removed, running this again creates it.
+
+    :return: The names of the indexes that were created
+    :rtype: list[str]
+    """
+    inspector = sqlalchemy.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.unique:
+                duplicates = find_duplicate_keys(index)
+                if duplicates:
+                    warnings.warn("Not creating unique index {} because {} has duplicates: {}"
+                                  .format(index.name, table.name,
+                                          ', '.join('{} ({} rows)'.format(values, rows)
+                                                    for values, rows in duplicates)),
+                                  DuplicateKeysWarning)
+                    continue
+            index.create(db.engine)
+            created.append(index.name)
+    return created
+
+
+def create_columns():
+    """ Add the nullable columns declared on the models which are missing from tables
+    that already exist. `db.create_all` never alters an existing table.
+
+    :return: The names of the columns that were added, as table.column
+    :rtype: list[str]
+    """
+    inspector = sqlalchemy.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                db.engine.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, column.name, column_type))
+                created.append('{}.{}'.format(table.name, column.name))
+    return created
+
+
+def migrate_archives():
+    """ Move archives stored by submission key into the content-addressed store and
+    record their digests.
+
+    :return: The number of archives moved
+    :rtype: int
+    """
+    moved = 0
+    keys = db.session.query(Submission.id, Submission.submission_key).all()
+    for submission_id, submission_key in keys:
+        legacy = storage.legacy_archive_path(submission_key)
+        if not os.path.isfile(legacy):
+            continue
+        archive_digest = storage.push_archive(legacy)
+        (db.session.query(Submission)
+         .filter(Submission.id == submission_id)
+         .update({'archive_digest': archive_digest}, synchronize_session=False))
+        db.session.commit()
+        os.unlink(legacy)
+        _submission_cache.pop(submission_key)
+        moved += 1
+    return moved
+
+
+def results_column_is_text():
+    """ Whether the submissions' results column is still the text column results
+    were stored in before they were compressed. Compressed results can't be written
+    to it on PostgreSQL; SQLite happily keeps binary values in a text column.
+
+    :rtype: bool
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    table = Submission.__table__
+    columns = sqlalchemy.inspect(db.engine).get_columns(table.name)
+    return any(column['name'] == 'results' and isinstance(column['type'], sqlalchemy.String)
+               for column in columns)
+
+
+def convert_results_column():
+    """ Change the submissions' results column from text to bytea if it still is
+    text. Existing JSON results are kept as their UTF-8 bytes, which
+    `decode_results` reads.
+
+    :return: Whether the column was changed
+    :rtype: bool
+    """
+    if not results_column_is_text():
+        return False
+    db.engine.execute("ALTER TABLE {} ALTER COLUMN results TYPE bytea "
+                      "USING convert_to(results, 'UTF8')".format(Submission.__tablename__))
+    return True
+
+
+def migrate_results(batch_size=1000):
+    """ Compress results stored as plain JSON before `encode_results` existed. On
+    PostgreSQL, the column is first changed from text to bytea.
+
+    :param int batch_size: How many rows to convert per transaction
+    :return: The number of rows converted
+    :rtype: int
+    """
+    table = Submission.__table__
+    convert_results_column()
+
+    statement = (table.update()
+                 .where(table.c.id == sqlalchemy.bindparam('submission_id'))
+                 .values(results=sqlalchemy.bindparam('new_results', type_=table.c.results.type)))
+    converted = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            sqlalchemy.select([table.c.id, table.c.results])
+            .where(table.c.id > last_id)
+            .where(table.c.results.isnot(None))
+            .order_by(table.c.id)
+            .limit(batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        legacy = [{'submission_id': submission_id,
+                   'new_results': encode_results(decode_results(encoded))}
+                  for submission_id, encoded in rows if encoded[:1] != RESULTS_FORMAT]
+        if legacy:
+            db.session.execute(statement, legacy)
+            db.session.commit()
+            converted += len(legacy)
+    return converted
+
+
+def backfill_submission_results(batch_size=1000):
+    """ Fill in the test case rows of submissions graded before `SubmissionResult`
+    existed, i.e., those with results but no test case rows.
+
+    :param int batch_size: How many submissions to fill in per transaction
+    :return: The number of submissions whose results were read
+    :rtype: int
+    """
+    filled = 0
+    last_id = 0
+    while True:
+        has_rows = (db.session.query(SubmissionResult.id)
+                    .filter(SubmissionResult.submission_id == Submission.id)
+                    .exists())
+        submissions = (db.session.query(Submission)
+                       .filter(Submission.id > last_id,
+                               Submission.results_at.isnot(None),
+                               ~has_rows)
+                       .order_by(Submission.id)
+                       .limit(batch_size)
+                       .all())
+        if not submissions:
+            break
+        last_id = submissions[-1].id
+        SubmissionResult.replace_results([(submission.id, submission.results)
+                                          for submission in submissions])
         db.session.commit()
+        filled += len(submissions)
+    return filled
 
 
 def create_all():
+    existing_tables = sqlalchemy.inspect(db.engine).get_table_names()
+    had_summaries = SubmissionSummary.__tablename__ in existing_tables
     db.create_all()
+    create_columns()
+    # Tables made before results were compressed hold them in a text column
+    convert_results_column()
+    create_indexes()
+    if not had_summaries:
+        # Summaries are only maintained incrementally, so start them off from any
+        # submissions made before the table existed
+        SubmissionSummary.rebuild_summaries()
 
 
 def drop_all():
@@ -0,0 +1,221 @@
+"""
+A cache of extracted project payloads for the local backend. Each payload is
+unzipped once into a directory named by its digest, and its files are made
+read-only. A grading task gets its own directory in which every file of the
+payload is a hard link into the cache, so setting a task up costs a link per file
+rather than decompressing the whole payload. A grader may add files or replace
+them, but must not change a payload file in place.
+
+When the extracted payloads take more than the configured budget of disk, those
+used least recently are removed. The pool's processes share the cache through the
+filesystem, with a lock file per payload so that none is extracted twice at once
+or removed while it is being linked.
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+import contextlib
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import stat
+import threading
+import uuid
+import zipfile
+
+from .config import get_config
+from . import storage
+
+
+logger = logging.getLogger(__name__)
+
+# The digests of the payload files this process has seen, by (path, size, mtime)
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def get_cache():
+    """ Return the configured payload cache.
+
+    :return: The cache or None if payloads are extracted afresh for every task
+    :rtype: PayloadCache|None
+    """
+    local_config = get_config().local_config
+    cache_config = local_config.payload_cache
+    if not cache_config.enabled:
+        return None
+    directory = cache_config.directory or os.path.join(local_config.payload_directory,
+                                                       'extracted')
+    return PayloadCache(directory, cache_config.max_mb * 1024 * 1024)
+
+
+def payload_digest(payload):
+    """ Return the digest of a payload file, only hashing it again if it has changed.
+
+    :param str payload: The path to the payload
+    :rtype: str
+    """
+    info = os.stat(payload)
+    key = (payload, info.st_size, info.st_mtime)
+    with _digests_lock:
+        digest = _digests.get(key)
+    if digest is None:
+        digest = storage.file_digest(payload)
+        with _digests_lock:
+            _digests[key] = digest
+    return digest
+
+
+def _tree_size(directory):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(directory) for name in names)
+
+
+def link_tree(source, destination):
+    """ Recreate the directories of `source` in `destination` and hard link its files
+    there, copying them instead if they can't be linked.
+
+    :param str source: The directory to link from
+    :param str destination: An existing directory to link into
+    """
+    for root, directories, names in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(root, source))
+        for directory in directories:
+            os.mkdir(os.path.join(target, directory))
+        for name in names:
+            try:
+                os.link(os.path.join(root, name), os.path.join(target, name))
+            except OSError:
+                shutil.copy2(os.path.join(root, name), os.path.join(target, name))
+
+
+class PayloadCache(object):
+    """ Extracted payloads under `directory`, taking at most `max_bytes` of disk.
+    Payloads live in its `payloads` directory and grading tasks are given
+    directories in its `tasks` directory, so that both are on one filesystem. """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @property
+    def payload_directory(self):
+        return os.path.join(self.directory, 'payloads')
+
+    @property
+    def task_directory(self):
+        return os.path.join(self.directory, 'tasks')
+
+    def _entry(self, digest):
+        return os.path.join(self.payload_directory, digest)
+
+    @contextlib.contextmanager
+    def _locked(self, digest, operation):
+        with open(self._entry(digest) + '.lock', 'a') as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def setup(self):
+        """ Create the cache's directories if they don't exist. """
+        for directory in (self.payload_directory, self.task_directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def checkout(self, payload, workdir):
+        """ Put a payload's files into a task's directory, extracting the payload into
+        the cache first if it isn't there.
+
+        :param str payload: The path to the payload
+        :param str workdir: The task's directory, which should be in `task_directory`
+        :return: The payload's digest
+        :rtype: str
+        """
+        self.setup()
+        digest = payload_digest(payload)
+        entry = self._entry(digest)
+        with self._locked(digest, fcntl.LOCK_SH):
+            if os.path.isdir(entry):
+                os.utime(entry, None)
+                link_tree(entry, workdir)
+                return digest
+
+        with self._locked(digest, fcntl.LOCK_EX):
+            if not os.path.isdir(entry):
+                self._extract(payload, entry)
+            link_tree(entry, workdir)
+        self.evict(keep=digest)
+        return digest
+
+    def _extract(self, payload, entry):
+        extracting = '{}.extracting-{}'.format(entry, uuid.uuid4().hex)
+        with zipfile.ZipFile(payload) as zf:
+            zf.extractall(extracting)
+        for root, _, names in os.walk(extracting):
+            for name in names:
+                path = os.path.join(root, name)
+                mode = os.stat(path).st_mode
+                os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+        with open(entry + '.size', 'w') as f:
+            f.write(str(_tree_size(extracting)))
+        os.rename(extracting, entry)
+
+    def entries(self):
+        """ List the extracted payloads, least recently used first.
+
+        :return: The digest and size in bytes of each payload
+        :rtype: list[(str, int)]
+        """
+        entries = []
+        for name in os.listdir(self.payload_directory):
+            entry = self._entry(name)
+            if '.' in name or not os.path.isdir(entry):
+                continue
+            try:
+                with open(entry + '.size') as f:
+                    size = int(f.read())
+                used_at = os.stat(entry).st_mtime
+            except (IOError, OSError, ValueError):
+                continue
+            entries.append((used_at, name, size))
+        return [(digest, entry_size) for _, digest, entry_size in sorted(entries)]
+
+    def evict(self, keep=None):
+        """ Remove the least recently used payloads until the rest fit in the budget.
+        Payloads being linked by another task are skipped.
+
+        :param str|None keep: The digest of a payload not to remove
+        :return: The digests removed
+        :rtype: list[str]
+        """
+        entries = self.entries()
+        total = sum(size for _, size in entries)
+        evicted = []
+        for digest, size in entries:
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            try:
+                with self._locked(digest, fcntl.LOCK_EX | fcntl.LOCK_NB):
+                    self._remove(digest)
+            except (IOError, OSError) as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    logger.exception("Could not remove extracted payload %s", digest)
+                continue
+            total -= size
+            evicted.append(digest)
+        return evicted
+
+    def _remove(self, digest):
+        entry = self._entry(digest)
+        removing = '{}.removing-{}'.format(entry, uuid.uuid4().hex)
+        os.rename(entry, removing)
+        os.unlink(entry + '.size')
+        shutil.rmtree(removing)
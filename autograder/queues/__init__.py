@@ -0,0 +1,57 @@
+"""
+Queuing backends grade submissions. Each backend is a module providing
+
+* `make_worker(payload, executable, project_key=None)`, which sets up the
+  payload a project is graded with and returns the project's key;
+* `submit_code(user, project, code)`, which stores code and queues it;
+* `submit_many(project, submissions)`, which queues submissions that already
+  exist; and
+* `poll(timeout=None)`, which waits for grading queued by this process to
+  finish and returns whether it has; and
+* `get_task_statuses(project, submissions)`, which returns whether the task of
+  each submission is still `ACTIVE` with the backend or has been `LOST`.
+
+The backend is chosen by the `queue_backend` config key and is only imported
+when it is first asked for, so nobody pays to import a backend they don't use.
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+import importlib
+
+from ..config import get_config
+
+
+# What `get_task_statuses` says of a task which is queued or running
+ACTIVE = 'active'
+# ... and of a task which finished, failed or was never known, without results
+LOST = 'lost'
+
+# The modules implementing each backend, by name
+BACKENDS = {
+    'local': 'autograder.queues.local',
+    'iron': 'autograder.queues.iron',
+}
+
+
+def register_backend(name, module_name):
+    """ Make a backend available to `get_queue`.
+
+    :param str name: The name used for the backend in the config
+    :param str module_name: The module implementing the backend
+    """
+    BACKENDS[name] = module_name
+
+
+def get_queue(name=None):
+    """ Return the module of a queuing backend, importing it if necessary.
+
+    :param str|None name: The name of the backend. Defaults to the configured one.
+    :return: The backend
+    :rtype: module
+    :raises ValueError: If there is no such backend
+    """
+    name = name or get_config().queue_backend
+    if name not in BACKENDS:
+        raise ValueError("Unknown queue backend {}; expected one of {}".format(
+            name, ', '.join(sorted(BACKENDS))))
+    return importlib.import_module(BACKENDS[name])
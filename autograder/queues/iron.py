@@ -3,35 +3,79 @@ Queuing functions for the IronWorker framework from iron.io.
 
 @author Kevin Wilson - khwilson@gmail.com
 """
+import calendar
+import logging
 import os
 import shutil
 import subprocess
+import time
 import uuid
 
+import iron_core
 from iron_worker import IronWorker, Task
+import requests
+from requests.packages.urllib3.exceptions import ConnectTimeoutError
 
-from ..utils import NamedTemporaryDirectory
-from .. import models, storage
+from ..config import get_config
+from ..utils import NamedTemporaryDirectory, chunked
+from .. import models, result_cache, scheduling, storage
+from . import ACTIVE, LOST
 
 
+logger = logging.getLogger(__name__)
+
 # Max timeout for now
 TIMEOUT = 60
 
+# The most tasks sent to iron.io in a single request
+MAX_BATCH_SIZE = 100
+
+# How many times a failed batch is retried, and how long to wait before the first retry
+RETRIES = 5
+RETRY_DELAY = 0.5
+
+# Responses which mean iron.io did not accept a batch, so it is safe to send again
+RETRY_STATUSES = (429, 503, 504)
+
+# The iron.io image projects are graded in unless another is asked for
+DEFAULT_PROJECT_TYPE = 'python-2.7'
+
+_worker = None
 
-def make_worker(directory, executable, project_type, project_key):
+
+def make_worker(payload, executable, project_key=None, project_type=DEFAULT_PROJECT_TYPE):
     """
     Makes an iron.io worker and uploads it to the central repo.
 
-    :param str directory: A dirctory which contains all the worker's dependencies
+    :param str payload: A zip file or a directory which contains all the worker's
+        dependencies
     :param str executable: The shell string which will be executed by the worker
+    :param str|None project_key: The unique identifier of the project to be used on
+        iron.io. If the project already exists, the digest of its new payload is recorded
+        and results graded with its old payload are forgotten. If not set, a new
+        key is made.
     :param str project_type: A valid iron.io image type
-    :param str project_key: The unique identifier of the project to be used on iron.io
+    :return: The key of the project
+    :rtype: str
     :raises subprocess.CalledProcessError: If something goes wrong uploading the image
     """
+    if project_key:
+        result_cache.invalidate(project_key)
+    else:
+        project_key = str(uuid.uuid4())
     with NamedTemporaryDirectory() as tmpdir:
-        archive = shutil.make_archive(directory, 'zip', os.path.join(tmpdir, 'data'))
+        if os.path.isdir(payload):
+            archive = shutil.make_archive(os.path.join(tmpdir, 'data'), 'zip', payload)
+        else:
+            archive = payload
         subprocess.check_call(['iron', 'worker', 'upload', '--zip', archive,
                                '--name', project_key, 'iron/images:' + project_type, executable])
+        payload_digest = storage.file_digest(archive)
+
+    project = models.Project.get_project_by_key(project_key)
+    if project:
+        project.update_payload(payload_digest)
+    return project_key
 
 
 def submit_code(user, project, code):
@@ -39,29 +83,178 @@ def submit_code(user, project, code):
 
     :param models.User user: The user
     :param models.Project project: The project
-    :param str code: The code to submit. If the file is a directory, then zips it up and
-        submits it. If the file is a regular file, submits as is.
+    :param str|file code: The code to submit. See `storage.push_code` for what may
+        be passed.
+    :return: The created submission. Its results are posted by the worker.
+    :rtype: models.Submission
+    :raises ValueError: If the user has not been assigned the project or the code
+        is not a valid archive
+    :raises models.SubmissionLimitError: If the user has no submissions left
     """
-    with NamedTemporaryDirectory() as tmpdir:
-        token = uuid.uuid4()
-        submission = models.Submission(user.id, project.id, token)
-        archive_name = os.path.join(tmpdir, submission.submission_key)
-        if os.path.isdir(code):
-            archive = shutil.make_archive(code, 'zip', archive_name)
-        elif code.endswith('.zip'):
-            archive = code
-        else:
-            shutil.copy(code, tmpdir)
-            archive = shutil.make_archive(tmpdir, 'zip', archive_name)
+    assignment = models.Assignment.get_assignment_for_user(user, project)
+    if not assignment:
+        raise ValueError("User {} has not been assigned project {}".format(
+            user.username, project.name))
+
+    # Turn away users with no submissions left before storing anything
+    models.Submission.reserve_submission(user, assignment)
+    try:
+        archive_digest = storage.push_code(code)
+    except Exception:
+        models.SubmissionSummary.release_submission(user.id, assignment.id)
+        raise
+    submission, token = models.Submission.add_submission(user, assignment,
+                                                         archive_digest=archive_digest,
+                                                         payload_digest=project.payload_digest,
+                                                         reserved=True)
+    submit_many(project, [(submission, token)])
+    return submission
+
+
+def poll(timeout=None):
+    """ Tasks are graded on iron.io and their results are posted back to the web app
+    by the workers, so there is never anything for this process to wait for.
+
+    :param float|None timeout: Ignored
+    :return: True
+    :rtype: bool
+    """
+    return True
+
+
+def submit_many(project, submissions):
+    """ Queue submissions which have already been created as iron.io tasks, at the
+    priority `scheduling.prioritize` gives them.
+
+    :param models.Project project: The project the submissions are for
+    :param list[(models.Submission, str)] submissions: The submissions and their tokens
+    :return: The ids of the queued tasks
+    :rtype: list[str]
+    """
+    submissions = [(submission, token) for submission, token in submissions
+                   if not result_cache.post_cached_results(project, submission)]
+    payloads = [(submission.id, {'submission_key': submission.submission_key, 'token': token})
+                for submission, token in submissions]
+    schedule = scheduling.prioritize([submission for submission, _ in submissions])
+    project_key = project.project_key
+    tasks = []
+    for submission_id, payload in payloads:
+        priority, _ = schedule[submission_id]
+        tasks.append(Task(code_name=project_key, payload=payload, timeout=TIMEOUT,
+                          priority=priority))
+    task_ids = queue_many(tasks)
+    submission_ids = [submission_id for submission_id, payload in payloads]
+    models.Submission.record_task_ids(list(zip(submission_ids, task_ids)))
+    return task_ids
+
+
+def get_task_statuses(project, submissions):
+    """ Ask iron.io which of the submissions' tasks are queued or running. Rather than
+    asking after each task, the project's active tasks created since the oldest of the
+    submissions are listed, `MAX_BATCH_SIZE` at a time.
+
+    :param models.Project project: The project the submissions are for
+    :param list[models.Submission] submissions: The submissions
+    :return: `queues.ACTIVE` or `queues.LOST` for each submission, by id
+    :rtype: dict[int, str]
+    """
+    if not submissions:
+        return {}
+    oldest = min(submission.submitted_at for submission in submissions)
+    worker = get_worker()
+    active = set()
+    page = 0
+    while True:
+        tasks = worker.tasks(code_name=project.project_key, queued=1, running=1,
+                             from_time=calendar.timegm(oldest.utctimetuple()),
+                             per_page=MAX_BATCH_SIZE, page=page)
+        active.update(task.id for task in tasks)
+        if len(tasks) < MAX_BATCH_SIZE:
+            break
+        page += 1
+    return {submission.id: ACTIVE if submission.task_id in active else LOST
+            for submission in submissions}
+
+
+class PooledIronClient(iron_core.IronClient):
+    """ An IronClient which sends all of its requests over one keep-alive session
+    rather than opening a new connection per request """
+
+    def __init__(self, *args, **kwargs):
+        iron_core.IronClient.__init__(self, *args, **kwargs)
+        self.session = requests.Session()
+
+    def _doRequest(self, url, method, body="", headers={}):
+        headers = dict(headers)
+        if self.token or self.keystone:
+            headers["Authorization"] = "OAuth %s" % self.token_provider.getToken()
+        return self.session.request(method, url, data=body, headers=headers)
 
-        storage.push_archive(archive)
 
-    payload = {
-        'submission_key': submission.submission_key,
-        'token': token
-    }
+def get_worker():
+    """ Return the iron.io client, creating it if necessary. The client is shared so
+    that its connections are reused across calls.
 
-    worker = IronWorker()
-    task = Task(code_name=project.project_key, payload=payload, timeout=TIMEOUT)
-    response = worker.queue(task)
-    return response
+    :return: The client
+    :rtype: IronWorker
+    """
+    global _worker
+    if _worker is None:
+        iron_config = get_config().iron
+        kwargs = {key: getattr(iron_config, key)
+                  for key in ('project_id', 'token', 'host', 'port', 'protocol')
+                  if getattr(iron_config, key) is not None}
+        _worker = IronWorker(**kwargs)
+        _worker.client = PooledIronClient(name=IronWorker.NAME, version=IronWorker.VERSION,
+                                          product='iron_worker', **kwargs)
+    return _worker
+
+
+def _is_retryable(error):
+    """ Whether a failed request to queue tasks may be sent again. Only failures where
+    iron.io cannot have accepted the batch are retried, since otherwise the retry
+    could queue the whole batch a second time.
+
+    :param requests.RequestException error: The failure
+    :rtype: bool
+    """
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUSES
+    if isinstance(error, requests.ConnectionError):
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(error, requests.exceptions.ConnectTimeout) or \
+            isinstance(reason, ConnectTimeoutError)
+    return False
+
+
+def queue_many(tasks, batch_size=MAX_BATCH_SIZE):
+    """ Queue tasks on iron.io, sending up to `batch_size` tasks per request. A request
+    which could not connect or was turned away with one of `RETRY_STATUSES` is retried
+    with exponential backoff.
+
+    :param list[Task] tasks: The tasks to queue
+    :param int batch_size: The most tasks to send per request
+    :return: The ids of the queued tasks, in order
+    :rtype: list[str]
+    :raises requests.RequestException: If a batch still fails after `RETRIES` retries,
+        or is rejected outright by iron.io
+    """
+    worker = get_worker()
+    task_ids = []
+    for batch in chunked(tasks, min(batch_size, MAX_BATCH_SIZE)):
+        delay = RETRY_DELAY
+        for attempt in range(RETRIES + 1):
+            try:
+                queued = worker.queue(tasks=batch, retry=False)
+                break
+            except requests.RequestException as e:
+                if attempt == RETRIES or not _is_retryable(e):
+                    raise
+                logger.warning("Queuing a batch of %d tasks failed; retrying in %.1fs",
+                               len(batch), delay)
+                time.sleep(delay)
+                delay *= 2
+        if not isinstance(queued, list):
+            queued = [queued]
+        task_ids.extend(task.id for task in queued)
+    return task_ids
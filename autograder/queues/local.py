@@ -1,22 +1,414 @@
+"""
+Queuing functions which grade submissions on the local machine with a
+bounded pool of worker processes.
+
+In warm mode, the pool's processes import the configured `preload` modules when
+they start, and a project whose executable just runs a python script with one
+of the configured `interpreters` has it run in a child forked from the pool
+process rather than in a new interpreter. Each pool process is replaced after
+`max_tasks` tasks.
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+import errno
+import functools
+import importlib
+import json
+import logging
+import multiprocessing
 import os
+import shlex
 import shutil
+import socket
+import threading
+import time
 import uuid
+import zipfile
 
 from ..config import get_config
+from ..utils import NamedTemporaryDirectory
+from .. import models, payload_cache, result_cache, sandbox, scheduling, storage
+from . import ACTIVE, LOST
+
+
+logger = logging.getLogger(__name__)
+
+# The name the submitted archive is given inside the grading directory
+SUBMISSION_ARCHIVE = 'submission.zip'
+
+# The most characters of output from a grading run that are kept in the results
+MAX_OUTPUT = 4096
+
+# An executable containing any of these needs a shell, so is never run warm
+SHELL_CHARACTERS = frozenset('|&;<>()$`\\*?[]~#\n')
+
+_pool = None
+
+# Grading tasks wait in `_queue` until one of the pool's processes is free, so that
+# the scheduler rather than the pool decides what is graded next. `_running` counts
+# the tasks handed to the pool which haven't finished, and `_active` holds the ids of
+# the submissions either waiting or running. All are guarded by `_lock`.
+_queue = scheduling.TaskQueue()
+_running = 0
+_active = set()
+_lock = threading.Condition()
+
 
+def payload_path(project_key):
+    """ Return where the payload for a project lives.
 
-def make_worker(filename, executable):
+    :param str project_key: The key of the project
+    :return: The path to the project's payload
+    :rtype: str
+    """
+    config = get_config()
+    return os.path.join(config.local_config.payload_directory, '{}.zip'.format(project_key))
+
+
+def make_worker(filename, executable, project_key=None):
     """
     Given a path to a payload and an executable to invoke, setup a
     Project which uses this payload and executable.
 
     :param str filename: The file containing the payload
     :param str executable: The executable to invoke
+    :param str|None project_key: If set, replace the payload of this existing project,
+        record the new payload's digest and forget any results graded with its old payload
     :return: The key assigned to the project
     :rtype: str
     """
-    config = get_config()
-    project_key = uuid.uuid4()
-    shutil.copyfile(filename, os.path.join(config.local_config.payload_directory,
-                                           '{}.zip'.format(project_key)))
-    return str(project_key)
+    if project_key:
+        result_cache.invalidate(project_key)
+    else:
+        project_key = str(uuid.uuid4())
+    shutil.copyfile(filename, payload_path(project_key))
+
+    project = models.Project.get_project_by_key(project_key)
+    if project:
+        project.update_payload(storage.file_digest(filename))
+    return project_key
+
+
+def get_processes():
+    """ Return how many grading tasks are run at once.
+
+    :rtype: int
+    """
+    return get_config().local_config.processes or multiprocessing.cpu_count()
+
+
+def get_pool():
+    """ Return the pool grading tasks are run in, creating it if necessary.
+
+    :return: The pool
+    :rtype: multiprocessing.pool.Pool
+    """
+    global _pool
+    if _pool is None:
+        warm_config = get_config().local_config.warm
+        if warm_config.enabled:
+            _pool = multiprocessing.Pool(processes=get_processes(), initializer=warm_up,
+                                         initargs=(warm_config.preload,),
+                                         maxtasksperchild=warm_config.max_tasks)
+        else:
+            _pool = multiprocessing.Pool(processes=get_processes())
+    return _pool
+
+
+def warm_up(preload):
+    """ Import modules graders will use. This runs as each warm pool process starts.
+
+    :param list[str] preload: The names of the modules
+    """
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            logger.exception("Could not preload %s", module)
+
+
+def get_script(executable, interpreters):
+    """ If an executable just runs a python script, return the script and its arguments.
+
+    >>> get_script('python grader.py --verbose', ['python'])
+    ['grader.py', '--verbose']
+    >>> get_script('python grader.py > out.txt', ['python']) is None
+    True
+
+    :param str executable: The shell string a project executes
+    :param list[str] interpreters: The commands which run python scripts
+    :return: The script's argv or None if the executable needs a shell
+    :rtype: list[str]|None
+    """
+    if SHELL_CHARACTERS.intersection(executable):
+        return None
+    try:
+        argv = shlex.split(executable)
+    except ValueError:
+        return None
+    if len(argv) < 2 or argv[0] not in interpreters or argv[1].startswith('-'):
+        return None
+    return argv[1:]
+
+
+def join():
+    """ Wait for all queued grading tasks to finish and shut down the pool. """
+    global _pool
+    poll()
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+
+
+def poll(timeout=None):
+    """ Wait for the grading tasks queued by this process to finish and their results
+    to be posted. Unlike `join`, the pool is left running.
+
+    :param float|None timeout: The most seconds to wait. If None, wait until they finish.
+    :return: Whether every task has finished
+    :rtype: bool
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    with _lock:
+        while _running or _queue:
+            if deadline is None:
+                _lock.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                _lock.wait(remaining)
+        return True
+
+
+def _dispatch():
+    """ Hand the pool the next tasks from the queue while it has free processes. The
+    caller must hold `_lock`. """
+    global _running
+    processes = get_processes()
+    while _running < processes and _queue:
+        (submission_id, args), priority, unit_id, waited = _queue.take()
+        scheduling.wait_stats.record(priority, unit_id, waited)
+        _running += 1
+        get_pool().apply_async(grade, args,
+                               callback=functools.partial(_finished, submission_id, unit_id))
+
+
+def _finished(submission_id, unit_id, results):
+    """ Post the results of a task, then start the next one. This runs in the pool's
+    result handling thread. """
+    global _running
+    try:
+        _post_results(submission_id, results)
+    finally:
+        with _lock:
+            _running -= 1
+            _active.discard(submission_id)
+            _queue.done(unit_id)
+            _dispatch()
+            _lock.notify_all()
+
+
+def _make_results(run):
+    stdout = run.stdout.decode('utf-8', 'replace')
+    stderr = run.stderr.decode('utf-8', 'replace')
+    try:
+        results = json.loads(stdout)
+    except ValueError:
+        results = None
+
+    if not isinstance(results, dict):
+        results = {'stdout': stdout[-MAX_OUTPUT:]}
+    results['returncode'] = run.returncode
+    results['timed_out'] = run.timed_out
+    results['cpu_seconds'] = round(run.cpu_seconds, 3)
+    results['max_rss'] = run.max_rss
+    if run.exceeded:
+        results['limit_exceeded'] = run.exceeded
+    if run.returncode:
+        results['stderr'] = stderr[-MAX_OUTPUT:]
+    return results
+
+
+def grade(payload, executable, archive, timeout, limits=None, cgroup_root=None, cache=None,
+          interpreters=None):
+    """ Grade a submission. This is run inside of the pool's worker processes.
+
+    The payload is unpacked into a fresh directory (or linked there from `cache`,
+    extracting it only if it isn't already there), the submitted archive is
+    placed alongside it as `SUBMISSION_ARCHIVE` (its path is also exported as
+    `AUTOGRADER_SUBMISSION`) and the executable is run there, which is also its
+    HOME and TMPDIR, within `limits`. If the executable
+    writes a JSON object to stdout, that object becomes the results. Its test cases
+    may be reported as a `tests` list; see `models.SubmissionResult.parse_results`.
+    The CPU seconds and peak RSS in bytes the run used are added as `cpu_seconds`
+    and `max_rss`, and a limit it was stopped for as `limit_exceeded`.
+
+    :param str payload: The path to the project's payload
+    :param str executable: The shell string to execute
+    :param str archive: The path to the submitted archive
+    :param int timeout: The number of seconds after which the executable is killed
+    :param sandbox.Limits|None limits: The resources the executable may use
+    :param str|None cgroup_root: A cgroup v2 directory to run the executable in a
+        child cgroup of; see `sandbox.run`
+    :param payload_cache.PayloadCache|None cache: Where extracted payloads are kept
+    :param list[str]|None interpreters: If set, an executable which runs a python script
+        with one of these is run warm; see `get_script`
+    :return: The results of the grading run
+    :rtype: dict
+    """
+    try:
+        task_directory = None
+        if cache is not None:
+            cache.setup()
+            task_directory = cache.task_directory
+        with NamedTemporaryDirectory(dir=task_directory) as workdir:
+            if cache is not None:
+                cache.checkout(payload, workdir)
+            else:
+                with zipfile.ZipFile(payload) as zf:
+                    zf.extractall(workdir)
+            submission = os.path.join(workdir, SUBMISSION_ARCHIVE)
+            shutil.copyfile(archive, submission)
+
+            env = dict(os.environ, AUTOGRADER_SUBMISSION=submission, HOME=workdir,
+                       TMPDIR=workdir)
+            script = get_script(executable, interpreters) if interpreters else None
+            if script:
+                run = sandbox.run_script(script, workdir, env=env, timeout=timeout,
+                                         limits=limits, cgroup_root=cgroup_root)
+            else:
+                run = sandbox.run(executable, workdir, env=env, timeout=timeout,
+                                  limits=limits, cgroup_root=cgroup_root)
+        return _make_results(run)
+    except Exception as e:
+        return {'error': '{}: {}'.format(type(e).__name__, e)}
+
+
+def _post_results(submission_id, results):
+    try:
+        submission = models.Submission.query.get(submission_id)
+        submission.post_results(results)
+        result_cache.store(submission.assignment.project, submission, results)
+    except Exception:
+        logger.exception("Could not post results for submission %s", submission_id)
+    finally:
+        models.db.session.remove()
+
+
+def submit_code(user, project, code):
+    """ Submit code on behalf of a user on a particular project and grade it in the pool.
+
+    :param models.User user: The user
+    :param models.Project project: The project
+    :param str|file code: The code to submit. See `storage.push_code` for what may
+        be passed.
+    :return: The created submission. Its results are posted once grading finishes.
+    :rtype: models.Submission
+    :raises ValueError: If the user has not been assigned the project or the code
+        is not a valid archive
+    :raises models.SubmissionLimitError: If the user has no submissions left
+    """
+    assignment = models.Assignment.get_assignment_for_user(user, project)
+    if not assignment:
+        raise ValueError("User {} has not been assigned project {}".format(
+            user.username, project.name))
+
+    # Turn away users with no submissions left before storing anything
+    models.Submission.reserve_submission(user, assignment)
+    try:
+        archive_digest = storage.push_code(code)
+    except Exception:
+        models.SubmissionSummary.release_submission(user.id, assignment.id)
+        raise
+    submission, token = models.Submission.add_submission(user, assignment,
+                                                         archive_digest=archive_digest,
+                                                         payload_digest=project.payload_digest,
+                                                         reserved=True)
+    submit_many(project, [(submission, token)])
+    return submission
+
+
+def submit_many(project, submissions):
+    """ Queue submissions which have already been created for grading in the pool, in
+    the order `scheduling.TaskQueue` takes them.
+
+    :param models.Project project: The project the submissions are for
+    :param list[(models.Submission, str)] submissions: The submissions and their tokens
+    """
+    payload = payload_path(project.project_key)
+    local_config = get_config().local_config
+    limits = sandbox.get_limits(local_config.sandbox)
+    cache = payload_cache.get_cache()
+    interpreters = local_config.warm.interpreters if local_config.warm.enabled else None
+    submissions = [submission for submission, _ in submissions
+                   if not result_cache.post_cached_results(project, submission)]
+    tasks = [(submission.id, (payload, project.executable, submission.archive,
+                              local_config.timeout, limits, local_config.sandbox.cgroup_root,
+                              cache, interpreters))
+             for submission in submissions]
+    schedule = scheduling.prioritize(submissions)
+    owner = get_task_owner()
+    models.Submission.record_task_ids([(submission.id, owner) for submission in submissions])
+    with _lock:
+        for submission_id, args in tasks:
+            priority, unit_id = schedule[submission_id]
+            _queue.put((submission_id, args), priority, unit_id)
+            _active.add(submission_id)
+        _dispatch()
+
+
+def get_task_owner():
+    """ Return what the submissions queued by this process record as their task id.
+
+    :return: The host and pid of this process, as host:pid
+    :rtype: str
+    """
+    # Leave room for the pid in the 64 characters of `models.Submission.task_id`
+    return '{}:{}'.format(socket.gethostname()[:50], os.getpid())
+
+
+def _owner_alive(task_owner):
+    """ Say whether the process which queued a task may still be running it.
+
+    :param str|None task_owner: What `get_task_owner` returned in that process
+    :return: False if the task was never queued or its process has exited, and True
+        otherwise, including for processes on other hosts, which can't be checked
+    :rtype: bool
+    """
+    if not task_owner:
+        return False
+    host, _, pid = task_owner.rpartition(':')
+    if host != socket.gethostname()[:50]:
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    except ValueError:
+        return False
+    return True
+
+
+def get_task_statuses(project, submissions):
+    """ Say which submissions are still waiting or being graded. Tasks only live as
+    long as the process which queued them, so a task queued by this process is active
+    while this process holds it, and one queued by another process is active while
+    that process is running.
+
+    :param models.Project project: The project the submissions are for
+    :param list[models.Submission] submissions: The submissions
+    :return: `queues.ACTIVE` or `queues.LOST` for each submission, by id
+    :rtype: dict[int, str]
+    """
+    owner = get_task_owner()
+    statuses = {}
+    with _lock:
+        for submission in submissions:
+            if submission.task_id == owner:
+                active = submission.id in _active
+            else:
+                active = _owner_alive(submission.task_id)
+            statuses[submission.id] = ACTIVE if active else LOST
+    return statuses
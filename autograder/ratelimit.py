@@ -0,0 +1,164 @@
+"""
+Admission control for submissions. Each user and each project has a token bucket
+which refills at a steady rate up to a burst size. A submission takes a token from
+the user's bucket and then from the project's, and is turned away if either is
+empty, before any archive is stored or task queued.
+
+Buckets are kept in memory, which only limits submissions made through one
+process, or in the database, which every web process (and the CLI) shares.
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+import math
+import threading
+import time
+
+from .config import get_config
+from . import models
+
+
+# How often, in seconds, buckets kept in memory which have refilled are dropped
+SWEEP_INTERVAL = 60
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+class RateLimited(Exception):
+    """ Raised when a submission is turned away because a bucket is empty """
+
+    def __init__(self, message, retry_after):
+        """
+        :param str message: Why the submission was turned away
+        :param int retry_after: How many seconds until it would be admitted
+        """
+        super(RateLimited, self).__init__(message)
+        self.retry_after = retry_after
+
+
+def refill(tokens, updated_at, now, rate, burst):
+    """ Return how many tokens a bucket holds now.
+
+    :param float tokens: The tokens the bucket held when it was last updated
+    :param float updated_at: When it was last updated, in seconds since the epoch
+    :param float now: The current time in seconds since the epoch
+    :param float rate: How many tokens the bucket gains a second
+    :param float burst: The most tokens the bucket holds
+    :return: The tokens in the bucket
+    :rtype: float
+    """
+    return min(burst, tokens + max(0, now - updated_at) * rate)
+
+
+class MemoryBuckets(object):
+    """ Token buckets kept in this process. A bucket which has refilled is the same as
+    one never taken from, so those are dropped every `sweep_interval` seconds. """
+
+    def __init__(self, sweep_interval=SWEEP_INTERVAL):
+        """
+        :param float sweep_interval: How many seconds to wait between dropping full buckets
+        """
+        self.sweep_interval = sweep_interval
+        self._buckets = {}
+        self._swept_at = None
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """ Take a token from a bucket. See `models.RateLimitBucket.take`. """
+        with self._lock:
+            if self._swept_at is None or now - self._swept_at >= self.sweep_interval:
+                self._sweep(now)
+            tokens, updated_at, _, _ = self._buckets.get(key, (burst, now, rate, burst))
+            tokens = refill(tokens, updated_at, now, rate, burst)
+            if tokens < 1:
+                return False, tokens
+            self._buckets[key] = (tokens - 1, max(now, updated_at), rate, burst)
+            return True, None
+
+    def _sweep(self, now):
+        """ Drop the buckets which have refilled. Call with the lock held. """
+        for key, (tokens, updated_at, rate, burst) in list(self._buckets.items()):
+            if refill(tokens, updated_at, now, rate, burst) >= burst:
+                del self._buckets[key]
+        self._swept_at = now
+
+
+class DatabaseBuckets(object):
+    """ Token buckets kept in the rate_limit_buckets table """
+
+    def take(self, key, rate, burst, now):
+        """ Take a token from a bucket. See `models.RateLimitBucket.take`. """
+        return models.RateLimitBucket.take(key, rate, burst, now)
+
+
+STORES = {
+    'memory': MemoryBuckets,
+    'database': DatabaseBuckets,
+}
+
+
+class Limiter(object):
+    """ Admits submissions as long as both the user's and the project's buckets have
+    tokens. Rates are given per minute; a rate of None or 0 means no limit.
+    """
+
+    def __init__(self, buckets, user_per_minute=None, user_burst=1,
+                 project_per_minute=None, project_burst=1):
+        self.buckets = buckets
+        self.limits = [('user', user_per_minute, user_burst),
+                       ('project', project_per_minute, project_burst)]
+
+    def admit(self, user, project, now=None):
+        """ Take a token for a submission by a user to a project.
+
+        :param models.User user: The user submitting
+        :param models.Project project: The project being submitted
+        :param float|None now: The current time in seconds since the epoch
+        :raises RateLimited: If the user or the project has submitted too often
+        """
+        now = time.time() if now is None else now
+        for (kind, per_minute, burst), owner in zip(self.limits, (user, project)):
+            if not per_minute:
+                continue
+            rate = per_minute / 60.0
+            taken, tokens = self.buckets.take('{}:{}'.format(kind, owner.id), rate,
+                                              max(1, burst), now)
+            if not taken:
+                raise RateLimited(
+                    "Too many submissions for this {}; try again later".format(kind),
+                    int(math.ceil((1 - tokens) / rate)))
+
+
+def get_limiter():
+    """ Return the limiter submissions are admitted through, creating it if necessary.
+
+    :return: The limiter or None if submissions are not rate limited
+    :rtype: Limiter|None
+    :raises ValueError: If the configured store is unknown
+    """
+    global _limiter
+    rate_limit_config = get_config().rate_limit
+    if not rate_limit_config.enabled:
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            if rate_limit_config.store not in STORES:
+                raise ValueError("Unknown rate limit store {}".format(rate_limit_config.store))
+            _limiter = Limiter(STORES[rate_limit_config.store](),
+                               user_per_minute=rate_limit_config.user_per_minute,
+                               user_burst=rate_limit_config.user_burst,
+                               project_per_minute=rate_limit_config.project_per_minute,
+                               project_burst=rate_limit_config.project_burst)
+    return _limiter
+
+
+def admit(user, project):
+    """ Admit a submission by a user to a project through the configured limiter.
+
+    :param models.User user: The user submitting
+    :param models.Project project: The project being submitted
+    :raises RateLimited: If the user or the project has submitted too often
+    """
+    limiter = get_limiter()
+    if limiter is not None:
+        limiter.admit(user, project)
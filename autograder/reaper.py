@@ -0,0 +1,145 @@
+"""
+Finding submissions whose grading got stuck. A submission which has waited longer
+than the reaper's timeout for results has its task looked up with the queuing
+backend. If the task is still queued or running it is left alone; otherwise the
+submission is queued again with a new token, or, once it has been retried
+`max_attempts` times, given results saying that grading failed.
+
+The reaper runs from `autograder queue reap` or, if `reaper.interval` is set, in a
+thread of the web process.
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+import collections
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+
+from .config import get_config
+from .queues import ACTIVE, get_queue
+from . import models
+
+
+logger = logging.getLogger(__name__)
+
+# What the reaper does with a stuck submission
+WAITING = 'waiting'
+RETRIED = 'retried'
+FAILED = 'failed'
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+class StuckSubmission(collections.namedtuple('StuckSubmission',
+                                             ['submission_key', 'project_name', 'submitted_at',
+                                              'attempts', 'status', 'action'])):
+    """ A submission which has waited too long for results and what was done about it """
+    pass
+
+
+def failed_results(attempts):
+    """ The results given to a submission which could not be graded.
+
+    :param int attempts: How many times the submission was queued
+    :rtype: dict
+    """
+    return {'error': "Grading did not finish after {} attempts".format(attempts)}
+
+
+def reap(timeout=None, max_attempts=None, batch_size=None, dry_run=False, now=None):
+    """ Look for stuck submissions and retry or fail them.
+
+    :param int|None timeout: How many seconds a submission may wait for results before
+        its task is checked. Defaults to the configured one.
+    :param int|None max_attempts: How many times a submission is queued again before
+        it is failed. Defaults to the configured number.
+    :param int|None batch_size: The most submissions to look at, oldest first. Defaults
+        to the configured number.
+    :param bool dry_run: If set, only report what would be done
+    :param datetime|None now: The current time
+    :return: The stuck submissions and what was (or would be) done with each
+    :rtype: list[StuckSubmission]
+    """
+    reaper_config = get_config().reaper
+    timeout = reaper_config.timeout if timeout is None else timeout
+    max_attempts = reaper_config.max_attempts if max_attempts is None else max_attempts
+    batch_size = batch_size or reaper_config.batch_size
+    now = now or datetime.utcnow()
+
+    by_project = collections.OrderedDict()
+    for submission, project in models.Submission.get_stuck_submissions(
+            now - timedelta(seconds=timeout), limit=batch_size):
+        by_project.setdefault(project.id, (project, []))[1].append(submission)
+
+    queue = get_queue()
+    report = []
+    to_retry = []
+    to_fail = []
+    for project, submissions in by_project.values():
+        statuses = queue.get_task_statuses(project, submissions)
+        retries = []
+        for submission in submissions:
+            status = statuses[submission.id]
+            attempts = submission.attempts or 0
+            if status == ACTIVE:
+                action = WAITING
+            elif attempts < max_attempts:
+                action = RETRIED
+                retries.append(submission)
+            else:
+                action = FAILED
+                to_fail.append((submission.submission_key, attempts + 1))
+            report.append(StuckSubmission(submission.submission_key, project.name,
+                                          submission.submitted_at, attempts, status, action))
+        if retries:
+            to_retry.append((project, retries))
+
+    if dry_run:
+        return report
+
+    if to_fail:
+        infos = models.Submission.get_submission_infos([key for key, _ in to_fail])
+        models.Submission.store_results([(infos[key], failed_results(tries))
+                                         for key, tries in to_fail])
+    for project, submissions in to_retry:
+        queue.submit_many(project, [(submission, submission.renew_token())
+                                    for submission in submissions])
+    for entry in report:
+        if entry.action != WAITING:
+            logger.warning("Submission %s to %s got stuck; %s it", entry.submission_key,
+                           entry.project_name, entry.action)
+    return report
+
+
+def _run(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            reap()
+        except Exception:
+            logger.exception("Could not reap stuck submissions")
+        finally:
+            models.db.session.remove()
+
+
+def start(interval=None):
+    """ Start reaping stuck submissions every so often in a thread of this process,
+    unless that is already happening.
+
+    :param float|None interval: How many seconds to wait between runs. Defaults to
+        the configured interval.
+    :return: Whether the reaper is running
+    :rtype: bool
+    """
+    global _thread
+    interval = interval or get_config().reaper.interval
+    if not interval:
+        return False
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, args=(interval,), name='reaper')
+            _thread.daemon = True
+            _thread.start()
+    return True
@@ -0,0 +1,101 @@
+"""
+Memoization of grading results. A grading run is determined by the project, the
+payload it was graded with and the submitted archive, so results are reused for
+byte-identical (payload, archive) pairs instead of queuing another task.
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from .config import get_config
+from .utils import LRUCache
+from . import models
+
+
+_cache = None
+
+
+def get_cache():
+    """ Return the in-process cache of results, creating it if necessary.
+
+    :return: The cache, keyed by (project_key, payload_digest, archive_digest)
+    :rtype: LRUCache
+    """
+    global _cache
+    if _cache is None:
+        cache_config = get_config().result_cache
+        _cache = LRUCache(maxsize=cache_config.max_size, ttl=cache_config.ttl)
+    return _cache
+
+
+def is_reusable(results):
+    """ Only results from grading runs which actually finished may be reused.
+
+    :param dict results: The results of a grading run
+    :return: Whether the results may be reused
+    :rtype: bool
+    """
+    return bool(results) and 'error' not in results and not results.get('timed_out')
+
+
+def lookup(project, archive_digest):
+    """ Look up the results of a previous grading of an archive against a project's
+    current payload. The in-process cache is checked first, then the database.
+    Nothing is reused for a project whose payload digest is unknown, since then
+    there is no telling which payload earlier results were graded with.
+
+    :param models.Project project: The project
+    :param str archive_digest: The digest of the archive
+    :return: The results or None if there are none to reuse
+    :rtype: dict|None
+    """
+    if not get_config().result_cache.enabled or project.payload_digest is None:
+        return None
+
+    key = (project.project_key, project.payload_digest, archive_digest)
+    results = get_cache().get(key)
+    if results is None:
+        duplicate = models.Submission.get_graded_duplicate(project, archive_digest,
+                                                           project.payload_digest)
+        if duplicate and is_reusable(duplicate.results):
+            results = duplicate.results
+            get_cache().set(key, results)
+    return results
+
+
+def store(project, submission, results):
+    """ Remember the results of grading a submission.
+
+    :param models.Project project: The project the submission was graded against
+    :param models.Submission submission: The submission
+    :param dict results: Its results
+    """
+    if (get_config().result_cache.enabled and submission.payload_digest is not None and
+            is_reusable(results)):
+        key = (project.project_key, submission.payload_digest, submission.archive_digest)
+        get_cache().set(key, results)
+
+
+def post_cached_results(project, submission):
+    """ If the submission's archive was already graded against the project's current
+    payload, post those results to the submission.
+
+    :param models.Project project: The project
+    :param models.Submission submission: The submission
+    :return: Whether results were posted
+    :rtype: bool
+    """
+    results = lookup(project, submission.archive_digest)
+    if results is None:
+        return False
+    submission.post_results(results)
+    return True
+
+
+def invalidate(project_key):
+    """ Forget all cached results for a project, e.g., because it has a new payload.
+
+    :param str project_key: The key of the project
+    """
+    cache = get_cache()
+    for key in cache.keys():
+        if key[0] == project_key:
+            cache.pop(key)
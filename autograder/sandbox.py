@@ -0,0 +1,434 @@
+"""
+Running untrusted grading commands with bounded resources. Each run gets its own
+session and, on Linux, rlimits on CPU time, core dumps and the size of files it
+writes. Its stdout and stderr are cut off at a maximum size.
+
+If `cgroup_root` names a cgroup v2 directory this process may create children in,
+each run also gets its own cgroup with `memory.max` and `pids.max` set. That limits
+the memory and number of processes of the whole run, and `cgroup.kill` cleans up
+anything it leaves behind. Without a cgroup, memory is limited through
+RLIMIT_AS and the number of processes is not limited: RLIMIT_NPROC counts every
+process of the user, so would also count the web server and the other runs.
+
+The CPU seconds and peak RSS each run used are measured with `os.wait4`, or with
+the cgroup's `cpu.stat` if there is one.
+
+Python scripts may instead be run with `run_script` in a child forked from the
+calling process, which skips interpreter startup and any imports that process
+has already done. The child drops the autograder app's config and database
+engine before the script runs.
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+import collections
+import errno
+import functools
+import logging
+import os
+import runpy
+import signal
+import subprocess
+import sys
+import threading
+import traceback
+import uuid
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+# The limits a run exceeded, as reported in `RunResult.exceeded`
+CPU = 'cpu'
+MEMORY = 'memory'
+PROCESSES = 'processes'
+OUTPUT = 'output'
+
+# How many bytes are read from a run's output at a time
+READ_SIZE = 65536
+
+# CPU time is only measured to the scheduler's tick, so a run killed after using
+# this much of its CPU time is taken to have run out
+CPU_TOLERANCE = 0.9
+
+
+class Limits(collections.namedtuple('Limits', ['cpu_time', 'memory', 'max_processes',
+                                               'max_output'])):
+    """ The resources one run may use. Any of them may be None for no limit.
+
+    :ivar int cpu_time: CPU seconds
+    :ivar int memory: Bytes of memory
+    :ivar int max_processes: Processes running at once. Only enforced with a cgroup.
+    :ivar int max_output: Bytes of stdout, of stderr and of each file written
+    """
+    pass
+
+
+class RunResult(collections.namedtuple('RunResult', ['returncode', 'stdout', 'stderr',
+                                                     'timed_out', 'exceeded', 'cpu_seconds',
+                                                     'max_rss'])):
+    """ What a run did and used. `exceeded` is the limit it was stopped for, if any,
+    and `max_rss` is in bytes. """
+    pass
+
+
+def get_limits(sandbox_config):
+    """ Return the limits set in the config.
+
+    :param config.SandboxConfig sandbox_config: The config
+    :rtype: Limits
+    """
+    def scaled(value, scale):
+        return None if value is None else int(value * scale)
+
+    return Limits(cpu_time=sandbox_config.cpu_time,
+                  memory=scaled(sandbox_config.memory_mb, 1024 * 1024),
+                  max_processes=sandbox_config.max_processes,
+                  max_output=scaled(sandbox_config.max_output_kb, 1024))
+
+
+def _set_rlimit(which, value):
+    """ Lower a resource limit, staying within the hard limit we were given """
+    _, hard = resource.getrlimit(which)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(which, (value, value))
+
+
+def _limit_child(limits, cgroup):
+    """ Run in the child between fork and exec """
+    os.setsid()
+    if cgroup:
+        with open(os.path.join(cgroup, 'cgroup.procs'), 'w') as f:
+            f.write(str(os.getpid()))
+    if resource is None:
+        return
+    _set_rlimit(resource.RLIMIT_CORE, 0)
+    if limits.cpu_time:
+        _set_rlimit(resource.RLIMIT_CPU, limits.cpu_time)
+    if limits.max_output:
+        _set_rlimit(resource.RLIMIT_FSIZE, limits.max_output)
+    if limits.memory and not cgroup:
+        _set_rlimit(resource.RLIMIT_AS, limits.memory)
+
+
+def _write(cgroup, name, value):
+    with open(os.path.join(cgroup, name), 'w') as f:
+        f.write(str(value))
+
+
+def _read_stats(cgroup, name):
+    """ Read a flat-keyed cgroup file such as `cpu.stat` into a dict of ints """
+    try:
+        with open(os.path.join(cgroup, name)) as f:
+            return {key: int(value) for key, value in (line.split() for line in f if line.strip())}
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def make_cgroup(cgroup_root, limits):
+    """ Create a cgroup for one run under `cgroup_root` and set its limits.
+
+    :param str cgroup_root: A cgroup v2 directory we may create children in
+    :param Limits limits: The limits
+    :return: The path of the new cgroup
+    :rtype: str
+    """
+    cgroup = os.path.join(cgroup_root, 'grade-{}'.format(uuid.uuid4().hex))
+    os.mkdir(cgroup)
+    if limits.memory:
+        _write(cgroup, 'memory.max', limits.memory)
+    if limits.max_processes:
+        _write(cgroup, 'pids.max', limits.max_processes)
+    return cgroup
+
+
+def remove_cgroup(cgroup):
+    """ Kill whatever is left in a run's cgroup and remove it.
+
+    :param str cgroup: The path of the cgroup
+    """
+    if os.path.exists(os.path.join(cgroup, 'cgroup.kill')):
+        try:
+            _write(cgroup, 'cgroup.kill', 1)
+        except (IOError, OSError):
+            pass
+    try:
+        os.rmdir(cgroup)
+    except OSError as e:
+        logger.warning("Could not remove cgroup %s: %s", cgroup, e)
+
+
+def _kill(pid, cgroup):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+    if cgroup and os.path.exists(os.path.join(cgroup, 'cgroup.kill')):
+        try:
+            _write(cgroup, 'cgroup.kill', 1)
+        except (IOError, OSError):
+            pass
+
+
+def _read_output(pipe, max_output, chunks, overflowed, stop):
+    """ Read a pipe to the end, keeping at most `max_output` bytes. Once more comes,
+    `stop` is called and the rest is thrown away. """
+    kept = 0
+    while True:
+        chunk = os.read(pipe.fileno(), READ_SIZE)
+        if not chunk:
+            break
+        if max_output is not None and kept + len(chunk) > max_output:
+            chunk = chunk[:max_output - kept]
+            if not overflowed:
+                overflowed.append(True)
+                stop()
+        kept += len(chunk)
+        if chunk:
+            chunks.append(chunk)
+    pipe.close()
+
+
+def _killed(returncode):
+    """ Whether a run was killed by SIGKILL or SIGXCPU, as it or the shell running it
+    reports """
+    return returncode in (-signal.SIGKILL, -signal.SIGXCPU,
+                          128 + signal.SIGKILL, 128 + signal.SIGXCPU)
+
+
+def _wait(pid):
+    while True:
+        try:
+            return os.wait4(pid, 0)
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+
+
+class _ForkedProcess(object):
+    """ The parts of a `subprocess.Popen` `run` uses, for a forked child """
+
+    def __init__(self, pid, stdout, stderr):
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+
+
+def _exit_code(e):
+    """ The exit status `python` gives a SystemExit """
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    sys.stderr.write('{}\n'.format(e.code))
+    return 1
+
+
+def _forget_app():
+    """ Run in a forked child: drop what the autograder's app left in this process
+    that a script shouldn't see, namely its config, with the secret key and database
+    URI, and its database engine. Only modules already imported are touched, as
+    importing the app here would bring it right back. Its file descriptors must
+    already be closed, so that disposing of the engine can't close the parent's
+    database connections. """
+    config_module = sys.modules.get('autograder.config')
+    if config_module is not None:
+        config_module.config = None
+    package = sys.modules.get('autograder')
+    if package is None:
+        return
+    package.config = None
+    app = getattr(package, 'app', None)
+    if app is None:
+        return
+    app.config.pop('SECRET_KEY', None)
+    app.config.pop('SQLALCHEMY_DATABASE_URI', None)
+    state = app.extensions.get('sqlalchemy')
+    if state is None:
+        return
+    for connector in list(state.connectors.values()):
+        engine = getattr(connector, '_engine', None)
+        if engine is not None:
+            try:
+                engine.dispose()
+            except Exception:
+                pass
+    state.connectors.clear()
+
+
+def _run_script(argv, cwd, env):
+    """ Run in a forked child: run a python script as `python` would, then exit
+    without returning to the caller """
+    code = 1
+    try:
+        _forget_app()
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+        sys.argv = list(argv)
+        sys.path[0] = os.path.dirname(os.path.abspath(argv[0]))
+        runpy.run_path(argv[0], run_name='__main__')
+        code = 0
+    except SystemExit as e:
+        code = _exit_code(e)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _close_fds():
+    """ Close every file descriptor but stdin, stdout and stderr """
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError:
+        fds = range(3, os.sysconf('SC_OPEN_MAX'))
+    for fd in fds:
+        if fd > 2:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def _fork_script(argv, cwd, env, limits, cgroup):
+    """ Fork a child of this process which runs a python script with what this process
+    has already imported """
+    stdout_read, stdout_write = os.pipe()
+    stderr_read, stderr_write = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            null = os.open(os.devnull, os.O_RDONLY)
+            for fd, target in ((null, 0), (stdout_write, 1), (stderr_write, 2)):
+                os.dup2(fd, target)
+            _close_fds()
+            # Whatever this process had replaced its standard streams with, the
+            # script's go to the pipes
+            sys.stdin = os.fdopen(0, 'r')
+            sys.stdout = os.fdopen(1, 'w')
+            sys.stderr = os.fdopen(2, 'w')
+            _limit_child(limits, cgroup)
+        except BaseException:
+            os._exit(1)
+        _run_script(argv, cwd, env or dict(os.environ))
+    os.close(stdout_write)
+    os.close(stderr_write)
+    return _ForkedProcess(pid, os.fdopen(stdout_read, 'rb'), os.fdopen(stderr_read, 'rb'))
+
+
+def run(command, cwd, env=None, timeout=None, limits=None, cgroup_root=None):
+    """ Run a shell command in its own session with limited resources.
+
+    :param str command: The shell string to execute
+    :param str cwd: The directory to run it in
+    :param dict|None env: Its environment. Defaults to ours.
+    :param float|None timeout: The number of seconds after which it is killed
+    :param Limits|None limits: The resources it may use. Defaults to no limits.
+    :param str|None cgroup_root: A cgroup v2 directory to create its cgroup in
+    :return: What the command did and used
+    :rtype: RunResult
+    """
+    def spawn(limits, cgroup):
+        return subprocess.Popen(command, shell=True, cwd=cwd, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                preexec_fn=lambda: _limit_child(limits, cgroup))
+
+    return _supervise(spawn, timeout, limits, cgroup_root)
+
+
+def run_script(argv, cwd, env=None, timeout=None, limits=None, cgroup_root=None):
+    """ Run a python script in a child forked from this process, with the same limits
+    as `run`. The script starts with every module this process has imported, instead
+    of paying for a new interpreter and its imports, but runs under this process's
+    python.
+
+    :param list[str] argv: The script and its arguments
+    :param str cwd: The directory to run it in
+    :param dict|None env: Its environment. Defaults to ours.
+    :param float|None timeout: The number of seconds after which it is killed
+    :param Limits|None limits: The resources it may use. Defaults to no limits.
+    :param str|None cgroup_root: A cgroup v2 directory to create its cgroup in
+    :return: What the script did and used
+    :rtype: RunResult
+    """
+    return _supervise(functools.partial(_fork_script, argv, cwd, env), timeout, limits,
+                      cgroup_root)
+
+
+def _supervise(spawn, timeout, limits, cgroup_root):
+    """ Start a child with `spawn(limits, cgroup)`, collect its output within the
+    limits and measure what it used """
+    limits = limits or Limits(None, None, None, None)
+    cgroup = make_cgroup(cgroup_root, limits) if cgroup_root else None
+    try:
+        process = spawn(limits, cgroup)
+        stop = functools.partial(_kill, process.pid, cgroup)
+
+        timed_out = []
+        overflowed = []
+
+        def time_out():
+            timed_out.append(True)
+            stop()
+
+        stdout, stderr = [], []
+        readers = [threading.Thread(target=_read_output,
+                                    args=(pipe, limits.max_output, chunks, overflowed, stop))
+                   for pipe, chunks in ((process.stdout, stdout), (process.stderr, stderr))]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, time_out)
+            timer.start()
+        try:
+            _, status, usage = _wait(process.pid)
+            # Anything the command left running in its session goes with it
+            stop()
+            for reader in readers:
+                reader.join()
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+
+        cpu_seconds = usage.ru_utime + usage.ru_stime
+        # ru_maxrss is in bytes on OS X and kilobytes elsewhere
+        max_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        exceeded = None
+        if cgroup:
+            cpu_usec = _read_stats(cgroup, 'cpu.stat').get('usage_usec')
+            if cpu_usec is not None:
+                cpu_seconds = max(cpu_seconds, cpu_usec / 1e6)
+            if _read_stats(cgroup, 'memory.events').get('oom_kill'):
+                exceeded = MEMORY
+            elif _read_stats(cgroup, 'pids.events').get('max'):
+                exceeded = PROCESSES
+        if overflowed:
+            exceeded = OUTPUT
+        elif (limits.cpu_time and not timed_out and _killed(process.returncode) and
+              cpu_seconds >= CPU_TOLERANCE * limits.cpu_time):
+            exceeded = CPU
+    finally:
+        if cgroup:
+            remove_cgroup(cgroup)
+
+    return RunResult(process.returncode, b''.join(stdout), b''.join(stderr), bool(timed_out),
+                     exceeded, cpu_seconds, max_rss)
@@ -0,0 +1,205 @@
+"""
+Scheduling of grading tasks. Every submission is given a priority from how soon
+its assignment is due and how many times its user has already submitted it, so
+that near a deadline a student's first submission doesn't wait behind another's
+fiftieth. The iron.io backend passes the priority on as the task's priority. The
+local backend keeps its own `TaskQueue`, which also shares its processes fairly
+between units. How long tasks wait before a worker picks them up is recorded
+in `wait_stats` so the scheduling can be checked.
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+import collections
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+
+import sqlalchemy
+
+from .utils import chunked
+from . import models
+
+
+logger = logging.getLogger(__name__)
+
+# The priorities a task may have, which are the task priorities iron.io offers
+LOW, NORMAL, HIGH = 0, 1, 2
+
+# Submissions to assignments due within this long are graded ahead of others
+DEADLINE_WINDOW = timedelta(hours=24)
+
+# A user's first few submissions to an assignment are graded ahead of their later ones
+FRESH_SUBMISSIONS = 3
+
+# Once a user has submitted an assignment this many times, their submissions are
+# always graded last
+HEAVY_SUBMISSIONS = 20
+
+
+def get_priority(submission_count, due_date, now=None):
+    """ Return the priority of a submission.
+
+    :param int submission_count: How many times the user has submitted the assignment,
+        counting this submission
+    :param datetime due_date: When the assignment is due
+    :param datetime|None now: The current time
+    :return: `LOW`, `NORMAL` or `HIGH`
+    :rtype: int
+    """
+    if submission_count > HEAVY_SUBMISSIONS:
+        return LOW
+    now = now or datetime.utcnow()
+    due_soon = now <= due_date <= now + DEADLINE_WINDOW
+    return LOW + (submission_count <= FRESH_SUBMISSIONS) + due_soon
+
+
+def prioritize(submissions, now=None):
+    """ Work out the priority of many submissions with a query for their assignments
+    and one for their summaries, and record it on the submissions. This commits, so
+    read anything else needed from the submissions first.
+
+    :param list[models.Submission] submissions: The submissions, which have been counted
+        in their summaries
+    :param datetime|None now: The current time
+    :return: The priority and unit of each submission, by submission id
+    :rtype: dict[int, (int, int)]
+    """
+    assignments = {}
+    for chunk in chunked(sorted({submission.assignment_id for submission in submissions}),
+                         models.MAX_IN_CLAUSE):
+        rows = (models.db.session.query(models.Assignment.id, models.Assignment.unit_id,
+                                        models.Assignment.due_date)
+                .filter(models.Assignment.id.in_(chunk)))
+        assignments.update((row.id, row) for row in rows)
+    counts = models.SubmissionSummary.get_submission_counts(
+        {(submission.user_id, submission.assignment_id) for submission in submissions})
+
+    schedule = {}
+    for submission in submissions:
+        assignment = assignments[submission.assignment_id]
+        priority = get_priority(counts.get((submission.user_id, submission.assignment_id), 1),
+                                assignment.due_date, now=now)
+        schedule[submission.id] = (priority, assignment.unit_id)
+
+    if schedule:
+        table = models.Submission.__table__
+        models.db.session.execute(
+            table.update()
+            .where(table.c.id == sqlalchemy.bindparam('submission_id'))
+            .values(priority=sqlalchemy.bindparam('new_priority')),
+            [{'submission_id': submission_id, 'new_priority': scheduled[0]}
+             for submission_id, scheduled in schedule.items()])
+        models.db.session.commit()
+    return schedule
+
+
+class TaskQueue(object):
+    """
+    Tasks waiting for a process. Tasks are taken highest priority first. Among those
+    of the same priority, they are taken from the unit with the fewest tasks running,
+    and otherwise oldest first. This is not thread-safe; callers hold their own lock.
+
+    >>> queue = TaskQueue()
+    >>> queue.put('a1', NORMAL, 'a', now=0)
+    >>> queue.put('a2', NORMAL, 'a', now=1)
+    >>> queue.put('b1', NORMAL, 'b', now=2)
+    >>> queue.put('c1', HIGH, 'c', now=3)
+    >>> [queue.take(now=4)[0] for _ in range(3)]
+    ['c1', 'a1', 'b1']
+    """
+
+    def __init__(self):
+        # priority -> unit -> the (enqueued at, task) waiting, oldest first
+        self._waiting = collections.defaultdict(collections.OrderedDict)
+        self._running = collections.Counter()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def put(self, task, priority, unit_id, now=None):
+        """ Add a task to the queue.
+
+        :param object task: The task
+        :param int priority: Its priority
+        :param object unit_id: The unit it is for
+        :param float|None now: The current time in seconds since the epoch
+        """
+        now = time.time() if now is None else now
+        self._waiting[priority].setdefault(unit_id, collections.deque()).append((now, task))
+        self._size += 1
+
+    def take(self, now=None):
+        """ Take the next task from the queue and count it as running until `done`
+        is called for its unit.
+
+        :param float|None now: The current time in seconds since the epoch
+        :return: The task, its priority, its unit and how many seconds it waited, or
+            None if the queue is empty
+        :rtype: (object, int, object, float)|None
+        """
+        if not self._size:
+            return None
+        now = time.time() if now is None else now
+        priority = max(priority for priority, units in self._waiting.items() if units)
+        units = self._waiting[priority]
+        unit_id = min(units, key=lambda unit: (self._running[unit], units[unit][0][0]))
+        enqueued_at, task = units[unit_id].popleft()
+        if not units[unit_id]:
+            del units[unit_id]
+        self._size -= 1
+        self._running[unit_id] += 1
+        return task, priority, unit_id, now - enqueued_at
+
+    def done(self, unit_id):
+        """ Record that a task taken for a unit has finished.
+
+        :param object unit_id: The unit
+        """
+        self._running[unit_id] -= 1
+        if self._running[unit_id] <= 0:
+            del self._running[unit_id]
+
+
+class WaitStats(object):
+    """ How long tasks have waited to be picked up, by priority and by unit """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._by_priority = collections.defaultdict(lambda: [0, 0.0, 0.0])
+            self._by_unit = collections.defaultdict(lambda: [0, 0.0, 0.0])
+
+    def record(self, priority, unit_id, waited):
+        """ Record that a task waited to be picked up.
+
+        :param int|None priority: The task's priority
+        :param object unit_id: The unit it is for
+        :param float waited: How many seconds it waited
+        """
+        logger.debug("Task for unit %s at priority %s waited %.3fs", unit_id, priority, waited)
+        with self._lock:
+            for stats in (self._by_priority[priority], self._by_unit[unit_id]):
+                stats[0] += 1
+                stats[1] += waited
+                stats[2] = max(stats[2], waited)
+
+    def summary(self):
+        """ Summarize the waits recorded so far.
+
+        :return: For 'priority' and 'unit', the number of tasks, mean wait and longest
+            wait in seconds of each priority or unit
+        :rtype: dict[str, dict[object, (int, float, float)]]
+        """
+        with self._lock:
+            return {name: {key: (count, total / count, longest)
+                           for key, (count, total, longest) in stats.items()}
+                    for name, stats in (('priority', self._by_priority),
+                                        ('unit', self._by_unit))}
+
+
+wait_stats = WaitStats()
@@ -3,14 +3,185 @@ Functions related to storing code and submissions.
 
 @author Kevin Wilson - khwilson@gmail.com
 """
+import hashlib
+import multiprocessing
+import os
 import shutil
+import tempfile
+import zipfile
 
-from config import config
+from .config import get_config
+from .utils import NamedTemporaryDirectory
+
+
+# Uploads are copied this many bytes at a time
+CHUNK_SIZE = 64 * 1024
+
+# The subdirectory of the submissions directory holding archives by digest
+BLOB_DIRECTORY = 'blobs'
+
+
+def blob_path(archive_digest):
+    """ Return where the archive with the passed digest lives in the content-addressed
+    store. Archives are sharded into subdirectories by the first two hex digits of
+    their digest.
+
+    :param str archive_digest: The hex SHA-256 digest of the archive
+    :return: The path to the archive
+    :rtype: str
+    """
+    return os.path.join(get_config().submissions_directory, BLOB_DIRECTORY,
+                        archive_digest[:2], archive_digest + '.zip')
+
+
+def legacy_archive_path(submission_key):
+    """ Return where archives stored before the content-addressed store were kept.
+
+    :param str submission_key: The key of the submission
+    :return: The path to the submission's archive
+    :rtype: str
+    """
+    return os.path.join(get_config().submissions_directory, submission_key + '.zip')
+
+
+def archive_path(submission_key, archive_digest=None):
+    """ Return where the archive for a submission lives.
+
+    :param str submission_key: The key of the submission
+    :param str|None archive_digest: The digest of the submission's archive, if known
+    :return: The path to the submission's archive
+    :rtype: str
+    """
+    if archive_digest:
+        return blob_path(archive_digest)
+    return legacy_archive_path(submission_key)
 
 
 def push_archive(archive_name):
     """ Push an archive of submitted code to the appropriate place.
 
     :param str archive_name: The submitted code to be pushed.
+    :return: The hex SHA-256 digest of the archive
+    :rtype: str
+    """
+    with open(archive_name, 'rb') as f:
+        return ingest_stream(f)
+
+
+def ingest_stream(stream):
+    """ Write a stream of zipped code to the content-addressed store in a single pass.
+
+    The data is hashed as it is written and the zip's central directory is read
+    (but nothing is extracted) before the archive is moved into place, so memory
+    use is bounded by `CHUNK_SIZE` whatever the size of the upload. If an identical
+    archive is already stored, the new copy is discarded.
+
+    :param file stream: A file-like object containing a zip archive
+    :return: The hex SHA-256 digest of the archive
+    :rtype: str
+    :raises ValueError: If the stream is not a zip archive
     """
-    shutil.copy(archive_name, config.submissions_directory)
+    fd, partial = tempfile.mkstemp(dir=get_config().submissions_directory, suffix='.part')
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        check_archive(partial)
+
+        destination = blob_path(digest.hexdigest())
+        if os.path.exists(destination):
+            os.unlink(partial)
+        else:
+            if not os.path.isdir(os.path.dirname(destination)):
+                try:
+                    os.makedirs(os.path.dirname(destination))
+                except OSError:
+                    # Someone else made it in the meantime
+                    pass
+            os.rename(partial, destination)
+    except Exception:
+        if os.path.exists(partial):
+            os.unlink(partial)
+        raise
+    return digest.hexdigest()
+
+
+def _try_push_code(code):
+    try:
+        return push_code(code), None
+    except (ValueError, IOError, OSError) as e:
+        return None, str(e)
+
+
+def push_many(codes, processes=None):
+    """ Push many pieces of code to the content-addressed store in parallel.
+
+    :param list[str] codes: The code to push. See `push_code` for what may be passed.
+    :param int|None processes: How many processes to archive with. Defaults to the
+        number of CPUs.
+    :return: For each piece of code, its digest and None, or None and an error message
+        if it could not be pushed
+    :rtype: list[(str|None, str|None)]
+    """
+    pool = multiprocessing.Pool(processes=processes)
+    try:
+        return pool.map(_try_push_code, codes, chunksize=16)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def file_digest(filename):
+    """ Return the hex SHA-256 digest of a file, reading it in chunks.
+
+    :param str filename: The file to hash
+    :return: The digest
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def check_archive(archive_name):
+    """ Check that a file is a zip archive by reading its central directory.
+
+    :param str archive_name: The file to check
+    :raises ValueError: If the file is not a zip archive
+    """
+    try:
+        zipfile.ZipFile(archive_name).close()
+    except zipfile.BadZipfile:
+        raise ValueError("Submitted code must be a zip archive")
+
+
+def push_code(code):
+    """ Push submitted code to the content-addressed store.
+
+    :param str|file code: The code to submit. If a file-like object, it is streamed in
+        as a zip archive. If the file is a directory, then zips it up and pushes it. If
+        the file is a zip file, pushes it as is. Otherwise, zips up the lone file and
+        pushes that.
+    :return: The hex SHA-256 digest of the pushed archive
+    :rtype: str
+    :raises ValueError: If the code is not a valid zip archive
+    """
+    if hasattr(code, 'read'):
+        return ingest_stream(code)
+
+    if code.endswith('.zip') and os.path.isfile(code):
+        return push_archive(code)
+
+    with NamedTemporaryDirectory() as tmpdir:
+        if os.path.isdir(code):
+            root_dir = code
+        else:
+            root_dir = os.path.join(tmpdir, 'code')
+            os.mkdir(root_dir)
+            shutil.copy(code, root_dir)
+        archive = shutil.make_archive(os.path.join(tmpdir, 'code'), 'zip', root_dir)
+        return push_archive(archive)
@@ -4,10 +4,13 @@ Utilities for general use in the project.
 @author Kevin Wilson - khwilson@gmail.com
 """
 
+import collections
 import random
 import shutil
 import string
 import tempfile
+import threading
+import time
 import uuid
 
 
@@ -17,7 +20,7 @@ TOKEN_CHARACTERS = string.ascii_letters + string.digits
 class NamedTemporaryDirectory(object):
     """
     A context manager that creates a temporary directory and deletes
-    it on exit
+    it on exit. If `dir` is set, the directory is created inside of it.
 
     >>> with NamedTemporaryDirectory() as directory:
     ...     assert os.path.isdir(directory)
@@ -27,8 +30,8 @@ class NamedTemporaryDirectory(object):
     ... assert not os.path.exists(directory)
     """
 
-    def __init__(self):
-        self.directory = tempfile.mkdtemp()
+    def __init__(self, dir=None):
+        self.directory = tempfile.mkdtemp(dir=dir)
 
     def __enter__(self):
         return self.directory
@@ -37,6 +40,82 @@ class NamedTemporaryDirectory(object):
         shutil.rmtree(self.directory)
 
 
+class LRUCache(object):
+    """
+    A thread-safe mapping which holds at most `maxsize` entries, evicting the
+    least recently used entry when full. If `ttl` is set, entries older than
+    `ttl` seconds are treated as missing.
+
+    >>> cache = LRUCache(maxsize=2)
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.set('c', 3)
+    >>> cache.get('b') is None
+    True
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires < time.time():
+                return default
+            self._data[key] = (value, expires)
+            return value
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            try:
+                return self._data.pop(key)[0]
+            except KeyError:
+                return default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def __len__(self):
+        return len(self._data)
+
+
+def chunked(sequence, size):
+    """ Split a sequence into lists of at most `size` elements.
+
+    >>> list(chunked([1, 2, 3, 4, 5], 2))
+    [[1, 2], [3, 4], [5]]
+
+    :param sequence: The sequence to split
+    :param int size: The largest size of a chunk
+    :return: The chunks, in order
+    :rtype: iterator[list]
+    """
+    sequence = list(sequence)
+    for start in range(0, len(sequence), size):
+        yield sequence[start:start + size]
+
+
 def random_token(length=64):
     """ Return a token to be used later for authentication.
 
@@ -3,21 +3,33 @@ The actual Flask app to be used as the web broker for the autograder.
 
 @author Kevin Wilson - khwilson@gmail.com
 """
-import datetime
+from datetime import datetime
+import json
 import os
-import uuid
+import zlib
 
-from flask import Flask, request, render_template, redirect, url_for, flash, g
+from flask import (Flask, Response, request, render_template, redirect, url_for, flash, g,
+                   send_file)
 from flask.ext.login import (LoginManager, current_user, login_required,
                             login_user, logout_user,
                             confirm_login, fresh_login_required)
 from werkzeug.contrib.fixers import ProxyFix
 
-from . import app, db
-from .models import Project, Submission, User
+from . import app, ingest, ratelimit, reaper, scheduling, storage
+from .config import get_config
+from .models import Project, Submission, SubmissionLimitError, User
+from .queues import get_queue
+from .utils import LRUCache
 
 app.wsgi_app = ProxyFix(app.wsgi_app)
 
+# The most bytes gzipped results posted by a worker may decompress to
+MAX_RESULTS_SIZE = 16 * 1024 * 1024
+
+# The tasks whose wait has been recorded in `scheduling.wait_stats`, so that a worker
+# fetching an archive again doesn't count as picking up its task again
+_picked_up = LRUCache(maxsize=10000)
+
 login_manager = LoginManager()
 
 login_manager.login_view = "login"
@@ -31,6 +43,12 @@ def load_user(user_id):
 
 login_manager.setup_app(app)
 
+@app.before_first_request
+def start_reaper():
+    """ Reap stuck submissions in the background if `reaper.interval` is configured """
+    reaper.start()
+
+
 @app.route("/")
 def index():
     return app.send_static_file('html/index.html')
@@ -77,30 +95,42 @@ def logout():
     return redirect(url_for("index"))
 
 
-class SavedZipFile(object):
-    def __init__(self, file, directory):
-        self.filename = os.path.join(directory, uuid.uuid4() + '.zip')
-        file.save(self.filename)
-    def __enter__(self):
-        return self.filename
-    def __exit__(self, *args):
-        os.unlink(self.filename)
-
-
 @app.route('/submit', methods=['GET', 'POST'])
 @login_required
 def submit_project():
+    """ Submit a zip archive of code for a project. The archive may either be the
+    `file` field of a multipart form or, to avoid the form parser spooling it, the
+    raw body of a request with an application/zip content type and the project
+    name in the query string. Either way it is streamed straight into storage.
+    """
     if request.method == 'POST':
-        project_name = request.form['project_name']
+        if request.mimetype == 'application/zip':
+            project_name = request.args.get('project_name')
+            stream = request.stream
+        else:
+            project_name = request.form.get('project_name')
+            file = request.files.get('file')
+            if not (file and file.filename.endswith('.zip')):
+                return render_template('submit.html',
+                                       error="Submitted code must be a zip file"), 400
+            stream = file.stream
+
         project = Project.get_project_by_name(project_name)
         if not project:
-            return render_template('submit', error="Project {} does not exist".format(project_name))
-        file = request.files['file']
-        if file and file.filename.endswith('.zip'):
-            with SavedZipFile(file, config.holding_directory) as some_filename:
-                queues.submit_code(g.user, project, some_filename)
-            return "Success"
-    return render_template('submit')
+            return render_template('submit.html',
+                                   error="Project {} does not exist".format(project_name)), 404
+        try:
+            ratelimit.admit(g.user, project)
+            get_queue().submit_code(g.user, project, stream)
+        except ratelimit.RateLimited as e:
+            return (render_template('submit.html', error=str(e)), 429,
+                    {'Retry-After': str(e.retry_after)})
+        except SubmissionLimitError as e:
+            return render_template('submit.html', error=str(e)), 403
+        except ValueError as e:
+            return render_template('submit.html', error=str(e)), 400
+        return "Success"
+    return render_template('submit.html')
 
 
 @app.route('/worker/code', methods=['GET'])
@@ -109,21 +139,119 @@ def worker_get_code():
     token = request.args.get('token')
     if not (submission_key and token):
         return "Both the submission_key and token must be set in the request", 400
-    submission = Submission.get_submission_by_key(submission_key)
-    if not (submission and submission.check_token(token)):
+    info = Submission.get_submission_info(submission_key)
+    if not (info and info.check_token(token)):
         return "Error finding submission you want to post results on", 404
-    return app.send_from_directory(config.submissions_directory, submission_key + '.zip')
+    response = send_archive(info.archive, info.archive_digest)
+    # A worker first fetching the whole archive is the task being picked up. A retried
+    # task has a new token, so it is picked up again.
+    task = (info.id, info.token_hash)
+    if response.status_code == 200 and _picked_up.get(task) is None:
+        _picked_up.set(task, True)
+        scheduling.wait_stats.record(info.priority, info.unit_id,
+                                     (datetime.utcnow() - info.submitted_at).total_seconds())
+    return response
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(storage.CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def send_archive(path, archive_digest=None):
+    """ Respond with a submitted archive. Its ETag is its digest, so a worker fetching
+    an archive it already has gets a 304. If `downloads.offload` says to, the archive
+    is left for the server in front of us to send with X-Accel-Redirect or
+    X-Sendfile. Otherwise a single byte range may be requested, and whole archives
+    go to the WSGI server's file wrapper, which may use sendfile.
+
+    :param str path: The path to the archive
+    :param str|None archive_digest: Its digest, or None for archives stored before
+        they were kept by digest
+    :rtype: flask.Response
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return Response("The submitted archive is missing", 404)
+    if archive_digest:
+        etag, weak = archive_digest, False
+    else:
+        etag, weak = '{}-{}'.format(int(stat.st_mtime), stat.st_size), True
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=weak)
+        return response
+
+    download_config = get_config().downloads
+    if download_config.offload == 'x-accel-redirect':
+        # The proxy serves the file, ranges and all
+        relative = os.path.relpath(path, get_config().submissions_directory)
+        response = Response(mimetype='application/zip')
+        response.headers['X-Accel-Redirect'] = (download_config.accel_prefix.rstrip('/') + '/' +
+                                                relative.replace(os.sep, '/'))
+    elif download_config.offload == 'x-sendfile':
+        response = Response(mimetype='application/zip')
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+    else:
+        byte_range = None
+        # A range of another version of the archive, or one only valid since a date,
+        # gets the whole archive
+        if_range = request.if_range
+        if request.range and if_range.etag in (None, etag) and if_range.date is None:
+            byte_range = request.range.range_for_length(stat.st_size)
+            if byte_range is None and len(request.range.ranges) == 1:
+                response = Response("The requested range is not satisfiable", status=416)
+                response.headers['Content-Range'] = 'bytes */{}'.format(stat.st_size)
+                return response
+        if byte_range is None:
+            response = send_file(path, mimetype='application/zip', add_etags=False)
+        else:
+            start, stop = byte_range
+            response = Response(_read_range(path, start, stop - start), status=206,
+                                mimetype='application/zip', direct_passthrough=True)
+            response.headers['Content-Length'] = str(stop - start)
+            response.headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, stop - 1,
+                                                                        stat.st_size)
+    response.set_etag(etag, weak=weak)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
 
 
 @app.route('/worker/results', methods=['POST'])
 def worker_post_results():
-    content = request.get_json()
-    submission = Submission.get_submission_by_key(content['submission_key'])
-    if not (submission and submission.check_token(content['token'])):
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        # Decompress no more than a results body may hold, so a small gzip bomb
+        # can't take up all the memory of the process
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            data = decompressor.decompress(request.get_data(), MAX_RESULTS_SIZE)
+            if decompressor.unconsumed_tail:
+                return "Results may be at most {} bytes".format(MAX_RESULTS_SIZE), 413
+            content = json.loads(data.decode('utf-8'))
+        except (zlib.error, ValueError):
+            return "Results must be gzipped JSON", 400
+    else:
+        content = request.get_json()
+    info = Submission.get_submission_info(content['submission_key'])
+    if not (info and info.check_token(content['token'])):
         return "Error finding submission you want to post results on", 404
-    submission.results = content['results']
-    submission.results_at = datetime.utcnow()
-    db.session.commit()
+
+    writer = ingest.get_writer()
+    if writer is None:
+        info.post_results(content['results'])
+    else:
+        try:
+            writer.post(info, content['results'], timeout=get_config().ingest.timeout)
+        except ingest.IngestError as e:
+            return "{}; please try again".format(e), 503
     return "Submission results accepted", 200
 
 
@@ -0,0 +1,143 @@
+"""
+A client for grading workers, which fetch submitted code from the web broker's
+`/worker/code` and post results to `/worker/results`. One `WorkerClient` keeps a
+pool of keep-alive connections to the broker, streams each submission's archive
+to disk rather than holding it in memory, and gzips the results it posts.
+
+A worker given the payload of a task (its `submission_key` and `token`) does
+
+    with WorkerClient('https://autograder.example.com') as client:
+        client.grade(payload['submission_key'], payload['token'], run_tests)
+
+where `run_tests` takes the path to the downloaded archive and returns the results.
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+import gzip
+import io
+import json
+import logging
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .utils import NamedTemporaryDirectory
+
+
+logger = logging.getLogger(__name__)
+
+# How many bytes of a download are written at a time
+CHUNK_SIZE = 64 * 1024
+
+# Results smaller than this many bytes are posted without compressing them
+MIN_COMPRESS_SIZE = 1024
+
+
+def compress(data):
+    """ Gzip some bytes.
+
+    :param bytes data: The bytes
+    :rtype: bytes
+    """
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class WorkerClient(object):
+    """ Talks to the web broker on behalf of a worker. Errors from the broker are
+    raised as `requests.HTTPError`. """
+
+    def __init__(self, base_url, pool_size=10, timeout=60, retries=3, session=None):
+        """
+        :param str base_url: Where the broker is, e.g., https://autograder.example.com
+        :param int pool_size: The most connections to the broker kept open at once
+        :param float timeout: The seconds to wait to connect or for data before giving up
+        :param int retries: How many times to retry a request whose connection failed
+        :param requests.Session|None session: The session to send requests with
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                                  max_retries=retries)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """ Close the connections to the broker. """
+        self.session.close()
+
+    def download_code(self, submission_key, token, path):
+        """ Download a submission's archive to a file.
+
+        :param str submission_key: The key of the submission
+        :param str token: The token of its task
+        :param str path: Where to write the archive
+        :return: The number of bytes written
+        :rtype: int
+        """
+        response = self.session.get(self.base_url + '/worker/code',
+                                    params={'submission_key': submission_key, 'token': token},
+                                    stream=True, timeout=self.timeout)
+        try:
+            response.raise_for_status()
+            written = 0
+            with open(path, 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    written += len(chunk)
+            return written
+        finally:
+            # Hands the connection back to the pool
+            response.close()
+
+    def post_results(self, submission_key, token, results):
+        """ Post the results of grading a submission.
+
+        :param str submission_key: The key of the submission
+        :param str token: The token of its task
+        :param dict results: The results
+        """
+        body = json.dumps({'submission_key': submission_key, 'token': token,
+                           'results': results}).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            body = compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        response = self.session.post(self.base_url + '/worker/results', data=body,
+                                     headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+
+    def grade(self, submission_key, token, grader):
+        """ Download a submission's archive, grade it and post the results. If the
+        grader raises, results saying what went wrong are posted instead, as the local
+        backend does, so the submission isn't left waiting. Errors talking to the
+        broker are raised.
+
+        :param str submission_key: The key of the submission
+        :param str token: The token of its task
+        :param function grader: Given the path to the archive, returns the results
+        :return: The results posted
+        :rtype: dict
+        """
+        with NamedTemporaryDirectory() as directory:
+            archive = os.path.join(directory, 'submission.zip')
+            self.download_code(submission_key, token, archive)
+            try:
+                results = grader(archive)
+            except Exception as e:
+                logger.exception("Could not grade submission %s", submission_key)
+                results = {'error': '{}: {}'.format(type(e).__name__, e)}
+        self.post_results(submission_key, token, results)
+        return results
@@ -0,0 +1,91 @@
+"""
+Measure the Python CPU time `/worker/code` spends per fetch of a large archive:
+sending it whole through the WSGI loop, answering a repeated fetch with a 304,
+handing it to a proxy with X-Accel-Redirect, and sending the last tenth of it to
+a worker resuming a download.
+
+Run from the root of the repository with
+
+    python benchmarks/code_download.py [FETCHES] [ARCHIVE_MB]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+import yaml
+
+import autograder
+
+
+FETCHES = 200
+ARCHIVE_MB = 8
+
+
+def fetch(client, query, headers, fetches):
+    """ Return the CPU seconds each fetch took and the size of the last response """
+    start = time.clock()
+    for _ in range(fetches):
+        response = client.get('/worker/code', query_string=query, headers=headers)
+        data = response.get_data()
+    return (time.clock() - start) / fetches, response.status_code, len(data)
+
+
+def main():
+    fetches = int(sys.argv[1]) if len(sys.argv) > 1 else FETCHES
+    archive_mb = int(sys.argv[2]) if len(sys.argv) > 2 else ARCHIVE_MB
+    directory = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(directory, 'config.yml')
+        with open(config_path, 'w') as f:
+            yaml.dump({
+                'secret_key': 'itsasecret',
+                'sqlalchemy_database_uri': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+                'iron': {'project_id': 'notnecessary'},
+                'submissions_directory': directory,
+                'holding_directory': directory
+            }, f)
+        autograder.setup_app(config_path)
+
+        from autograder import models, storage, web
+        from autograder.config import get_config
+        models.drop_all()
+        models.create_all()
+        teacher = models.User.add_user(u'teacher', 'pass')
+        student = models.User.add_user(u'student', 'word')
+        unit = models.Unit.add_unit('Class', teacher)
+        models.Registration.add_registration(student, unit)
+        project = models.Project.add_project('project', 'hello.exe', teacher)
+        assignment = models.Assignment.add_assignment(teacher, unit, project)
+
+        archive = os.path.join(directory, 'code.zip')
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('data.bin', os.urandom(archive_mb * 1024 * 1024))
+        submission, token = models.Submission.add_submission(
+            student, assignment, archive_digest=storage.push_code(archive))
+        query = {'submission_key': submission.submission_key, 'token': token}
+        etag = '"{}"'.format(submission.archive_digest)
+        size = os.path.getsize(submission.archive)
+        client = web.app.test_client()
+
+        runs = [('whole', {}, None),
+                ('304', {'If-None-Match': etag}, None),
+                ('offloaded', {}, 'x-accel-redirect'),
+                ('last 10%', {'Range': 'bytes={}-'.format(size - size // 10)}, None)]
+        for name, headers, offload in runs:
+            get_config().downloads.offload = offload
+            seconds, status, length = fetch(client, query, headers, fetches)
+            print("{:>10}: {:.2f}ms CPU a fetch ({} with {} bytes)".format(
+                name, 1000 * seconds, status, length))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Compare building a gradebook (each student's best score and the pass rate of each
+test) by decoding every submission's results in Python with the aggregate queries
+over `SubmissionResult`.
+
+Run from the root of the repository with
+
+    python benchmarks/gradebook.py [NUMBER_OF_STUDENTS] [SUBMISSIONS_PER_STUDENT]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import collections
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+import autograder
+
+
+STUDENTS = 500
+SUBMISSIONS_PER_STUDENT = 5
+TESTS = 20
+
+
+def make_results(seed):
+    return {'tests': [{'name': 'test_{}'.format(i), 'passed': (seed + i) % 3 != 0,
+                       'score': 1.0 if (seed + i) % 3 else 0.0, 'duration': 0.01}
+                      for i in range(TESTS)]}
+
+
+def gradebook_in_python(models, assignment_id):
+    best = {}
+    passes = collections.Counter()
+    totals = collections.Counter()
+    submissions = (models.Submission.query
+                   .filter(models.Submission.assignment_id == assignment_id,
+                           models.Submission.results_at.isnot(None)))
+    for submission in submissions:
+        tests = submission.results['tests']
+        score = sum(test['score'] for test in tests)
+        best[submission.user_id] = max(score, best.get(submission.user_id, score))
+        for test in tests:
+            totals[test['name']] += 1
+            passes[test['name']] += bool(test['passed'])
+    return best, {name: float(passes[name]) / totals[name] for name in totals}
+
+
+def gradebook_in_sql(models, assignment):
+    return (models.SubmissionResult.get_best_scores(assignment),
+            models.SubmissionResult.get_pass_rates(assignment))
+
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else STUDENTS
+    per_student = int(sys.argv[2]) if len(sys.argv) > 2 else SUBMISSIONS_PER_STUDENT
+    directory = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(directory, 'config.yml')
+        with open(config_path, 'w') as f:
+            yaml.dump({
+                'secret_key': 'itsasecret',
+                'sqlalchemy_database_uri': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+                'iron': {'project_id': 'notnecessary'},
+                'submissions_directory': directory,
+                'holding_directory': directory
+            }, f)
+        autograder.setup_app(config_path)
+
+        from autograder import models
+        models.create_all()
+        teacher = models.User.add_user(u'teacher', 'pass')
+        unit = models.Unit.add_unit('Class', teacher)
+        project = models.Project.add_project('project', 'hello.exe', teacher)
+        assignment = models.Assignment.add_assignment(teacher, unit, project)
+        assignment_id = assignment.id
+
+        entries = [(user_id, assignment_id, None)
+                   for user_id in range(1, students + 1) for _ in range(per_student)]
+        created = models.Submission.add_submissions(entries)
+        models.Submission.post_results_many([
+            (submission.submission_key, token, make_results(i))
+            for i, (submission, token) in enumerate(created)])
+        print("{} students, {} graded submissions, {} tests each".format(
+            students, len(created), TESTS))
+
+        models.db.session.remove()
+        start = time.time()
+        in_python = gradebook_in_python(models, assignment_id)
+        print("decoding every result in Python: {:.3f} s".format(time.time() - start))
+
+        models.db.session.remove()
+        assignment = models.Assignment.query.get(assignment_id)
+        start = time.time()
+        in_sql = gradebook_in_sql(models, assignment)
+        print("aggregating SubmissionResult in SQL: {:.3f} s".format(time.time() - start))
+        assert in_python == in_sql
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Measure submission lookups with and without the indexes declared on the models.
+A throwaway SQLite database is seeded with submissions, the submissions indexes
+are dropped and lookups are timed, then `models.create_indexes` puts them back
+and the lookups are timed again.
+
+Run from the root of the repository with
+
+    python benchmarks/indexes.py [NUMBER_OF_SUBMISSIONS]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import yaml
+
+import autograder
+
+
+SUBMISSIONS = 1000000
+USERS = 500
+ASSIGNMENTS = 40
+LOOKUPS = 200
+
+SUBMISSION_INDEXES = ('ix_submissions_submission_key', 'ix_submissions_user_id_assignment_id',
+                      'ix_submissions_assignment_id')
+
+
+def seed(models, count):
+    """ Insert `count` bare submissions with a raw executemany and return their keys """
+    keys = [str(uuid.uuid4()) for _ in range(count)]
+    connection = models.db.engine.raw_connection()
+    cursor = connection.cursor()
+    cursor.executemany(
+        "INSERT INTO submissions (user_id, assignment_id, submission_key, token_hash) "
+        "VALUES (?, ?, ?, ?)",
+        ((i % USERS, i % ASSIGNMENTS, key, 'x') for i, key in enumerate(keys)))
+    connection.commit()
+    connection.close()
+    return keys
+
+
+def time_lookups(models, keys, label):
+    session = models.db.session
+    Submission = models.Submission
+
+    start = time.time()
+    for key in random.sample(keys, LOOKUPS):
+        session.query(Submission).filter(Submission.submission_key == key).first()
+    by_key = (time.time() - start) / LOOKUPS
+
+    start = time.time()
+    for i in range(LOOKUPS):
+        (session.query(Submission.id)
+         .filter(Submission.user_id == i % USERS,
+                 Submission.assignment_id == i % ASSIGNMENTS)
+         .count())
+    by_pair = (time.time() - start) / LOOKUPS
+
+    print("{}: by key {:.3f} ms, count by (user, assignment) {:.3f} ms".format(
+        label, by_key * 1000, by_pair * 1000))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else SUBMISSIONS
+    directory = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(directory, 'config.yml')
+        with open(config_path, 'w') as f:
+            yaml.dump({
+                'secret_key': 'itsasecret',
+                'sqlalchemy_database_uri': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+                'iron': {'project_id': 'notnecessary'},
+                'submissions_directory': directory,
+                'holding_directory': directory
+            }, f)
+        autograder.setup_app(config_path)
+
+        from autograder import models
+        models.db.create_all()
+        keys = seed(models, count)
+
+        for name in SUBMISSION_INDEXES:
+            models.db.engine.execute('DROP INDEX {}'.format(name))
+        time_lookups(models, keys, 'without indexes')
+
+        start = time.time()
+        models.create_indexes()
+        print("create_indexes took {:.1f} s".format(time.time() - start))
+        time_lookups(models, keys, 'with indexes')
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
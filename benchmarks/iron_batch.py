@@ -0,0 +1,75 @@
+"""
+Measure how fast tasks can be queued on iron.io at different batch sizes. The
+requests go to the stand-in iron.io server used by the tests, so this measures
+the client's overhead per request rather than iron.io itself.
+
+Run from the root of the repository with
+
+    python benchmarks/iron_batch.py
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+import autograder  # noqa: E402
+from test_iron_queue import FakeIronHandler, ThreadingHTTPServer  # noqa: E402
+
+
+TASKS = 2000
+BATCH_SIZES = (1, 10, 100)
+
+
+def main():
+    server = ThreadingHTTPServer(('localhost', 0), FakeIronHandler)
+    server.failures = 0
+    server.requests = []
+    server.tasks = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    directory = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(directory, 'config.yml')
+        with open(config_path, 'w') as f:
+            yaml.dump({
+                'secret_key': 'itsasecret',
+                'sqlalchemy_database_uri': 'sqlite://',
+                'iron': {
+                    'project_id': 'notnecessary',
+                    'token': 'nottoken',
+                    'host': 'localhost',
+                    'port': server.server_address[1],
+                    'protocol': 'http'
+                },
+                'submissions_directory': directory,
+                'holding_directory': directory
+            }, f)
+        autograder.setup_app(config_path)
+
+        from autograder.queues import iron
+        for batch_size in BATCH_SIZES:
+            tasks = [iron.Task(code_name='project', payload={'n': n}) for n in range(TASKS)]
+            start = time.time()
+            iron.queue_many(tasks, batch_size=batch_size)
+            elapsed = time.time() - start
+            print("batch size {:>3}: {:>8.0f} tasks/sec".format(batch_size, TASKS / elapsed))
+        iron.get_worker().client.session.close()
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Compare the time to set up a grading task's directory from a payload with large
+test fixtures: unzipping the whole payload for every task, as the local backend
+used to, against linking it from a `payload_cache.PayloadCache`.
+
+Run from the root of the repository with
+
+    python benchmarks/payload_cache.py [FIXTURES] [FIXTURE_KB]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+from autograder.payload_cache import PayloadCache
+from autograder.utils import NamedTemporaryDirectory
+
+
+FIXTURES = 200
+FIXTURE_KB = 512
+TASKS = 20
+
+
+def make_payload(path, fixtures, fixture_kb):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('grader.py', 'print("{}")\n')
+        for n in range(fixtures):
+            zf.writestr('fixtures/case{}.txt'.format(n), os.urandom(fixture_kb * 1024))
+
+
+def unzipped(payload, cache):
+    with NamedTemporaryDirectory() as workdir:
+        with zipfile.ZipFile(payload) as zf:
+            zf.extractall(workdir)
+
+
+def linked(payload, cache):
+    with NamedTemporaryDirectory(dir=cache.task_directory) as workdir:
+        cache.checkout(payload, workdir)
+
+
+def main():
+    fixtures = int(sys.argv[1]) if len(sys.argv) > 1 else FIXTURES
+    fixture_kb = int(sys.argv[2]) if len(sys.argv) > 2 else FIXTURE_KB
+    directory = tempfile.mkdtemp()
+    try:
+        payload = os.path.join(directory, 'payload.zip')
+        make_payload(payload, fixtures, fixture_kb)
+        cache = PayloadCache(os.path.join(directory, 'cache'), 10 * 1024 ** 3)
+        cache.setup()
+
+        start = time.time()
+        linked(payload, cache)
+        print("{:>10}: {:.1f}ms".format('first link', 1000 * (time.time() - start)))
+        for name, setup in (('unzipped', unzipped), ('linked', linked)):
+            start = time.time()
+            for _ in range(TASKS):
+                setup(payload, cache)
+            elapsed = time.time() - start
+            print("{:>10}: {:.1f}ms a task".format(name, 1000 * elapsed / TASKS))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
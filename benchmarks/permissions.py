@@ -0,0 +1,88 @@
+"""
+Compare checking that a student may submit an assignment by loading all of their
+registrations with the single EXISTS query `Registration.is_registered` makes, as
+the number of units the student is registered in grows.
+
+Run from the root of the repository with
+
+    python benchmarks/permissions.py [MOST_UNITS]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+import autograder
+
+
+MOST_UNITS = 10000
+REPEATS = 200
+
+
+def main():
+    most_units = int(sys.argv[1]) if len(sys.argv) > 1 else MOST_UNITS
+    directory = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(directory, 'config.yml')
+        with open(config_path, 'w') as f:
+            yaml.dump({
+                'secret_key': 'itsasecret',
+                'sqlalchemy_database_uri': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+                'iron': {'project_id': 'notnecessary'},
+                'submissions_directory': directory,
+                'holding_directory': directory
+            }, f)
+        autograder.setup_app(config_path)
+
+        from autograder import models
+        models.create_all()
+        teacher = models.User.add_user(u'teacher', 'pass')
+        student = models.User.add_user(u'student', 'pass')
+        teacher_id, student_id = teacher.id, student.id
+
+        units = 0
+        number = 10
+        while number <= most_units:
+            models.db.session.execute(
+                models.Unit.__table__.insert(),
+                [{'description': 'Class', 'creator_id': teacher_id}
+                 for _ in range(number - units)])
+            unit_ids = [row[0] for row in models.db.session.query(models.Unit.id)
+                        .order_by(models.Unit.id).offset(units)]
+            models.db.session.execute(
+                models.Registration.__table__.insert(),
+                [{'user_id': student_id, 'unit_id': unit_id} for unit_id in unit_ids])
+            models.db.session.commit()
+            units = number
+            unit_id = unit_ids[-1]
+
+            start = time.time()
+            for _ in range(REPEATS):
+                models.db.session.remove()
+                student = models.User.query.get(student_id)
+                assert any(unit_id == reg.unit_id for reg in student.registrations)
+            loaded = (time.time() - start) / REPEATS * 1000
+
+            start = time.time()
+            for _ in range(REPEATS):
+                models.db.session.remove()
+                student = models.User.query.get(student_id)
+                assert models.Registration.is_registered(student, unit_id)
+            exists = (time.time() - start) / REPEATS * 1000
+
+            print("{:6d} units: load registrations {:7.2f} ms, EXISTS {:5.2f} ms".format(
+                units, loaded, exists))
+            number *= 10
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
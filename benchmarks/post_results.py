@@ -0,0 +1,92 @@
+"""
+Compare posting results one submission and one commit at a time with
+`Submission.post_results_many`, which posts a batch with one UPDATE and one
+commit. By default a throwaway SQLite database is used; pass a SQLAlchemy URI
+(e.g. for a local PostgreSQL database) to run against that instead. The tables
+in that database are dropped and recreated.
+
+Run from the root of the repository with
+
+    python benchmarks/post_results.py [NUMBER_OF_RESULTS] [DATABASE_URI]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+import autograder
+from autograder.utils import chunked
+
+
+RESULTS = 10000
+BATCH_SIZE = 500
+
+RESULT = {'grade': 'A', 'tests': [{'name': 'test_{}'.format(i), 'passed': True}
+                                  for i in range(20)]}
+
+
+def make_submissions(models, assignment_id, user_id, count):
+    created = models.Submission.add_submissions([(user_id, assignment_id, None)] * count)
+    keys = [(submission.submission_key, token) for submission, token in created]
+    models.db.session.remove()
+    return keys
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else RESULTS
+    directory = tempfile.mkdtemp()
+    try:
+        database_uri = (sys.argv[2] if len(sys.argv) > 2 else
+                        'sqlite:///' + os.path.join(directory, 'bench.db'))
+        config_path = os.path.join(directory, 'config.yml')
+        with open(config_path, 'w') as f:
+            yaml.dump({
+                'secret_key': 'itsasecret',
+                'sqlalchemy_database_uri': database_uri,
+                'iron': {'project_id': 'notnecessary'},
+                'submissions_directory': directory,
+                'holding_directory': directory
+            }, f)
+        autograder.setup_app(config_path)
+
+        from autograder import models
+        models.drop_all()
+        models.create_all()
+        teacher = models.User.add_user(u'teacher', 'pass')
+        unit = models.Unit.add_unit('Class', teacher)
+        project = models.Project.add_project('project', 'hello.exe', teacher)
+        assignment = models.Assignment.add_assignment(teacher, unit, project)
+        user_id, assignment_id = teacher.id, assignment.id
+        print("{} results against {}".format(count, models.db.engine.dialect.name))
+
+        keys = make_submissions(models, assignment_id, user_id, count)
+        start = time.time()
+        for submission_key, token in keys:
+            submission = models.Submission.get_submission_by_key(submission_key)
+            if submission.check_token(token):
+                submission.post_results(RESULT)
+        elapsed = time.time() - start
+        print("one commit per result: {:.1f} s, {:.0f} results/sec".format(
+            elapsed, count / elapsed))
+
+        keys = make_submissions(models, assignment_id, user_id, count)
+        start = time.time()
+        for batch in chunked(keys, BATCH_SIZE):
+            models.Submission.post_results_many([(submission_key, token, RESULT)
+                                                 for submission_key, token in batch])
+        elapsed = time.time() - start
+        print("post_results_many, {} per batch: {:.1f} s, {:.0f} results/sec".format(
+            BATCH_SIZE, elapsed, count / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Measure how fast /worker/results accepts results from many workers at once,
+with each request committing on its own and with requests going through the
+batching writer in `autograder.ingest`. Requests are made through the Flask
+test client from a pool of threads against a throwaway SQLite database.
+
+Run from the root of the repository with
+
+    python benchmarks/result_ingest.py [NUMBER_OF_RESULTS] [NUMBER_OF_THREADS]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+import autograder
+
+
+RESULTS = 2000
+THREADS = 32
+
+
+def post_all(client, submissions):
+    for submission_key, token in submissions:
+        response = client.post('/worker/results', content_type='application/json',
+                               data=json.dumps({'submission_key': submission_key,
+                                                'token': token,
+                                                'results': {'grade': 'A', 'tests': [1] * 20}}))
+        assert response.status_code == 200, response.data
+
+
+def time_posts(app, submissions, threads, label):
+    shares = [submissions[i::threads] for i in range(threads)]
+    workers = [threading.Thread(target=post_all, args=(app.test_client(), share))
+               for share in shares]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+    print("{}: {:.0f} results/sec".format(label, len(submissions) / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else RESULTS
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else THREADS
+    directory = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(directory, 'config.yml')
+        with open(config_path, 'w') as f:
+            yaml.dump({
+                'secret_key': 'itsasecret',
+                'sqlalchemy_database_uri': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+                'iron': {'project_id': 'notnecessary'},
+                'submissions_directory': directory,
+                'holding_directory': directory
+            }, f)
+        autograder.setup_app(config_path)
+
+        from autograder import models, web
+        from autograder.config import get_config
+        models.create_all()
+        teacher = models.User.add_user(u'teacher', 'pass')
+        unit = models.Unit.add_unit('Class', teacher)
+        project = models.Project.add_project('project', 'hello.exe', teacher)
+        assignment = models.Assignment.add_assignment(teacher, unit, project)
+        teacher_id, assignment_id = teacher.id, assignment.id
+
+        for enabled, label in ((False, 'commit per request'), (True, 'batching writer')):
+            created = models.Submission.add_submissions(
+                [(teacher_id, assignment_id, None)] * count)
+            submissions = [(submission.submission_key, token) for submission, token in created]
+            models.db.session.remove()
+            get_config().ingest.enabled = enabled
+            time_posts(web.app, submissions, threads, label)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
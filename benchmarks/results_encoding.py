@@ -0,0 +1,90 @@
+"""
+Compare how results are stored now (compact JSON compressed with zlib) with the
+plain JSON text they used to be stored as: the bytes stored per result, and the
+time to load every submission of an assignment with and without reading their
+results.
+
+Run from the root of the repository with
+
+    python benchmarks/results_encoding.py [NUMBER_OF_SUBMISSIONS]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+import autograder
+
+
+SUBMISSIONS = 5000
+
+# Results like a grader with 50 test cases would report
+RESULT = {
+    'grade': 87.5,
+    'returncode': 0,
+    'timed_out': False,
+    'tests': [{'name': 'test_case_{}'.format(i), 'passed': i % 7 != 0, 'score': 2.0,
+               'duration': 0.013, 'message': '' if i % 7 else 'AssertionError: 3 != 4'}
+              for i in range(50)]
+}
+
+
+def time_load(models, read_results):
+    models.db.session.remove()
+    start = time.time()
+    submissions = models.Submission.query.all()
+    if read_results:
+        for submission in submissions:
+            submission.results
+    return time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else SUBMISSIONS
+    directory = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(directory, 'config.yml')
+        with open(config_path, 'w') as f:
+            yaml.dump({
+                'secret_key': 'itsasecret',
+                'sqlalchemy_database_uri': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+                'iron': {'project_id': 'notnecessary'},
+                'submissions_directory': directory,
+                'holding_directory': directory
+            }, f)
+        autograder.setup_app(config_path)
+
+        from autograder import models
+        models.create_all()
+        teacher = models.User.add_user(u'teacher', 'pass')
+        unit = models.Unit.add_unit('Class', teacher)
+        project = models.Project.add_project('project', 'hello.exe', teacher)
+        assignment = models.Assignment.add_assignment(teacher, unit, project)
+        created = models.Submission.add_submissions([(teacher.id, assignment.id, None)] * count)
+        models.Submission.post_results_many([(submission.submission_key, token, RESULT)
+                                             for submission, token in created])
+
+        print("plain JSON: {} bytes per result".format(len(json.dumps(RESULT))))
+        print("compressed: {} bytes per result".format(len(models.encode_results(RESULT))))
+        print("load {} submissions: {:.3f} s".format(count, time_load(models, False)))
+        print("load {} submissions and read results: {:.3f} s".format(
+            count, time_load(models, True)))
+
+        models.db.engine.execute(models.Submission.__table__.update().values(
+            results=json.dumps(RESULT)))
+        print("load {} legacy JSON submissions and read results: {:.3f} s".format(
+            count, time_load(models, True)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Measure what running a grading command in the sandbox costs over running it with
+a plain `subprocess.Popen.communicate`, the way the local backend used to.
+
+Run from the root of the repository with
+
+    python benchmarks/sandbox.py [RUNS]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from autograder import sandbox
+
+
+RUNS = 200
+COMMAND = 'python -c "print(1)"'
+LIMITS = sandbox.Limits(cpu_time=60, memory=512 * 1024 * 1024, max_processes=64,
+                        max_output=1024 * 1024)
+
+
+def plain(directory):
+    process = subprocess.Popen(COMMAND, shell=True, cwd=directory, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, preexec_fn=os.setsid)
+    process.communicate()
+
+
+def sandboxed(directory):
+    sandbox.run(COMMAND, directory, timeout=60, limits=LIMITS)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    directory = tempfile.mkdtemp()
+    try:
+        for name, run in (('plain', plain), ('sandboxed', sandboxed)):
+            start = time.time()
+            for _ in range(runs):
+                run(directory)
+            elapsed = time.time() - start
+            print("{:>10}: {:.2f}ms a run".format(name, 1000 * elapsed / runs))
+    finally:
+        os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Simulate a deadline rush on the local backend: one student has queued many
+resubmissions just before the rest of the class submits for the first time,
+and a second unit's class submits at the same time. Compare how long first
+submissions wait when tasks are graded in the order they arrived with the
+order `scheduling.TaskQueue` takes them in.
+
+Run from the root of the repository with
+
+    python benchmarks/scheduling.py [RESUBMISSIONS] [STUDENTS]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import collections
+from datetime import datetime, timedelta
+import heapq
+import sys
+
+from autograder import scheduling
+
+
+RESUBMISSIONS = 50
+STUDENTS = 30
+PROCESSES = 4
+# How many seconds grading a submission takes
+GRADING_TIME = 10.0
+
+
+def simulate(queue, take):
+    """ Run the queued tasks on `PROCESSES` processes and return how long each waited """
+    waits = {}
+    finishing = []
+    now = 0.0
+    while queue or finishing:
+        while len(finishing) < PROCESSES and queue:
+            task, unit_id = take(now)
+            waits[task] = now
+            heapq.heappush(finishing, (now + GRADING_TIME, unit_id))
+        now, unit_id = heapq.heappop(finishing)
+        if hasattr(queue, 'done'):
+            queue.done(unit_id)
+    return waits
+
+
+def main():
+    resubmissions = int(sys.argv[1]) if len(sys.argv) > 1 else RESUBMISSIONS
+    students = int(sys.argv[2]) if len(sys.argv) > 2 else STUDENTS
+    now = datetime(2016, 1, 1)
+    due_soon = now + timedelta(hours=1)
+
+    tasks = [('spammer', n + 1, 'unit1') for n in range(resubmissions)]
+    tasks += [('student{}'.format(n), 1, 'unit{}'.format(n % 2 + 1)) for n in range(students)]
+
+    fifo = collections.deque((task, task[2]) for task in tasks)
+    fifo_waits = simulate(fifo, lambda now: fifo.popleft())
+
+    queue = scheduling.TaskQueue()
+    for task in tasks:
+        queue.put(task, scheduling.get_priority(task[1], due_soon, now=now), task[2], now=0)
+
+    def take(now):
+        task, _, unit_id, _ = queue.take(now=now)
+        return task, unit_id
+    scheduled_waits = simulate(queue, take)
+
+    for name, waits in (('arrival order', fifo_waits), ('TaskQueue', scheduled_waits)):
+        firsts = [wait for task, wait in waits.items() if task[0] != 'spammer']
+        spammer = [wait for task, wait in waits.items() if task[0] == 'spammer']
+        print("{:13s}: first submissions wait {:6.1f} s mean, {:6.1f} s max; "
+              "resubmissions {:6.1f} s mean".format(
+                  name, sum(firsts) / len(firsts), max(firsts), sum(spammer) / len(spammer)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Compare checking a user's submissions against an assignment's limit by counting
+their rows in the submissions table with the conditional UPDATE of their summary
+row that `Submission.reserve_submission` makes, as the user's submissions grow.
+
+Run from the root of the repository with
+
+    python benchmarks/submission_limit.py [MOST_SUBMISSIONS]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+import autograder
+
+
+MOST_SUBMISSIONS = 100000
+REPEATS = 200
+
+
+def main():
+    most_submissions = int(sys.argv[1]) if len(sys.argv) > 1 else MOST_SUBMISSIONS
+    directory = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(directory, 'config.yml')
+        with open(config_path, 'w') as f:
+            yaml.dump({
+                'secret_key': 'itsasecret',
+                'sqlalchemy_database_uri': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+                'iron': {'project_id': 'notnecessary'},
+                'submissions_directory': directory,
+                'holding_directory': directory
+            }, f)
+        autograder.setup_app(config_path)
+
+        from autograder import models
+        models.create_all()
+        teacher = models.User.add_user(u'teacher', 'pass')
+        unit = models.Unit.add_unit('Class', teacher)
+        models.Registration.add_registration(teacher, unit)
+        project = models.Project.add_project('project', 'hello.exe', teacher)
+        assignment = models.Assignment.add_assignment(teacher, unit, project,
+                                                      max_submissions=10 * most_submissions)
+        user_id, assignment_id = teacher.id, assignment.id
+        # Keep the assignment loaded through the rollbacks below
+        models.db.session.expunge(assignment)
+        Submission = models.Submission
+
+        submissions = 0
+        number = 100
+        while number <= most_submissions:
+            models.Submission.add_submissions(
+                [(user_id, assignment_id, None)] * (number - submissions))
+            submissions = number
+
+            start = time.time()
+            for _ in range(REPEATS):
+                count = (models.db.session.query(models.sqlalchemy.func.count(Submission.id))
+                         .filter(Submission.user_id == user_id,
+                                 Submission.assignment_id == assignment_id)
+                         .scalar())
+                assert count < assignment.max_submissions
+                models.db.session.rollback()
+            counted = (time.time() - start) / REPEATS * 1000
+
+            start = time.time()
+            for _ in range(REPEATS):
+                assert models.SubmissionSummary.reserve_submission(user_id, assignment)
+                models.db.session.rollback()
+            reserved = (time.time() - start) / REPEATS * 1000
+
+            print("{:7d} submissions: COUNT(*) {:6.2f} ms, conditional UPDATE {:5.2f} ms".format(
+                submissions, counted, reserved))
+            number *= 10
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
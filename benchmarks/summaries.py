@@ -0,0 +1,93 @@
+"""
+Compare finding every student's latest and best submission to an assignment by
+grouping the submissions table with reading the maintained submission_summaries
+table.
+
+Run from the root of the repository with
+
+    python benchmarks/summaries.py [NUMBER_OF_STUDENTS] [SUBMISSIONS_PER_STUDENT]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+import autograder
+
+
+STUDENTS = 500
+SUBMISSIONS_PER_STUDENT = 100
+REPEATS = 20
+
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else STUDENTS
+    per_student = int(sys.argv[2]) if len(sys.argv) > 2 else SUBMISSIONS_PER_STUDENT
+    directory = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(directory, 'config.yml')
+        with open(config_path, 'w') as f:
+            yaml.dump({
+                'secret_key': 'itsasecret',
+                'sqlalchemy_database_uri': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+                'iron': {'project_id': 'notnecessary'},
+                'submissions_directory': directory,
+                'holding_directory': directory
+            }, f)
+        autograder.setup_app(config_path)
+
+        from autograder import models
+        models.create_all()
+        teacher = models.User.add_user(u'teacher', 'pass')
+        unit = models.Unit.add_unit('Class', teacher)
+        project = models.Project.add_project('project', 'hello.exe', teacher)
+        assignment = models.Assignment.add_assignment(teacher, unit, project)
+        assignment_id = assignment.id
+
+        start = time.time()
+        for _ in range(per_student):
+            created = models.Submission.add_submissions(
+                [(user_id, assignment_id, None) for user_id in range(1, students + 1)])
+            models.Submission.post_results_many([
+                (submission.submission_key, token,
+                 {'tests': [{'name': 'test', 'passed': True, 'score': submission.id % 17}]})
+                for submission, token in created])
+            models.db.session.remove()
+        print("{} students, {} submissions each; seeding took {:.1f} s".format(
+            students, per_student, time.time() - start))
+
+        Submission = models.Submission
+        func = models.sqlalchemy.func
+        start = time.time()
+        for _ in range(REPEATS):
+            latest = dict(models.db.session.query(Submission.user_id, func.max(Submission.id))
+                          .filter(Submission.assignment_id == assignment_id)
+                          .group_by(Submission.user_id))
+            best = models.SubmissionResult.get_best_scores(
+                models.Assignment.query.get(assignment_id))
+        print("GROUP BY over submissions: {:.1f} ms".format(
+            (time.time() - start) / REPEATS * 1000))
+
+        start = time.time()
+        for _ in range(REPEATS):
+            rows = (models.db.session.query(models.SubmissionSummary)
+                    .filter(models.SubmissionSummary.assignment_id == assignment_id)
+                    .all())
+        print("read submission_summaries: {:.1f} ms".format(
+            (time.time() - start) / REPEATS * 1000))
+        assert {row.user_id: row.latest_submission_id for row in rows} == latest
+        assert {row.user_id: row.best_score for row in rows} == best
+        assert models.SubmissionSummary.check_summaries() == []
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compare the time to hash and check a worker's token with the keyed HMAC-SHA256
+digest tokens are now stored as, against the salted PBKDF2 password hash they
+used to be stored as.
+
+Run from the root of the repository with
+
+    python benchmarks/tokens.py [NUMBER_OF_CHECKS]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+from werkzeug.security import generate_password_hash
+
+import autograder
+from autograder.utils import random_token
+
+
+CHECKS = 2000
+
+
+def pbkdf2_hash(models, token):
+    return generate_password_hash(token, salt_length=models.SALT_LENGTH,
+                                  method=models.PW_HASH_METHOD)
+
+
+def time_scheme(models, make_hash, token, count):
+    start = time.time()
+    for _ in range(count):
+        token_hash = make_hash(token)
+    hashed = time.time() - start
+
+    start = time.time()
+    for _ in range(count):
+        assert models.check_token_hash(token_hash, token)
+    checked = time.time() - start
+    return hashed, checked
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else CHECKS
+    directory = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(directory, 'config.yml')
+        with open(config_path, 'w') as f:
+            yaml.dump({
+                'secret_key': 'itsasecret',
+                'sqlalchemy_database_uri': 'sqlite://',
+                'iron': {'project_id': 'notnecessary'},
+                'submissions_directory': directory,
+                'holding_directory': directory
+            }, f)
+        autograder.setup_app(config_path)
+
+        from autograder import models
+        token = random_token()
+        schemes = (('pbkdf2', lambda t: pbkdf2_hash(models, t)),
+                   (models.TOKEN_HASH_METHOD, models.hash_token))
+        for name, make_hash in schemes:
+            hashed, checked = time_scheme(models, make_hash, token, count)
+            print("{:>12}: {:.1f}us a hash, {:.1f}us a check".format(
+                name, 1e6 * hashed / count, 1e6 * checked / count))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
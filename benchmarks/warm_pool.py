@@ -0,0 +1,66 @@
+"""
+Compare the per-submission latency of a python grader run cold, as a new
+interpreter which imports its test framework, with running it warm in a child
+forked from a process which has already imported it, as the local backend's
+warm mode does.
+
+Run from the root of the repository with
+
+    python benchmarks/warm_pool.py [RUNS]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import os
+import pipes
+import shutil
+import sys
+import tempfile
+import time
+
+from autograder import sandbox
+from autograder.queues import local
+
+
+RUNS = 50
+PRELOAD = ['unittest', 'decimal', 'json', 'xml.dom.minidom', 'email.mime.multipart',
+           'logging.handlers', 'sqlite3']
+HARNESS = """
+import json, unittest
+{imports}
+
+class Test(unittest.TestCase):
+    def test_it(self):
+        self.assertEqual(1 + 1, 2)
+
+result = unittest.TextTestRunner(stream=open(__import__('os').devnull, 'w')).run(
+    unittest.defaultTestLoader.loadTestsFromTestCase(Test))
+print(json.dumps({{'passed': result.wasSuccessful()}}))
+""".format(imports='\n'.join('import {}'.format(module) for module in PRELOAD))
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    directory = tempfile.mkdtemp()
+    try:
+        harness = os.path.join(directory, 'harness.py')
+        with open(harness, 'w') as f:
+            f.write(HARNESS)
+        command = '{} harness.py'.format(pipes.quote(sys.executable))
+        local.warm_up(PRELOAD)
+
+        for name, run in (('cold', lambda: sandbox.run(command, directory, timeout=60)),
+                          ('warm', lambda: sandbox.run_script([harness], directory,
+                                                              timeout=60))):
+            start = time.time()
+            for _ in range(runs):
+                assert b'true' in run().stdout
+            elapsed = time.time() - start
+            print("{}: {:.1f}ms a submission".format(name, 1000 * elapsed / runs))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
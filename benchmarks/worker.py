@@ -0,0 +1,120 @@
+"""
+Measure the throughput of a worker fetching and posting results for many
+submissions against a stand-in for the web broker: once the way worker scripts
+were written, with a new connection per request and the archive read into
+memory, and once with `worker.WorkerClient`.
+
+Run from the root of the repository with
+
+    python benchmarks/worker.py [SUBMISSIONS] [ARCHIVE_KB]
+
+@author Kevin Wilson - khwilson@gmail.com
+"""
+from __future__ import print_function
+
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from autograder.worker import WorkerClient
+
+
+SUBMISSIONS = 1000
+ARCHIVE_KB = 64
+RESULTS = {'tests': [{'name': 'test{}'.format(n), 'passed': n % 3 != 0,
+                      'output': 'expected 42 but got 41\n' * 4} for n in range(50)]}
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class BrokerHandler(BaseHTTPRequestHandler):
+    """ Serves the same archive for any submission and accepts any results """
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # As servers in front of the broker do, so responses aren't held back by
+        # Nagle's algorithm waiting on a delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.respond(self.server.archive)
+
+    def do_POST(self):
+        self.server.received += int(self.headers['Content-Length'])
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.respond(b'Submission results accepted')
+
+    def respond(self, body):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def naive(base_url, submissions):
+    for n in range(submissions):
+        response = requests.get(base_url + '/worker/code',
+                                params={'submission_key': str(n), 'token': 'token'})
+        response.raise_for_status()
+        archive = response.content
+        assert archive
+        response = requests.post(base_url + '/worker/results',
+                                 data=json.dumps({'submission_key': str(n), 'token': 'token',
+                                                  'results': RESULTS}),
+                                 headers={'Content-Type': 'application/json'})
+        response.raise_for_status()
+
+
+def pooled(base_url, submissions):
+    with WorkerClient(base_url) as client:
+        for n in range(submissions):
+            client.grade(str(n), 'token', lambda archive: RESULTS)
+
+
+def main():
+    submissions = int(sys.argv[1]) if len(sys.argv) > 1 else SUBMISSIONS
+    archive_kb = int(sys.argv[2]) if len(sys.argv) > 2 else ARCHIVE_KB
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BrokerHandler)
+    server.archive = os.urandom(archive_kb * 1024)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    base_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    tempfile.tempdir = tempfile.mkdtemp()
+    try:
+        for name, run in (('naive', naive), ('pooled', pooled)):
+            server.connections = server.received = 0
+            start = time.time()
+            run(base_url, submissions)
+            elapsed = time.time() - start
+            print("{:>6}: {:.0f} submissions/s, {} connections, {}KB of results posted".format(
+                name, submissions / elapsed, server.connections, server.received // 1024))
+    finally:
+        os.rmdir(tempfile.tempdir)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Fixtures shared by the test modules.
+
+A module can set `CONFIG` to a dict of settings to add to its config file, e.g.,
+`CONFIG = {'local': {'processes': 2}}`, and `DATABASE_FILE = True` if its database
+has to be a file every thread and process can see rather than an in-memory one.
+"""
+import os
+import shutil
+import tempfile
+
+import pytest
+import yaml
+
+import autograder
+
+
+def write_config(request, extra=None, database_file=False):
+    """ Write a config file on disk which is removed, along with its directories and
+    database, when the request is finished.
+
+    :param request: The py.test request the config is for
+    :param dict|None extra: Settings to add to the config. Sections which are dicts
+        are merged into the defaults.
+    :param bool database_file: Whether the database should be a file rather than in memory
+    :return: The path to the config
+    :rtype: str
+    """
+    submissions_directory = tempfile.mkdtemp()
+    holding_directory = tempfile.mkdtemp()
+    payload_directory = tempfile.mkdtemp()
+    database_filepath = None
+    if database_file:
+        database_fd, database_filepath = tempfile.mkstemp()
+        os.close(database_fd)
+
+    test_config = {
+        'secret_key': 'itsasecret',
+        'sqlalchemy_database_uri': 'sqlite:///' + database_filepath if database_file
+                                   else 'sqlite://',
+        'iron': {
+            'project_id': 'notnecessary'
+        },
+        'local': {
+            'payload_directory': payload_directory
+        },
+        'submissions_directory': submissions_directory,
+        'holding_directory': holding_directory
+    }
+    for key, value in (extra or {}).items():
+        if isinstance(value, dict) and isinstance(test_config.get(key), dict):
+            test_config[key] = dict(test_config[key], **value)
+        else:
+            test_config[key] = value
+
+    opened_file_descriptor, filepath = tempfile.mkstemp()
+    opened_file = os.fdopen(opened_file_descriptor, 'w')
+    yaml.dump(test_config, opened_file)
+    opened_file.close()
+
+    def fin():
+        os.unlink(filepath)
+        if database_filepath:
+            os.unlink(database_filepath)
+        shutil.rmtree(submissions_directory)
+        shutil.rmtree(holding_directory)
+        shutil.rmtree(payload_directory)
+
+    request.addfinalizer(fin)
+    return filepath
+
+
+@pytest.fixture(scope='module')
+def config_path(request):
+    """ A py.test fixture which creates a config file on disk and returns the path to the config """
+    return write_config(request, getattr(request.module, 'CONFIG', None),
+                        getattr(request.module, 'DATABASE_FILE', False))
+
+
+@pytest.fixture(scope='module')
+def models(config_path, request):
+    """ Setup the db and initialize the models """
+    autograder.setup_app(config_path)
+
+    # Now that setup has occurred, we can import the models
+    from autograder import models as m
+
+    # Make sure that if we've used a different db setup in another module
+    # we don't keep trying to write to that database
+    m.db.session.remove()
+
+    m.drop_all()
+    m.create_all()
+    request.addfinalizer(m.db.session.remove)
+    return m
@@ -3,56 +3,16 @@ from __future__ import print_function
 import os
 import random
 import re
-import shutil
 import subprocess
-import tempfile
 import time
 
 import psutil
 import pytest
 import requests
-import yaml
 
 
-@pytest.fixture(scope='module')
-def config_path(request):
-    """ A py.test fixture which creates a config file on disk and returns the path to the config """
-    submissions_directory = tempfile.mkdtemp()
-    holding_directory = tempfile.mkdtemp()
-    payload_directory = tempfile.mkdtemp()
-    database_fd, database_filepath = tempfile.mkstemp()
-
-    opened_file = os.fdopen(database_fd, 'w')
-    opened_file.write(b'')
-    opened_file.close()
-
-    test_config = {
-        'secret_key': 'itsasecret',
-        'sqlalchemy_database_uri': 'sqlite:///' + database_filepath,
-        'iron': {
-            'project_id': 'notnecessary'
-        },
-        'local': {
-            'payload_directory': payload_directory
-        },
-        'submissions_directory': submissions_directory,
-        'holding_directory': holding_directory
-    }
-
-    opened_file_descriptor, filepath = tempfile.mkstemp()
-    opened_file = os.fdopen(opened_file_descriptor, 'w')
-    yaml.dump(test_config, opened_file)
-    opened_file.close()
-
-    def fin():
-        os.unlink(filepath)
-        os.unlink(database_filepath)
-        shutil.rmtree(submissions_directory)
-        shutil.rmtree(holding_directory)
-        shutil.rmtree(payload_directory)
-
-    request.addfinalizer(fin)
-    return filepath
+# The commands run in processes of their own
+DATABASE_FILE = True
 
 
 def term_or_kill_proc(process):
@@ -148,6 +108,67 @@ def test_project_add(test_project):
     assert os.path.isfile(os.path.join(payload_directory, test_project + '.zip'))
 
 
+def test_project_update_payload(test_project, test_users, config_path):
+    """ Only the project's creator can replace its payload """
+    teacher_name, teacher_password, student_name, student_password = test_users
+    payload = os.path.join(os.path.dirname(__file__), 'fixtures', 'hello.py.zip')
+    call = ['autograder', '--config', config_path, 'project', 'update-payload']
+
+    process = subprocess.Popen(call + [student_name, 'Simple project', payload,
+                                       '-p', student_password],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = process.communicate()
+    assert process.returncode == 1
+    assert "did not create" in err
+
+    output = subprocess.check_output(call + [teacher_name, 'Simple project', payload,
+                                             '-p', teacher_password])
+    assert "Payload updated" in output
+
+
+def test_import_submissions(test_project, test_users, config_path, tmpdir):
+    teacher_name, _, student_name, _ = test_users
+
+    from autograder import setup_app
+    setup_app(config_path)
+
+    from autograder import models as m
+    m.db.session.remove()
+    teacher = m.User.get_user_by_name(teacher_name)
+    student = m.User.get_user_by_name(student_name)
+    broken = m.User.add_user(u'broken', 'pass')
+    twice = m.User.add_user(u'twice', 'pass')
+    unit = m.Unit.add_unit('Import class', teacher)
+    for user in (student, broken, twice):
+        m.Registration.add_registration(user, unit)
+    project = m.Project.get_project_by_key(test_project)
+    m.Assignment.add_assignment(teacher, unit, project)
+    student_id, project_name = student.id, project.name
+
+    directory = tmpdir.mkdir('export')
+    directory.mkdir(student_name).join('hello.py').write('print("hello")\n')
+    directory.join('nobody.py').write('print("nobody")\n')
+    directory.mkdir(teacher_name).join('hello.py').write('print("teacher")\n')
+    directory.join('broken.zip').write('not a zip')
+    directory.mkdir('twice').join('hello.py').write('print("one")\n')
+    directory.join('twice.zip').write('not a zip either')
+
+    output = subprocess.check_output(['autograder', '--config', config_path,
+                                      'submissions', 'import', project_name, str(directory)],
+                                     stderr=subprocess.STDOUT)
+    print(output)
+    assert "Skipping nobody: no such user" in output
+    assert "Skipping {}: not assigned".format(teacher_name) in output
+    assert "Skipping broken: Submitted code must be a zip archive" in output
+    assert "Skipping twice: more than one entry (twice, twice.zip)" in output
+    assert "Imported 1 submissions" in output
+
+    m.db.session.remove()
+    submissions = m.Submission.query.all()
+    assert [submission.user_id for submission in submissions] == [student_id]
+    assert submissions[0].results_at is not None
+
+
 @pytest.fixture(scope='module')
 def serve(request, config_path):
     """ Setup an autograder server
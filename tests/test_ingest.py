@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+
+# The writer runs in its own thread, so the database has to be one every thread can see
+DATABASE_FILE = True
+
+
+@pytest.fixture(scope='module')
+def infos(models):
+    """ The info of a few submissions which have no results yet """
+    teacher = models.User.add_user(u'teacher', 'pass')
+    unit = models.Unit.add_unit('Class', teacher)
+    project = models.Project.add_project('project', 'hello.exe', teacher)
+    assignment = models.Assignment.add_assignment(teacher, unit, project)
+    entries = [(teacher.id, assignment.id, None) for _ in range(20)]
+    keys = [submission.submission_key
+            for submission, _ in models.Submission.add_submissions(entries)]
+    return [models.Submission.get_submission_info(key) for key in keys]
+
+
+def test_writer_batches(models, infos, monkeypatch):
+    """ Results posted at once are committed together and only then acknowledged """
+    from autograder import ingest
+
+    batches = []
+    store_results = models.Submission.store_results
+
+    def counting_store_results(entries):
+        batches.append(len(entries))
+        store_results(entries)
+
+    monkeypatch.setattr(models.Submission, 'store_results', staticmethod(counting_store_results))
+
+    writer = ingest.ResultWriter(max_batch=len(infos), max_delay=1)
+    writer.start()
+    threads = [threading.Thread(target=writer.post, args=(info, {'grade': i}, 5))
+               for i, info in enumerate(infos)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(batches) == len(infos)
+    assert len(batches) < len(infos)
+    models.db.session.remove()
+    for i, info in enumerate(infos):
+        submission = models.Submission.query.get(info.id)
+        assert submission.results == {'grade': i}
+        assert submission.results_at is not None
+
+
+def test_writer_reports_failures(models, infos, monkeypatch):
+    """ A poster is told when the transaction holding its results fails """
+    from autograder import ingest
+
+    def failing_store_results(entries):
+        raise RuntimeError("database is gone")
+
+    monkeypatch.setattr(models.Submission, 'store_results', staticmethod(failing_store_results))
+
+    writer = ingest.ResultWriter(max_delay=0)
+    writer.start()
+    with pytest.raises(ingest.IngestError) as excinfo:
+        writer.post(infos[0], {'grade': 'F'}, timeout=5)
+    assert "database is gone" in str(excinfo.value)
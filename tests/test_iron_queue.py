@@ -0,0 +1,181 @@
+from __future__ import print_function
+
+import collections
+from datetime import datetime
+import json
+import threading
+
+import pytest
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+
+import autograder
+
+from conftest import write_config
+
+pytest.importorskip('iron_worker')
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeIronHandler(BaseHTTPRequestHandler):
+    """ Stands in for the iron.io task API. The server's `failures` attribute is how
+    many requests should get a 503 before requests start succeeding. """
+
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write rather than a write per header
+    wbufsize = -1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.respond(503, {'msg': 'Service unavailable'})
+            return
+
+        tasks = json.loads(body.decode('utf-8'))['tasks']
+        self.server.requests.append(tasks)
+        ids = [{'id': 'task{}'.format(len(self.server.tasks) + i)} for i in range(len(tasks))]
+        self.server.tasks.extend(tasks)
+        self.respond(200, {'msg': 'Queued up', 'tasks': ids})
+
+    def do_GET(self):
+        """ List the tasks in the server's `active` list, a page at a time """
+        query = parse_qs(urlparse(self.path).query)
+        self.server.listings.append(query)
+        per_page = int(query['per_page'][0])
+        page = int(query.get('page', ['0'])[0])
+        active = self.server.active[page * per_page:(page + 1) * per_page]
+        self.respond(200, {'tasks': [{'id': task_id, 'status': 'running'}
+                                     for task_id in active]})
+
+    def respond(self, status, content):
+        data = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def iron_server(request):
+    server = ThreadingHTTPServer(('localhost', 0), FakeIronHandler)
+    server.failures = 0
+    server.requests = []
+    server.tasks = []
+    server.active = []
+    server.listings = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    request.addfinalizer(server.shutdown)
+    return server
+
+
+@pytest.fixture(scope='module')
+def config_path(request, iron_server):
+    """ A config pointing the iron queue at the fake server """
+    return write_config(request, {
+        'iron': {
+            'project_id': 'notnecessary',
+            'token': 'nottoken',
+            'host': 'localhost',
+            'port': iron_server.server_address[1],
+            'protocol': 'http'
+        }
+    })
+
+
+@pytest.fixture(scope='module')
+def iron(config_path):
+    autograder.setup_app(config_path)
+
+    from autograder.queues import iron as i
+    i._worker = None
+    i.RETRY_DELAY = 0.01
+    return i
+
+
+def test_queue_many(iron, iron_server):
+    """ Tasks are sent in batches over one client and get back their ids in order """
+    tasks = [iron.Task(code_name='project', payload={'n': n}) for n in range(25)]
+    del iron_server.requests[:]
+    task_ids = iron.queue_many(tasks, batch_size=10)
+
+    assert [len(batch) for batch in iron_server.requests] == [10, 10, 5]
+    assert len(set(task_ids)) == 25
+    assert [json.loads(task['payload'])['n'] for batch in iron_server.requests
+            for task in batch] == list(range(25))
+    assert iron.get_worker() is iron.get_worker()
+
+
+def test_queue_many_retries(iron, iron_server):
+    """ A batch which fails is retried """
+    iron_server.failures = 2
+    del iron_server.requests[:]
+    task_ids = iron.queue_many([iron.Task(code_name='project', payload={}) for _ in range(3)])
+    assert len(task_ids) == 3
+    assert len(iron_server.requests) == 1
+    assert iron_server.failures == 0
+
+
+def test_queue_many_does_not_retry_unsafe_failures(iron):
+    """ Only failures where iron.io cannot have accepted the batch are retried """
+    import requests
+
+    def http_error(status):
+        response = requests.Response()
+        response.status_code = status
+        return requests.HTTPError(response=response)
+
+    assert iron._is_retryable(http_error(503))
+    assert iron._is_retryable(http_error(429))
+    assert not iron._is_retryable(http_error(500))
+    assert not iron._is_retryable(http_error(400))
+    assert iron._is_retryable(requests.exceptions.ConnectTimeout())
+    assert not iron._is_retryable(requests.exceptions.ReadTimeout())
+    assert not iron._is_retryable(requests.ConnectionError('Connection reset by peer'))
+
+    # Nothing is listening on a port we just released, so the connection is refused
+    import socket
+    sock = socket.socket()
+    sock.bind(('localhost', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    try:
+        requests.get('http://localhost:{}/'.format(port))
+    except requests.ConnectionError as e:
+        assert iron._is_retryable(e)
+
+
+def test_get_task_statuses(iron, iron_server):
+    """ Active tasks are listed a page at a time rather than looked up one by one """
+    Project = collections.namedtuple('Project', ['project_key'])
+    Submission = collections.namedtuple('Submission', ['id', 'task_id', 'submitted_at'])
+
+    iron_server.active[:] = ['active{}'.format(n) for n in range(150)]
+    del iron_server.listings[:]
+    submissions = [Submission(1, 'active3', datetime(2016, 1, 1, 12)),
+                   Submission(2, 'active120', datetime(2016, 1, 1, 11)),
+                   Submission(3, 'finished', datetime(2016, 1, 1, 13)),
+                   Submission(4, None, datetime(2016, 1, 1, 13))]
+    statuses = iron.get_task_statuses(Project('project'), submissions)
+    assert statuses == {1: 'active', 2: 'active', 3: 'lost', 4: 'lost'}
+
+    assert len(iron_server.listings) == 2
+    assert all(listing['code_name'] == ['project'] and listing['from_time'] == ['1451646000']
+               for listing in iron_server.listings)
+    assert iron.get_task_statuses(Project('project'), []) == {}
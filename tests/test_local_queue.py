@@ -0,0 +1,206 @@
+import os
+import shutil
+import zipfile
+
+import pytest
+
+
+DATABASE_FILE = True
+CONFIG = {
+    'local': {
+        'processes': 2,
+        'timeout': 5
+    }
+}
+
+
+GRADER = """
+from __future__ import print_function
+import json, os, sys, zipfile
+with zipfile.ZipFile(os.environ['AUTOGRADER_SUBMISSION']) as zf:
+    names = sorted(zf.namelist())
+print(json.dumps({'grade': 'A', 'files': names}))
+"""
+
+
+@pytest.fixture
+def payload(tmpdir):
+    """ Make a payload whose executable is a python script printing json results """
+    path = str(tmpdir.join('payload.zip'))
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('grader.py', GRADER)
+        zf.writestr('sleeper.py', 'import time\ntime.sleep(30)\n')
+    return path
+
+
+@pytest.fixture
+def code(tmpdir):
+    directory = tmpdir.mkdir('code')
+    directory.join('hello.py').write('print("hello")\n')
+    return str(directory)
+
+
+def test_grade(payload, code, tmpdir):
+    from autograder.queues import local
+
+    archive = str(tmpdir.join('code.zip'))
+    shutil.make_archive(archive[:-len('.zip')], 'zip', code)
+    results = local.grade(payload, 'python grader.py', archive, 5)
+    assert results['grade'] == 'A'
+    assert results['files'] == ['hello.py']
+    assert results['returncode'] == 0
+    assert not results['timed_out']
+    assert results['cpu_seconds'] > 0
+    assert results['max_rss'] > 0
+    assert 'limit_exceeded' not in results
+
+
+def test_grade_timeout(payload, code, tmpdir):
+    from autograder.queues import local
+
+    archive = str(tmpdir.join('code.zip'))
+    shutil.make_archive(archive[:-len('.zip')], 'zip', code)
+    results = local.grade(payload, 'python sleeper.py', archive, 1)
+    assert results['timed_out']
+    assert results['returncode'] != 0
+
+
+def test_grade_with_payload_cache(payload, code, tmpdir):
+    from autograder import payload_cache
+    from autograder.queues import local
+
+    archive = str(tmpdir.join('code.zip'))
+    shutil.make_archive(archive[:-len('.zip')], 'zip', code)
+    cache = payload_cache.PayloadCache(str(tmpdir.join('cache')), 1024 * 1024)
+    for _ in range(2):
+        results = local.grade(payload, 'python grader.py', archive, 5, cache=cache)
+        assert results['grade'] == 'A'
+        assert results['files'] == ['hello.py']
+    assert len(cache.entries()) == 1
+    assert os.listdir(cache.task_directory) == []
+
+
+def test_grade_warm(payload, code, tmpdir):
+    """ A python grader may run in a child forked from the grading process """
+    from autograder.queues import local
+
+    archive = str(tmpdir.join('code.zip'))
+    shutil.make_archive(archive[:-len('.zip')], 'zip', code)
+    results = local.grade(payload, 'python grader.py', archive, 5, interpreters=['python'])
+    assert results['grade'] == 'A'
+    assert results['files'] == ['hello.py']
+    assert results['returncode'] == 0
+
+
+def test_grade_limits(payload, code, tmpdir):
+    """ A grader which runs into a limit is stopped and says which """
+    from autograder import sandbox
+    from autograder.queues import local
+
+    archive = str(tmpdir.join('code.zip'))
+    shutil.make_archive(archive[:-len('.zip')], 'zip', code)
+    results = local.grade(payload, 'python grader.py', archive, 5,
+                          limits=sandbox.Limits(None, None, None, 10))
+    assert results['limit_exceeded'] == sandbox.OUTPUT
+    assert len(results['stdout']) == 10
+
+
+def test_submit_code(models, payload, code):
+    from autograder import storage
+    from autograder.queues import local
+
+    teacher = models.User.add_user(u'teacher', 'pass')
+    student = models.User.add_user(u'student', 'word')
+    unit = models.Unit.add_unit('Class', teacher)
+    models.Registration.add_registration(student, unit)
+    project_key = local.make_worker(payload, 'python grader.py')
+    project = models.Project.add_project('project', 'python grader.py', teacher,
+                                         project_key=project_key,
+                                         payload_digest=storage.file_digest(payload))
+
+    # Not yet assigned
+    with pytest.raises(ValueError):
+        local.submit_code(student, project, code)
+
+    models.Assignment.add_assignment(teacher, unit, project)
+    submissions = [local.submit_code(student, project, code) for _ in range(3)]
+    assert local.poll()
+
+    for submission in submissions:
+        models.db.session.refresh(submission)
+        assert submission.results_at is not None
+        assert submission.results['grade'] == 'A'
+        assert submission.results['files'] == ['hello.py']
+
+    # A byte-identical resubmission reuses the results without grading
+    submission = local.submit_code(student, project, code)
+    assert submission.results_at is not None
+    assert submission.results in [graded.results for graded in submissions]
+    assert submission.archive_digest == submissions[0].archive_digest
+
+
+def test_result_cache_invalidation(models, payload, code, tmpdir):
+    """ Replacing a project's payload means resubmissions are graded again """
+    from autograder import storage
+    from autograder.queues import local
+
+    project = models.Project.get_project_by_name('project')
+    student = models.User.get_user_by_name(u'student')
+
+    new_payload = str(tmpdir.join('new_payload.zip'))
+    with zipfile.ZipFile(new_payload, 'w') as zf:
+        zf.writestr('grader.py', GRADER.replace("'A'", "'B'"))
+    local.make_worker(new_payload, project.executable, project_key=project.project_key)
+    assert project.payload_digest == storage.file_digest(new_payload)
+
+    submission = local.submit_code(student, project, code)
+    assert submission.results_at is None
+    local.join()
+    models.db.session.refresh(submission)
+    assert submission.results['grade'] == 'B'
+
+    submission = local.submit_code(student, project, code)
+    assert submission.results['grade'] == 'B'
+
+
+def test_no_memoization_without_payload_digest(models, payload, code):
+    """ Results are never reused for a project whose payload digest is unknown """
+    from autograder.queues import local
+
+    teacher = models.User.get_user_by_name(u'teacher')
+    student = models.User.get_user_by_name(u'student')
+    unit = models.Unit.query.filter(models.Unit.description == 'Class').first()
+    project_key = local.make_worker(payload, 'python grader.py')
+    project = models.Project.add_project('undigested', 'python grader.py', teacher,
+                                         project_key=project_key)
+    models.Assignment.add_assignment(teacher, unit, project)
+
+    first = local.submit_code(student, project, code)
+    local.join()
+    second = local.submit_code(student, project, code)
+    assert second.results_at is None
+    local.join()
+    models.db.session.refresh(first)
+    models.db.session.refresh(second)
+    assert first.results['grade'] == second.results['grade'] == 'A'
+
+
+def test_submit_code_warm(models, payload, code):
+    """ Submissions are graded the same by a warm pool """
+    from autograder.config import get_config
+    from autograder.queues import local
+
+    warm_config = get_config().local_config.warm
+    local.join()
+    warm_config.enabled, warm_config.preload, warm_config.max_tasks = True, ['json'], 1
+    try:
+        project = models.Project.get_project_by_name('undigested')
+        student = models.User.get_user_by_name(u'student')
+        submissions = [local.submit_code(student, project, code) for _ in range(3)]
+        assert local.poll(timeout=30)
+        for submission in submissions:
+            models.db.session.refresh(submission)
+            assert submission.results['grade'] == 'A'
+    finally:
+        local.join()
+        warm_config.enabled = False
@@ -1,63 +1,12 @@
 from datetime import datetime, timedelta
 
-import os
-import shutil
-import tempfile
+import json
+import warnings
 
 import pytest
-import yaml
 
 from sqlalchemy.orm import load_only
 
-import autograder
-
-
-@pytest.fixture(scope='module')
-def config_path(request):
-    """ A py.test fixture which creates a config file on disk and returns the path to the config """
-    submissions_directory = tempfile.mkdtemp()
-    holding_directory = tempfile.mkdtemp()
-
-    test_config = {
-        'secret_key': 'itsasecret',
-        'sqlalchemy_database_uri': 'sqlite://',
-        'iron': {
-            'project_id': 'notnecessary'
-        },
-        'submissions_directory': submissions_directory,
-        'holding_directory': holding_directory
-    }
-
-    opened_file_descriptor, filepath = tempfile.mkstemp()
-    opened_file = os.fdopen(opened_file_descriptor, 'w')
-    yaml.dump(test_config, opened_file)
-    opened_file.close()
-
-    def fin():
-        os.unlink(filepath)
-        shutil.rmtree(submissions_directory)
-        shutil.rmtree(holding_directory)
-
-    request.addfinalizer(fin)
-    return filepath
-
-
-@pytest.fixture(scope='module')
-def models(config_path):
-    """ Setup the sqlite db and initialize the models """
-    autograder.setup_app(config_path)
-
-    # Now that setup has occurred, we can import the models
-    from autograder import models as m
-
-    # Make sure that if we've used a different db setup in another module
-    # we don't keep trying to write to that database
-    m.db.session.remove()
-
-    m.drop_all()
-    m.create_all()
-    return m
-
 
 def test_models(models, config_path):
     # Insert a few users
@@ -124,13 +73,14 @@ def test_models(models, config_path):
     # Make a few assignments
     assignments = []
     for i, (user, unit, project) in enumerate(zip(users, units, projects)):
-        assignment = models.Assignment.add_assignment(user, unit, project, max_submissions=i)
+        assignment = models.Assignment.add_assignment(user, unit, project,
+                                                      max_submissions=i + 1)
         assignments.append(assignment)
         assert assignment.unit.id == unit.id
         assert assignment.project.id == project.id
         assert assignment.assigner.id == user.id
         assert datetime.utcnow() - assignment.due_date < create_time_tolerance + models.ONE_YEAR
-        assert assignment.max_submissions == i
+        assert assignment.max_submissions == i + 1
 
     assert models.db.session.query(models.Assignment).count() == 5
 
@@ -157,3 +107,365 @@ def test_models(models, config_path):
 
     assert {submission.results['grade'] for submission in models.db.session.query(models.Submission).options(load_only("results")).all()} == \
         set('ABCDF')
+
+
+def test_legacy_token_hash_upgrade(models):
+    """ Tokens hashed with the old password scheme still work and are rehashed on use """
+    from werkzeug.security import generate_password_hash
+
+    user = models.User.add_user(u'legacy', 'password')
+    unit = models.Unit.add_unit('Legacy class', user)
+    models.Registration.add_registration(user, unit)
+    project = models.Project.add_project('legacy project', 'hello.exe', user)
+    assignment = models.Assignment.add_assignment(user, unit, project)
+    submission, token = models.Submission.add_submission(user, assignment)
+    assert submission.token_hash.startswith(models.TOKEN_HASH_METHOD + '$')
+
+    submission.token_hash = generate_password_hash(token, salt_length=models.SALT_LENGTH,
+                                                   method=models.PW_HASH_METHOD)
+    models.db.session.commit()
+
+    assert not submission.check_token(token + 'foo')
+    assert submission.token_hash.startswith(models.PW_HASH_METHOD)
+    assert submission.check_token(token)
+    assert submission.token_hash == models.hash_token(token)
+    assert submission.check_token(token)
+
+
+def test_create_indexes(models):
+    """ Indexes missing from existing tables are created without recreating the tables """
+    models.db.session.remove()
+    models.db.engine.execute('DROP INDEX ix_submissions_submission_key')
+    models.db.engine.execute('DROP INDEX ix_users_username')
+
+    assert sorted(models.create_indexes()) == ['ix_submissions_submission_key',
+                                               'ix_users_username']
+    assert models.create_indexes() == []
+
+
+def test_create_indexes_with_duplicates(models):
+    """ A unique index is skipped rather than failing if there are duplicates already """
+    models.db.session.remove()
+    models.db.engine.execute('DROP INDEX ix_users_username')
+    models.db.engine.execute('DROP INDEX ix_projects_name')
+    models.db.engine.execute("INSERT INTO projects (name, project_key) "
+                             "VALUES ('dupe', 'dupe1'), ('dupe', 'dupe2')")
+
+    with warnings.catch_warnings(record=True) as record:
+        warnings.simplefilter('always')
+        assert models.create_indexes() == ['ix_users_username']
+    record = [w for w in record if issubclass(w.category, models.DuplicateKeysWarning)]
+    assert len(record) == 1
+    assert "ix_projects_name" in str(record[0].message)
+    assert "dupe" in str(record[0].message)
+
+    models.db.engine.execute("DELETE FROM projects WHERE name = 'dupe'")
+    assert models.create_indexes() == ['ix_projects_name']
+
+
+def test_get_submission_info(models):
+    """ Submission info is cached until results are posted """
+    user = models.User.add_user(u'cached', 'password')
+    unit = models.Unit.add_unit('Cached class', user)
+    models.Registration.add_registration(user, unit)
+    project = models.Project.add_project('cached project', 'hello.exe', user)
+    assignment = models.Assignment.add_assignment(user, unit, project)
+    submission, token = models.Submission.add_submission(user, assignment)
+
+    assert models.Submission.get_submission_by_key(submission.submission_key) is submission
+    assert models.Submission.get_submission_by_key('nope') is None
+    assert models.Submission.get_submission_info('nope') is None
+
+    info = models.Submission.get_submission_info(submission.submission_key)
+    assert info.id == submission.id
+    assert info.check_token(token)
+    assert not info.check_token(token + 'foo')
+    assert models.Submission.get_submission_info(submission.submission_key) is info
+
+    submission.post_results({'grade': 'A'})
+    assert models.Submission.get_submission_info(submission.submission_key) is not info
+
+
+def test_add_submissions(models):
+    """ Many submissions can be added at once for users assigned a project """
+    teacher = models.User.add_user(u'bulkteacher', 'password')
+    unit = models.Unit.add_unit('Bulk class', teacher)
+    project = models.Project.add_project('bulk project', 'hello.exe', teacher)
+    assignment = models.Assignment.add_assignment(teacher, unit, project)
+    students = []
+    for i in range(5):
+        student = models.User.add_user(u'bulkstudent{}'.format(i), 'password')
+        students.append(student)
+        if i % 2 == 0:
+            models.Registration.add_registration(student, unit)
+
+    users = models.User.get_users_by_name([bulk.username for bulk in students] + [u'nobody'])
+    assert sorted(users) == sorted(bulk.username for bulk in students)
+
+    assignments = models.Assignment.get_assignments_for_users(users.values(), project)
+    assert sorted(assignments) == [students[i].id for i in (0, 2, 4)]
+    assert all(a.id == assignment.id for a in assignments.values())
+
+    entries = [(user_id, a.id, 'ab' * 32) for user_id, a in assignments.items()]
+    created = models.Submission.add_submissions(entries)
+    assert len(created) == 3
+    for (user_id, _, _), (submission, token) in zip(entries, created):
+        assert submission.id is not None
+        assert submission.user_id == user_id
+        assert submission.check_token(token)
+
+
+def test_post_results_many(models):
+    """ Results for many submissions are posted at once and each entry gets a status """
+    user = models.User.get_user_by_name(u'cached')
+    project = models.Project.get_project_by_name('cached project')
+    assignment = models.Assignment.get_assignment_for_user(user, project)
+    created = [models.Submission.add_submission(user, assignment) for _ in range(3)]
+    models.Submission.get_submission_info(created[0][0].submission_key)
+
+    entries = [(submission.submission_key, token, {'grade': i})
+               for i, (submission, token) in enumerate(created)]
+    entries[1] = (entries[1][0], 'wrong', entries[1][2])
+    entries.append(('nope', 'nope', {}))
+    assert models.Submission.post_results_many(entries) == [
+        models.POSTED, models.BAD_TOKEN, models.POSTED, models.NOT_FOUND]
+
+    for submission, _ in created:
+        models.db.session.refresh(submission)
+    results = [submission.results for submission, _ in created]
+    assert results == [{'grade': 0}, None, {'grade': 2}]
+    assert created[1][0].results_at is None
+    assert models.Submission.post_results_many([]) == []
+
+
+def test_encoded_results(models):
+    """ Results are stored compressed, decoded lazily, and old JSON rows still read """
+    results = {'grade': 'A', 'tests': [{'name': u'test_\xe9', 'passed': True}] * 100}
+    encoded = models.encode_results(results)
+    assert encoded.startswith(models.RESULTS_FORMAT)
+    assert len(encoded) < len(json.dumps(results)) / 10
+    assert models.decode_results(encoded) == results
+    assert models.decode_results(json.dumps(results).encode('utf-8')) == results
+    assert models.encode_results(None) is None
+
+    user = models.User.get_user_by_name(u'cached')
+    project = models.Project.get_project_by_name('cached project')
+    assignment = models.Assignment.get_assignment_for_user(user, project)
+    new, _ = models.Submission.add_submission(user, assignment)
+    new.post_results(results)
+    legacy, _ = models.Submission.add_submission(user, assignment)
+    legacy_id = legacy.id
+    models.db.engine.execute(
+        models.sqlalchemy.text("UPDATE submissions SET results = :results WHERE id = :id"),
+        results=json.dumps(results), id=legacy_id)
+
+    models.db.session.remove()
+    legacy = models.Submission.query.get(legacy_id)
+    assert '_decoded_results' not in legacy.__dict__
+    assert legacy.results == results
+    assert legacy.results is legacy.results
+
+    assert models.migrate_results() == 1
+    assert models.migrate_results() == 0
+    models.db.session.remove()
+    legacy = models.Submission.query.get(legacy_id)
+    assert legacy.encoded_results.startswith(models.RESULTS_FORMAT)
+    assert legacy.results == results
+
+
+def test_convert_results_column(models, monkeypatch):
+    """ A text results column is changed to bytea, which only PostgreSQL needs """
+    assert not models.results_column_is_text()
+    assert not models.convert_results_column()
+
+    statements = []
+    monkeypatch.setattr(models, 'results_column_is_text', lambda: True)
+    monkeypatch.setattr(models.db.engine, 'execute', statements.append)
+    assert models.convert_results_column()
+    assert statements == ["ALTER TABLE submissions ALTER COLUMN results TYPE bytea "
+                          "USING convert_to(results, 'UTF8')"]
+
+
+def test_submission_results(models):
+    """ Test cases are recorded when results are posted and aggregated in SQL """
+    user = models.User.get_user_by_name(u'cached')
+    unit = models.Unit.query.filter(models.Unit.description == 'Cached class').first()
+    project = models.Project.add_project('gradebook project', 'hello.exe', user)
+    assignment = models.Assignment.add_assignment(user, unit, project)
+
+    def tests(*scores):
+        return {'tests': [{'name': 'test_{}'.format(i), 'passed': score > 0, 'score': score,
+                           'duration': 0.5}
+                          for i, score in enumerate(scores)]}
+
+    first, _ = models.Submission.add_submission(user, assignment)
+    second, token = models.Submission.add_submission(user, assignment)
+    ungraded, _ = models.Submission.add_submission(user, assignment)
+    first.post_results(tests(1, 0, 0))
+    models.Submission.post_results_many([(second.submission_key, token, tests(1, 1, 0))])
+
+    rows = models.SubmissionResult.query.filter_by(submission_id=second.id).all()
+    assert sorted((row.name, row.passed, row.score) for row in rows) == [
+        ('test_0', True, 1), ('test_1', True, 1), ('test_2', False, 0)]
+    assert models.SubmissionResult.get_best_scores(assignment) == {user.id: 2}
+    assert models.SubmissionResult.get_pass_rates(assignment) == {
+        'test_0': 1.0, 'test_1': 0.5, 'test_2': 0.0}
+
+    # Posting again replaces the rows
+    first.post_results(tests(1, 1, 1))
+    assert models.SubmissionResult.query.filter_by(submission_id=first.id).count() == 3
+    assert models.SubmissionResult.get_best_scores(assignment) == {user.id: 3}
+
+    # A submission posted twice in one batch keeps its last results
+    assert models.Submission.post_results_many([
+        (second.submission_key, token, tests(0, 0, 0, 0)),
+        (second.submission_key, token, tests(1, 1))]) == [models.POSTED] * 2
+    models.db.session.refresh(second)
+    assert second.results == tests(1, 1)
+    assert models.SubmissionResult.query.filter_by(submission_id=second.id).count() == 2
+    assert models.SubmissionResult.get_best_scores(assignment) == {user.id: 3}
+
+    assert models.SubmissionResult.parse_results(None) == []
+    assert models.SubmissionResult.parse_results({'tests': 'nope'}) == []
+    assert models.SubmissionResult.parse_results(
+        {'tests': [{'passed': True}, {'name': 'named', 'score': 'lots'}]}) == [
+            (u'named', False, None, None)]
+
+    # Submissions graded before test cases were recorded are filled in
+    models.db.engine.execute('DELETE FROM submission_results')
+    assert models.backfill_submission_results() > 0
+    assert models.SubmissionResult.get_best_scores(assignment) == {user.id: 3}
+    assert ungraded.results_at is None
+
+
+def test_submission_summaries(models):
+    """ Summaries follow submissions and results and agree with a rebuild """
+    user = models.User.get_user_by_name(u'cached')
+    unit = models.Unit.query.filter(models.Unit.description == 'Cached class').first()
+    project = models.Project.add_project('summary project', 'hello.exe', user)
+    assignment = models.Assignment.add_assignment(user, unit, project)
+
+    def score(points):
+        return {'tests': [{'name': 'test', 'passed': bool(points), 'score': points}]}
+
+    first, _ = models.Submission.add_submission(user, assignment)
+    summary = models.SubmissionSummary.query.filter_by(user_id=user.id,
+                                                       assignment_id=assignment.id).one()
+    assert summary.submission_count == 1
+    assert summary.latest_submission_id == first.id
+    assert summary.best_submission_id is None
+
+    created = models.Submission.add_submissions([(user.id, assignment.id, None)] * 2)
+    (second, second_token), (third, third_token) = created
+    first.post_results(score(2))
+    models.Submission.post_results_many([(second.submission_key, second_token, score(5)),
+                                         (third.submission_key, third_token, score(5))])
+    models.db.session.refresh(summary)
+    assert summary.submission_count == 3
+    assert summary.latest_submission_id == third.id
+    assert summary.latest_submitted_at == third.submitted_at
+    assert (summary.best_submission_id, summary.best_score) == (third.id, 5)
+
+    # A lower score later on doesn't replace the best one
+    first.post_results(score(1))
+    models.db.session.refresh(summary)
+    assert summary.best_submission_id == third.id
+
+    assert models.SubmissionSummary.check_summaries() == []
+    before = {(row.user_id, row.assignment_id): [getattr(row, field)
+                                                 for field in models.SubmissionSummary.FIELDS]
+              for row in models.SubmissionSummary.query}
+    models.SubmissionSummary.rebuild_summaries()
+    after = {(row.user_id, row.assignment_id): [getattr(row, field)
+                                                for field in models.SubmissionSummary.FIELDS]
+             for row in models.SubmissionSummary.query}
+    assert after == before
+
+    models.db.engine.execute('UPDATE submission_summaries SET submission_count = 7 '
+                             'WHERE assignment_id = {}'.format(assignment.id))
+    assert models.SubmissionSummary.check_summaries() == [
+        (user.id, assignment.id, 'submission_count', 3, 7)]
+    models.SubmissionSummary.rebuild_summaries()
+    assert models.SubmissionSummary.check_summaries() == []
+
+
+def test_permission_checks(models):
+    """ Authorization checks compare the right ids and take one query however many
+    units a user belongs to """
+    from sqlalchemy import event
+
+    # Take up some teacher ids so that they no longer line up with user ids
+    other = models.User.add_user(u'permother', 'password')
+    for i in range(3):
+        models.Unit.add_unit('Other class {}'.format(i), other)
+
+    teacher = models.User.add_user(u'permteacher', 'password')
+    student = models.User.add_user(u'permstudent', 'password')
+    unit = models.Unit.add_unit('Permission class', teacher)
+    teacher_row = models.Teacher.query.filter(models.Teacher.user_id == teacher.id).one()
+    assert teacher_row.id != teacher.id
+
+    project = models.Project.add_project('permission project', 'hello.exe', teacher)
+    assignment = models.Assignment.add_assignment(teacher, unit, project)
+    with pytest.raises(ValueError):
+        models.Assignment.add_assignment(other, unit, project)
+
+    # A failed check is forgotten once the user is registered
+    with pytest.raises(ValueError):
+        models.Submission.add_submission(student, assignment)
+    for other_unit in models.Unit.query.filter(models.Unit.creator_id == other.id):
+        models.Registration.add_registration(student, other_unit)
+    models.Registration.add_registration(student, unit)
+    # Load what the commits expired so that only the checks themselves are counted
+    models.db.session.refresh(student)
+    unit_id = unit.id
+
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    event.listen(models.db.engine, 'before_cursor_execute', count)
+    try:
+        assert models.Registration.is_registered(student, unit_id)
+        assert models.Registration.is_registered(student, unit_id)
+        assert not models.Teacher.is_teacher(student, unit_id)
+    finally:
+        event.remove(models.db.engine, 'before_cursor_execute', count)
+    assert len(statements) == 2
+    assert all('EXISTS' in statement for statement in statements)
+
+    submission, _ = models.Submission.add_submission(student, assignment)
+    assert submission.user_id == student.id
+
+
+def test_max_submissions(models):
+    """ Users are turned away once they have used up an assignment's submissions """
+    user = models.User.get_user_by_name(u'cached')
+    unit = models.Unit.query.filter(models.Unit.description == 'Cached class').first()
+    project = models.Project.add_project('limited project', 'hello.exe', user)
+    assignment = models.Assignment.add_assignment(user, unit, project, max_submissions=2)
+    models.db.session.expire(assignment)
+    assert assignment.max_submissions == 2
+
+    models.Submission.add_submission(user, assignment)
+    models.Submission.reserve_submission(user, assignment)
+    with pytest.raises(models.SubmissionLimitError):
+        models.Submission.add_submission(user, assignment)
+
+    # A released reservation can be used again
+    models.SubmissionSummary.release_submission(user.id, assignment.id)
+    models.Submission.reserve_submission(user, assignment)
+    models.Submission.add_submission(user, assignment, reserved=True)
+    with pytest.raises(models.SubmissionLimitError):
+        models.Submission.reserve_submission(user, assignment)
+
+    summary = models.SubmissionSummary.query.filter_by(user_id=user.id,
+                                                       assignment_id=assignment.id).one()
+    assert summary.submission_count == 2
+    assert models.SubmissionSummary.check_summaries() == []
+
+    unlimited = models.Assignment.add_assignment(user, unit, project)
+    assert not unlimited.limits_submissions()
+    for _ in range(3):
+        models.Submission.add_submission(user, unlimited)
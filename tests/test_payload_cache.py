@@ -0,0 +1,75 @@
+import fcntl
+import os
+import time
+import zipfile
+
+import pytest
+
+from autograder import payload_cache
+
+
+def make_payload(path, contents):
+    with zipfile.ZipFile(path, 'w') as zf:
+        for name, data in contents.items():
+            zf.writestr(name, data)
+    return path
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return payload_cache.PayloadCache(str(tmpdir.join('cache')), 1024 * 1024)
+
+
+def checkout(cache, payload):
+    cache.setup()
+    workdir = os.path.join(cache.task_directory, str(len(os.listdir(cache.task_directory))))
+    os.mkdir(workdir)
+    return cache.checkout(payload, workdir), workdir
+
+
+def test_checkout(cache, tmpdir):
+    """ A payload is extracted once and its files linked into each task """
+    payload = make_payload(str(tmpdir.join('payload.zip')),
+                           {'grader.py': 'print(1)\n', 'fixtures/data.txt': 'data'})
+    digest, first = checkout(cache, payload)
+    assert open(os.path.join(first, 'fixtures', 'data.txt')).read() == 'data'
+    assert not os.access(os.path.join(first, 'grader.py'), os.W_OK) or os.getuid() == 0
+    assert cache.entries() == [(digest, len('print(1)\n') + len('data'))]
+
+    _, second = checkout(cache, payload)
+    assert (os.stat(os.path.join(first, 'grader.py')).st_ino ==
+            os.stat(os.path.join(second, 'grader.py')).st_ino)
+
+    # Tasks may add files without touching the cache
+    open(os.path.join(second, 'fixtures', 'output.txt'), 'w').close()
+    assert sorted(os.listdir(os.path.join(first, 'fixtures'))) == ['data.txt']
+
+    # A replaced payload is extracted again
+    time.sleep(0.01)
+    make_payload(payload, {'grader.py': 'print(2)\n'})
+    new_digest, third = checkout(cache, payload)
+    assert new_digest != digest
+    assert open(os.path.join(third, 'grader.py')).read() == 'print(2)\n'
+    assert sorted(name for name, _ in cache.entries()) == sorted([digest, new_digest])
+
+
+def test_evict(tmpdir):
+    """ The least recently used payloads go first, unless they are in use """
+    cache = payload_cache.PayloadCache(str(tmpdir.join('cache')), 2500)
+    payloads = [make_payload(str(tmpdir.join('payload{}.zip'.format(n))),
+                             {'fixture': str(n) * 1000}) for n in range(4)]
+    digests = []
+    for n, payload in enumerate(payloads[:2]):
+        digests.append(checkout(cache, payload)[0])
+        os.utime(os.path.join(cache.payload_directory, digests[-1]), (n, n))
+    assert [digest for digest, _ in cache.entries()] == digests
+
+    digests.append(checkout(cache, payloads[2])[0])
+    assert [digest for digest, _ in cache.entries()] == digests[1:]
+
+    with open(os.path.join(cache.payload_directory, digests[1] + '.lock')) as f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        digests.append(checkout(cache, payloads[3])[0])
+        fcntl.flock(f, fcntl.LOCK_UN)
+    assert [digest for digest, _ in cache.entries()] == [digests[1], digests[3]]
+    assert cache.evict() == []
@@ -0,0 +1,50 @@
+import subprocess
+import sys
+
+import pytest
+
+import autograder
+
+
+@pytest.fixture(scope='module')
+def queues(config_path):
+    autograder.setup_app(config_path)
+
+    from autograder import queues as q
+    return q
+
+
+def test_get_queue(queues):
+    from autograder.queues import local
+
+    assert queues.get_queue() is local
+    assert queues.get_queue('local') is local
+    with pytest.raises(ValueError):
+        queues.get_queue('nope')
+
+
+def test_register_backend(queues):
+    queues.register_backend('other', 'autograder.queues.local')
+    try:
+        assert queues.get_queue('other') is queues.get_queue('local')
+    finally:
+        del queues.BACKENDS['other']
+
+
+def test_iron_backend(queues):
+    pytest.importorskip('iron_worker')
+    from autograder.queues import iron
+
+    assert queues.get_queue('iron') is iron
+    for name in ('make_worker', 'submit_code', 'submit_many', 'poll', 'get_task_statuses'):
+        assert callable(getattr(iron, name))
+
+
+def test_local_backend_does_not_import_iron(config_path):
+    """ Using the local backend never imports iron_worker """
+    script = ("import sys, autograder; autograder.setup_app(sys.argv[1]); "
+              "import autograder.cli, autograder.web; "
+              "from autograder.queues import get_queue; get_queue(); "
+              "print(sorted(name for name in sys.modules if name.startswith('iron')))")
+    output = subprocess.check_output([sys.executable, '-c', script, config_path])
+    assert output.strip() == b'[]'
@@ -0,0 +1,85 @@
+import pytest
+
+
+CONFIG = {
+    'rate_limit': {
+        'enabled': True,
+        'store': 'database'
+    }
+}
+
+
+@pytest.fixture(scope='module')
+def ratelimit(models):
+    from autograder import ratelimit as r
+    return r
+
+
+@pytest.fixture(scope='module', params=['memory', 'database'])
+def buckets(request, ratelimit):
+    return ratelimit.STORES[request.param]()
+
+
+def test_buckets(buckets):
+    """ A bucket starts full, empties and refills at its rate """
+    key = 'test:{}'.format(type(buckets).__name__)
+    for _ in range(3):
+        assert buckets.take(key, 0.5, 3, 1000.0) == (True, None)
+    taken, tokens = buckets.take(key, 0.5, 3, 1000.0)
+    assert not taken
+    assert abs(tokens - 0) < 1e-6
+
+    taken, tokens = buckets.take(key, 0.5, 3, 1001.0)
+    assert not taken
+    assert abs(tokens - 0.5) < 1e-6
+    assert buckets.take(key, 0.5, 3, 1002.0) == (True, None)
+
+    # A clock running behind doesn't take tokens away, and nothing overfills
+    assert not buckets.take(key, 0.5, 3, 900.0)[0]
+    for _ in range(3):
+        assert buckets.take(key, 0.5, 3, 5000.0) == (True, None)
+    assert not buckets.take(key, 0.5, 3, 5000.0)[0]
+
+
+def test_memory_buckets_swept(ratelimit):
+    """ Buckets which have refilled are dropped, and the rest are kept """
+    buckets = ratelimit.MemoryBuckets(sweep_interval=10)
+    assert buckets.take('idle', 1, 2, 0.0) == (True, None)
+    for _ in range(2):
+        assert buckets.take('busy', 0.01, 2, 0.0) == (True, None)
+    assert sorted(buckets._buckets) == ['busy', 'idle']
+
+    assert buckets.take('new', 1, 2, 5.0) == (True, None)
+    assert len(buckets._buckets) == 3
+    assert buckets.take('new', 1, 2, 10.0) == (True, None)
+    assert sorted(buckets._buckets) == ['busy', 'new']
+    assert not buckets.take('busy', 0.01, 2, 10.0)[0]
+
+
+def test_limiter(models, ratelimit):
+    """ Users and projects are limited separately and told when to come back """
+    user = models.User.add_user(u'ratelimited', 'password')
+    other = models.User.add_user(u'ratelimitedtoo', 'password')
+    project = models.Project.add_project('rate limited project', 'hello.exe', user)
+
+    limiter = ratelimit.Limiter(ratelimit.MemoryBuckets(), user_per_minute=6, user_burst=2,
+                                project_per_minute=60, project_burst=2)
+    limiter.admit(user, project, now=0)
+    limiter.admit(user, project, now=0)
+    with pytest.raises(ratelimit.RateLimited) as info:
+        limiter.admit(user, project, now=1)
+    assert 'user' in str(info.value)
+    assert info.value.retry_after == 9
+
+    limiter.admit(other, project, now=1)
+    with pytest.raises(ratelimit.RateLimited) as info:
+        limiter.admit(other, project, now=1)
+    assert 'project' in str(info.value)
+    assert info.value.retry_after == 1
+    limiter.admit(user, project, now=10)
+
+
+def test_get_limiter(ratelimit):
+    limiter = ratelimit.get_limiter()
+    assert isinstance(limiter.buckets, ratelimit.DatabaseBuckets)
+    assert ratelimit.get_limiter() is limiter
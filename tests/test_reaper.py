@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+
+import os
+import shutil
+import subprocess
+import tempfile
+import zipfile
+
+import pytest
+
+
+DATABASE_FILE = True
+CONFIG = {
+    'local': {
+        'processes': 2,
+        'timeout': 5
+    },
+    'reaper': {
+        'timeout': 60,
+        'max_attempts': 1
+    }
+}
+
+
+@pytest.fixture(scope='module')
+def assignment(models, request):
+    """ An assignment graded by a payload which prints json results """
+    from autograder import storage
+    from autograder.queues import local
+
+    directory = tempfile.mkdtemp()
+    request.addfinalizer(lambda: shutil.rmtree(directory))
+    payload = os.path.join(directory, 'payload.zip')
+    with zipfile.ZipFile(payload, 'w') as zf:
+        zf.writestr('grader.py', 'print(\'{"grade": "A"}\')\n')
+
+    teacher = models.User.add_user(u'teacher', 'pass')
+    student = models.User.add_user(u'student', 'word')
+    unit = models.Unit.add_unit('Class', teacher)
+    models.Registration.add_registration(student, unit)
+    project_key = local.make_worker(payload, 'python grader.py')
+    project = models.Project.add_project('project', 'python grader.py', teacher,
+                                         project_key=project_key,
+                                         payload_digest=storage.file_digest(payload))
+    return models.Assignment.add_assignment(teacher, unit, project)
+
+
+def add_stuck_submission(models, assignment, tmpdir, age=timedelta(hours=1)):
+    """ A submission which was never queued, as though its worker had died """
+    from autograder import storage
+
+    code = tmpdir.mkdir('code{}'.format(len(tmpdir.listdir())))
+    code.join('hello.py').write('print("hello")\n')
+    student = models.User.get_user_by_name(u'student')
+    submission, _ = models.Submission.add_submission(
+        student, assignment, archive_digest=storage.push_code(str(code)))
+    submission.submitted_at = datetime.utcnow() - age
+    models.db.session.commit()
+    return submission
+
+
+def test_stuck_submission_query_uses_index(models):
+    plan = models.db.engine.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM submissions "
+        "WHERE results_at IS NULL AND submitted_at < '2016-01-01' "
+        "ORDER BY submitted_at").fetchall()
+    assert 'ix_submissions_results_at_submitted_at' in ' '.join(str(row) for row in plan)
+
+
+def test_reap(models, assignment, tmpdir):
+    """ Lost submissions are retried and then failed; fresh ones are left alone """
+    from autograder import reaper
+    from autograder.queues import local
+
+    stuck = add_stuck_submission(models, assignment, tmpdir)
+    fresh = add_stuck_submission(models, assignment, tmpdir, age=timedelta(0))
+    stuck_key, fresh_key = stuck.submission_key, fresh.submission_key
+    old_token_hash = stuck.token_hash
+
+    report = reaper.reap(dry_run=True)
+    assert [(entry.submission_key, entry.status, entry.action) for entry in report] == \
+        [(stuck_key, 'lost', reaper.RETRIED)]
+    models.db.session.refresh(stuck)
+    assert stuck.attempts is None
+
+    report = reaper.reap()
+    assert [(entry.submission_key, entry.action) for entry in report] == \
+        [(stuck_key, reaper.RETRIED)]
+    # While it is being graded again, it is left alone
+    assert [entry.action for entry in reaper.reap()] in ([reaper.WAITING], [])
+    assert local.poll(timeout=30)
+
+    stuck = models.Submission.get_submission_by_key(stuck_key)
+    models.db.session.refresh(stuck)
+    assert stuck.attempts == 1
+    assert stuck.token_hash != old_token_hash
+    assert stuck.results['grade'] == 'A'
+    assert models.Submission.get_submission_by_key(fresh_key).results_at is None
+
+
+def test_reap_fails_after_max_attempts(models, assignment, tmpdir):
+    from autograder import reaper
+
+    stuck = add_stuck_submission(models, assignment, tmpdir)
+    stuck.attempts = 1
+    models.db.session.commit()
+    stuck_key = stuck.submission_key
+
+    report = reaper.reap()
+    assert [(entry.submission_key, entry.action) for entry in report] == \
+        [(stuck_key, reaper.FAILED)]
+    stuck = models.Submission.get_submission_by_key(stuck_key)
+    models.db.session.refresh(stuck)
+    assert stuck.results == reaper.failed_results(2)
+    assert reaper.reap() == []
+
+
+def test_reap_leaves_other_processes_alone(models, assignment, tmpdir):
+    """ Tasks queued by another running process aren't lost, even if this one doesn't
+    hold them """
+    from autograder import reaper
+    from autograder.queues import local
+
+    exited = subprocess.Popen(['true'])
+    exited.wait()
+    host = local.get_task_owner().rpartition(':')[0]
+    owners = ['{}:{}'.format(host, os.getppid()), 'elsewhere:1',
+              '{}:{}'.format(host, exited.pid), None]
+    keys = []
+    for owner in owners:
+        stuck = add_stuck_submission(models, assignment, tmpdir)
+        stuck.task_id = owner
+        keys.append(stuck.submission_key)
+    models.db.session.commit()
+
+    report = reaper.reap(dry_run=True)
+    assert [(entry.submission_key, entry.action) for entry in report] == \
+        list(zip(keys, [reaper.WAITING, reaper.WAITING, reaper.RETRIED, reaper.RETRIED]))
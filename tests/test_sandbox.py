@@ -0,0 +1,150 @@
+import os
+
+import pytest
+
+from autograder import sandbox
+
+
+def python(code):
+    return 'python -c "{}"'.format(code)
+
+
+def test_run(tmpdir):
+    """ Usage is measured and output kept """
+    result = sandbox.run(python("x = bytearray(64 * 1024 * 1024); print(sum(range(10 ** 6)))"),
+                         str(tmpdir), timeout=10,
+                         limits=sandbox.Limits(cpu_time=10, memory=512 * 1024 * 1024,
+                                               max_processes=None, max_output=1024))
+    assert result.returncode == 0
+    assert result.stdout.strip() == str(sum(range(10 ** 6))).encode('ascii')
+    assert not result.timed_out
+    assert result.exceeded is None
+    assert result.cpu_seconds > 0
+    assert result.max_rss >= 64 * 1024 * 1024
+
+
+def test_cpu_limit(tmpdir):
+    result = sandbox.run(python("while True: pass"), str(tmpdir), timeout=30,
+                         limits=sandbox.Limits(1, None, None, None))
+    assert result.returncode != 0
+    assert not result.timed_out
+    assert result.exceeded == sandbox.CPU
+    assert result.cpu_seconds >= sandbox.CPU_TOLERANCE
+
+
+def test_timeout(tmpdir):
+    result = sandbox.run(python("import time; time.sleep(30)"), str(tmpdir), timeout=1)
+    assert result.timed_out
+    assert result.returncode != 0
+
+
+def test_output_limit(tmpdir):
+    """ Runs writing too much are stopped, whether to stdout or to files """
+    result = sandbox.run(python("while True: print('x' * 1000)"), str(tmpdir), timeout=30,
+                         limits=sandbox.Limits(None, None, None, 10000))
+    assert result.exceeded == sandbox.OUTPUT
+    assert len(result.stdout) == 10000
+    assert not result.timed_out
+
+    result = sandbox.run(python("open('big', 'w').write('x' * 100000)"), str(tmpdir),
+                         limits=sandbox.Limits(None, None, None, 10000))
+    assert result.returncode != 0
+    assert os.path.getsize(str(tmpdir.join('big'))) <= 10000
+
+
+def test_memory_limit(tmpdir):
+    result = sandbox.run(python("x = bytearray(256 * 1024 * 1024)"), str(tmpdir),
+                         limits=sandbox.Limits(None, 128 * 1024 * 1024, None, None))
+    assert result.returncode != 0
+    assert b'MemoryError' in result.stderr
+
+
+def test_max_processes_needs_cgroup(tmpdir):
+    """ Without a cgroup the process limit isn't applied, as RLIMIT_NPROC would count
+    every process of the user """
+    result = sandbox.run("sh -c 'true & true & wait'", str(tmpdir), timeout=10,
+                         limits=sandbox.Limits(None, None, 1, None))
+    assert result.returncode == 0
+
+
+def test_cgroup(tmpdir):
+    """ With a cgroup root, each run is put in a cgroup of its own """
+    limits = sandbox.Limits(None, 128 * 1024 * 1024, 16, None)
+    cgroup = sandbox.make_cgroup(str(tmpdir), limits)
+    assert open(os.path.join(cgroup, 'memory.max')).read() == str(128 * 1024 * 1024)
+    assert open(os.path.join(cgroup, 'pids.max')).read() == '16'
+
+    # A directory which isn't a real cgroup can't be removed once it has files in it
+    root = tmpdir.mkdir('root')
+    result = sandbox.run('true', str(tmpdir), limits=limits, cgroup_root=str(root))
+    assert result.returncode == 0
+    cgroup, = root.listdir()
+    assert cgroup.join('cgroup.procs').read().isdigit()
+
+
+@pytest.mark.parametrize('stats, exceeded', [
+    ({'memory.events': 'low 0\nhigh 0\nmax 3\noom 1\noom_kill 1\n'}, sandbox.MEMORY),
+    ({'pids.events': 'max 2\n'}, sandbox.PROCESSES),
+    ({'memory.events': 'oom_kill 0\n', 'pids.events': 'max 0\n'}, None),
+])
+def test_cgroup_exceeded(tmpdir, monkeypatch, stats, exceeded):
+    """ The cgroup's event counters say which limit a run hit """
+    def make_cgroup(cgroup_root, limits):
+        cgroup = tmpdir.mkdir('cgroup')
+        cgroup.join('cpu.stat').write('usage_usec 5000000\nuser_usec 4000000\n')
+        for name, contents in stats.items():
+            cgroup.join(name).write(contents)
+        return str(cgroup)
+
+    monkeypatch.setattr(sandbox, 'make_cgroup', make_cgroup)
+    result = sandbox.run('true', str(tmpdir), cgroup_root=str(tmpdir))
+    assert result.exceeded == exceeded
+    assert result.cpu_seconds == 5
+
+
+def test_run_script(tmpdir):
+    """ Scripts run in a forked child see what this process imported """
+    script = tmpdir.join('script.py')
+    script.write('import sys\n'
+                 'print(sys.argv[1:], "autograder.sandbox" in sys.modules)\n'
+                 'sys.exit(int(sys.argv[1]))\n')
+    result = sandbox.run_script([str(script), '3'], str(tmpdir), timeout=10)
+    assert result.returncode == 3
+    assert result.stdout.strip() == b"(['3'], True)"
+    assert not result.timed_out
+    assert result.max_rss > 0
+
+    script.write('raise ValueError("broken")\n')
+    result = sandbox.run_script([str(script)], str(tmpdir), timeout=10)
+    assert result.returncode == 1
+    assert b'ValueError: broken' in result.stderr
+
+    script.write('while True: pass\n')
+    result = sandbox.run_script([str(script)], str(tmpdir), timeout=30,
+                                limits=sandbox.Limits(1, None, None, None))
+    assert result.exceeded == sandbox.CPU
+
+
+def test_run_script_forgets_app(models, tmpdir):
+    """ Scripts can't read the app's secrets or use its database connections """
+    import autograder
+    from autograder.config import get_config
+
+    models.User.query.count()
+    script = tmpdir.join('script.py')
+    script.write('import autograder\n'
+                 'from autograder.config import get_config\n'
+                 'print("{} {} {} {}".format(get_config(), autograder.config, '
+                 'sorted(autograder.app.config), '
+                 'autograder.app.extensions["sqlalchemy"].connectors))\n')
+    result = sandbox.run_script([str(script)], str(tmpdir), timeout=10)
+    assert result.returncode == 0, result.stderr
+    assert b'itsasecret' not in result.stdout
+    assert b'SECRET_KEY' not in result.stdout
+    assert b'SQLALCHEMY_DATABASE_URI' not in result.stdout
+    assert result.stdout.startswith(b'None None [')
+    assert result.stdout.strip().endswith(b'{}')
+
+    assert get_config().secret_key == 'itsasecret'
+    assert autograder.app.config['SECRET_KEY'] == 'itsasecret'
+    assert models.User.query.count() >= 0
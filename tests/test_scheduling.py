@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def scheduling(models):
+    from autograder import scheduling as s
+    return s
+
+
+def test_get_priority(scheduling):
+    """ Fresh submissions near a deadline come first and heavy submitters come last """
+    now = datetime(2016, 1, 1)
+    soon = now + timedelta(hours=1)
+    later = now + timedelta(days=7)
+    past = now - timedelta(hours=1)
+
+    assert scheduling.get_priority(1, soon, now=now) == scheduling.HIGH
+    assert scheduling.get_priority(1, later, now=now) == scheduling.NORMAL
+    assert scheduling.get_priority(1, past, now=now) == scheduling.NORMAL
+    assert scheduling.get_priority(10, soon, now=now) == scheduling.NORMAL
+    assert scheduling.get_priority(10, later, now=now) == scheduling.LOW
+    assert scheduling.get_priority(50, soon, now=now) == scheduling.LOW
+
+
+def test_task_queue(scheduling):
+    """ Within a priority, units with fewer tasks running go first """
+    queue = scheduling.TaskQueue()
+    for n in range(3):
+        queue.put('busy{}'.format(n), scheduling.NORMAL, 'busy', now=n)
+    queue.put('quiet', scheduling.NORMAL, 'quiet', now=10)
+    queue.put('late', scheduling.LOW, 'quiet', now=0)
+    assert len(queue) == 5
+
+    assert queue.take(now=20) == ('busy0', scheduling.NORMAL, 'busy', 20)
+    assert queue.take(now=20)[0] == 'quiet'
+    assert queue.take(now=20)[0] == 'busy1'
+    queue.done('busy')
+    queue.done('quiet')
+    assert queue.take(now=20)[0] == 'busy2'
+    assert queue.take(now=20)[:2] == ('late', scheduling.LOW)
+    assert queue.take() is None
+    assert not queue
+
+
+def test_prioritize(models, scheduling):
+    """ Priorities come from the assignment's due date and the user's submission count """
+    teacher = models.User.add_user(u'teacher', 'pass')
+    student = models.User.add_user(u'student', 'word')
+    unit = models.Unit.add_unit('Class', teacher)
+    models.Registration.add_registration(student, unit)
+    project = models.Project.add_project('project', 'hello.exe', teacher)
+    soon = models.Assignment.add_assignment(teacher, unit, project,
+                                            due_date=datetime.utcnow() + timedelta(hours=1))
+    later = models.Assignment.add_assignment(teacher, unit, project)
+    unit_id = unit.id
+
+    fresh, _ = models.Submission.add_submission(student, soon)
+    assert scheduling.prioritize([fresh]) == {fresh.id: (scheduling.HIGH, unit_id)}
+    assert models.Submission.query.get(fresh.id).priority == scheduling.HIGH
+    info = models.Submission.get_submission_info(fresh.submission_key)
+    assert (info.priority, info.unit_id) == (scheduling.HIGH, unit_id)
+
+    # Every submission added in one go counts as the user's latest
+    created = models.Submission.add_submissions(
+        [(student.id, later.id, None)] * (scheduling.FRESH_SUBMISSIONS + 1))
+    submissions = [submission for submission, token in created]
+    ids = [submission.id for submission in submissions]
+    assert scheduling.prioritize(submissions) == {
+        submission_id: (scheduling.LOW, unit_id) for submission_id in ids}
+
+
+def test_wait_stats(scheduling):
+    stats = scheduling.WaitStats()
+    stats.record(scheduling.HIGH, 1, 1.0)
+    stats.record(scheduling.HIGH, 2, 3.0)
+    stats.record(scheduling.LOW, 1, 5.0)
+    assert stats.summary() == {
+        'priority': {scheduling.HIGH: (2, 2.0, 3.0), scheduling.LOW: (1, 5.0, 5.0)},
+        'unit': {1: (2, 3.0, 5.0), 2: (1, 3.0, 3.0)},
+    }
+    stats.reset()
+    assert stats.summary() == {'priority': {}, 'unit': {}}
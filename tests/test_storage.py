@@ -0,0 +1,80 @@
+import hashlib
+import io
+import os
+import zipfile
+
+import pytest
+
+import autograder
+
+
+@pytest.fixture(scope='module')
+def storage(config_path):
+    autograder.setup_app(config_path)
+
+    from autograder import storage as s
+    return s
+
+
+def make_zip():
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as zf:
+        zf.writestr('hello.py', 'print("hello")\n' * 10000)
+    return data.getvalue()
+
+
+def test_ingest_stream(storage):
+    """ A streamed archive lands in the store under its digest, and only once """
+    data = make_zip()
+    digest = storage.ingest_stream(io.BytesIO(data))
+    assert digest == hashlib.sha256(data).hexdigest()
+    with open(storage.blob_path(digest), 'rb') as f:
+        assert f.read() == data
+
+    assert storage.ingest_stream(io.BytesIO(data)) == digest
+    assert os.listdir(os.path.dirname(storage.blob_path(digest))) == [digest + '.zip']
+
+
+def test_ingest_stream_rejects_non_zip(storage):
+    """ Something which isn't a zip is rejected and leaves nothing behind """
+    data = b'not a zip' * 100000
+    with pytest.raises(ValueError):
+        storage.ingest_stream(io.BytesIO(data))
+    assert not os.path.exists(storage.blob_path(hashlib.sha256(data).hexdigest()))
+    directory = os.path.dirname(storage.legacy_archive_path('somekey'))
+    assert not [name for name in os.listdir(directory) if name.endswith('.part')]
+
+
+def test_push_code(storage, tmpdir):
+    """ Directories are zipped up before being pushed """
+    directory = tmpdir.mkdir('code')
+    directory.join('hello.py').write('print("hello")\n')
+    digest = storage.push_code(str(directory))
+    with open(storage.blob_path(digest), 'rb') as f:
+        assert hashlib.sha256(f.read()).hexdigest() == digest
+    with zipfile.ZipFile(storage.blob_path(digest)) as zf:
+        assert zf.namelist() == ['hello.py']
+
+
+def test_archive_path(storage):
+    """ Submissions without a digest have their archive at the legacy location """
+    assert storage.archive_path('somekey') == storage.legacy_archive_path('somekey')
+    assert storage.archive_path('somekey', 'ab' * 32) == storage.blob_path('ab' * 32)
+
+
+def test_push_many(storage, tmpdir):
+    """ Many pieces of code can be pushed at once and bad ones are reported """
+    codes = []
+    for i in range(3):
+        directory = tmpdir.mkdir('code{}'.format(i))
+        directory.join('hello.py').write('print({})\n'.format(i))
+        codes.append(str(directory))
+    bad = tmpdir.join('bad.zip')
+    bad.write('not a zip')
+    codes.append(str(bad))
+
+    pushed = storage.push_many(codes, processes=2)
+    assert [error is None for _, error in pushed] == [True, True, True, False]
+    assert len({digest for digest, _ in pushed[:3]}) == 3
+    for digest, _ in pushed[:3]:
+        assert os.path.isfile(storage.blob_path(digest))
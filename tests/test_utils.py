@@ -40,3 +40,32 @@ def test_random_project_key():
     """ Just make sure the each project key is different """
     keys = [utils.random_project_key() for _ in range(20)]
     assert len(set(keys)) == len(keys)
+
+
+def test_lru_cache():
+    """ The least recently used entry is evicted when the cache is full """
+    cache = utils.LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+    assert cache.pop('a') == 1
+    assert cache.get('a', 'missing') == 'missing'
+
+
+def test_lru_cache_ttl():
+    """ Entries older than the ttl are treated as missing """
+    cache = utils.LRUCache(maxsize=2, ttl=-1)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_chunked():
+    """ Chunks are in order and only the last may be short """
+    assert list(utils.chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(utils.chunked([], 2)) == []
@@ -0,0 +1,318 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+
+import pytest
+
+
+# Results are posted from the pool's result thread, so the database has to be
+# one every thread can see
+DATABASE_FILE = True
+CONFIG = {
+    'local': {
+        'processes': 1,
+        'timeout': 5
+    },
+    'rate_limit': {
+        'enabled': True
+    }
+}
+
+
+@pytest.fixture(scope='module')
+def client(models):
+    from autograder import web
+    web.app.config['TESTING'] = True
+    return web.app.test_client()
+
+
+@pytest.fixture(scope='module')
+def submission(models, request):
+    """ A submission of a small archive and its token """
+    from autograder import storage
+
+    teacher = models.User.add_user(u'teacher', 'pass')
+    student = models.User.add_user(u'student', 'word')
+    unit = models.Unit.add_unit('Class', teacher)
+    models.Registration.add_registration(student, unit)
+    project = models.Project.add_project('project', 'python grader.py', teacher)
+    assignment = models.Assignment.add_assignment(teacher, unit, project)
+
+    directory = tempfile.mkdtemp()
+    request.addfinalizer(lambda: shutil.rmtree(directory))
+    archive = os.path.join(directory, 'code.zip')
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('hello.py', 'print("hello")\n')
+    return models.Submission.add_submission(student, assignment,
+                                            archive_digest=storage.push_code(archive))
+
+
+def test_worker_get_code(client, submission):
+    submission, token = submission
+    response = client.get('/worker/code', query_string={'submission_key': submission.submission_key,
+                                                        'token': token})
+    assert response.status_code == 200
+    with open(submission.archive, 'rb') as f:
+        assert response.data == f.read()
+
+    response = client.get('/worker/code', query_string={'submission_key': submission.submission_key,
+                                                        'token': token + 'nope'})
+    assert response.status_code == 404
+    assert client.get('/worker/code').status_code == 400
+
+
+def test_worker_get_code_conditional(client, submission):
+    """ The archive's digest is its ETag, and single byte ranges may be fetched """
+    from autograder import scheduling, web
+
+    submission, token = submission
+    query = {'submission_key': submission.submission_key, 'token': token}
+    with open(submission.archive, 'rb') as f:
+        archive = f.read()
+
+    scheduling.wait_stats.reset()
+    web._picked_up.clear()
+    response = client.get('/worker/code', query_string=query)
+    assert response.headers['ETag'] == '"{}"'.format(submission.archive_digest)
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+    response = client.get('/worker/code', query_string=query,
+                          headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    response = client.get('/worker/code', query_string=query, headers={'Range': 'bytes=0-9'})
+    assert response.status_code == 206
+    assert response.data == archive[:10]
+    assert response.headers['Content-Range'] == 'bytes 0-9/{}'.format(len(archive))
+
+    response = client.get('/worker/code', query_string=query, headers={'Range': 'bytes=-5'})
+    assert response.status_code == 206
+    assert response.data == archive[-5:]
+
+    # A range of a different version of the archive gets all of this one
+    response = client.get('/worker/code', query_string=query,
+                          headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == archive
+
+    # Only the first fetch of the task counted as picking it up
+    counts = [count for count, _, _ in scheduling.wait_stats.summary()['unit'].values()]
+    assert counts == [1]
+
+    response = client.get('/worker/code', query_string=query,
+                          headers={'Range': 'bytes={}-'.format(len(archive))})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */{}'.format(len(archive))
+
+
+@pytest.mark.parametrize('offload, header', [('x-accel-redirect', 'X-Accel-Redirect'),
+                                             ('x-sendfile', 'X-Sendfile')])
+def test_worker_get_code_offload(client, submission, monkeypatch, offload, header):
+    """ Behind a proxy, the proxy is told which file to send """
+    from autograder.config import get_config
+
+    submission, token = submission
+    monkeypatch.setattr(get_config().downloads, 'offload', offload)
+    response = client.get('/worker/code', query_string={
+        'submission_key': submission.submission_key, 'token': token})
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['ETag'] == '"{}"'.format(submission.archive_digest)
+    digest = submission.archive_digest
+    if offload == 'x-accel-redirect':
+        assert response.headers[header] == '/_submissions/blobs/{}/{}.zip'.format(digest[:2],
+                                                                                  digest)
+    else:
+        assert response.headers[header] == submission.archive
+
+
+def test_worker_post_results(client, models, submission):
+    submission, token = submission
+    content = {'submission_key': submission.submission_key, 'token': token,
+               'results': {'grade': 'A'}}
+    response = client.post('/worker/results', data=json.dumps(content),
+                           content_type='application/json')
+    assert response.status_code == 200
+    submission = models.Submission.get_submission_by_key(submission.submission_key)
+    assert submission.results == {'grade': 'A'}
+    assert submission.results_at is not None
+
+    content['token'] = token + 'nope'
+    response = client.post('/worker/results', data=json.dumps(content),
+                           content_type='application/json')
+    assert response.status_code == 404
+
+
+def test_worker_post_gzipped_results(client, models, submission, monkeypatch):
+    """ Workers may gzip the results they post """
+    from autograder import web, worker
+
+    submission, token = submission
+    content = {'submission_key': submission.submission_key, 'token': token,
+               'results': {'grade': 'B', 'log': 'x' * 10000}}
+    body = worker.compress(json.dumps(content).encode('utf-8'))
+    response = client.post('/worker/results', data=body, content_type='application/json',
+                           headers={'Content-Encoding': 'gzip'})
+    assert response.status_code == 200
+    submission = models.Submission.get_submission_by_key(submission.submission_key)
+    assert submission.results == content['results']
+
+    response = client.post('/worker/results', data=b'not gzip',
+                           content_type='application/json',
+                           headers={'Content-Encoding': 'gzip'})
+    assert response.status_code == 400
+
+    monkeypatch.setattr(web, 'MAX_RESULTS_SIZE', 1000)
+    response = client.post('/worker/results', data=body, content_type='application/json',
+                           headers={'Content-Encoding': 'gzip'})
+    assert response.status_code == 413
+
+
+def make_zip():
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as zf:
+        zf.writestr('upload.py', 'print("uploaded")\n')
+    return data.getvalue()
+
+
+@pytest.fixture
+def logged_in(client, submission, request):
+    """ Log the student in for the length of a test and wait for grading afterwards """
+    from autograder.queues import local
+
+    client.post('/login', data={'username': 'student'})
+
+    def fin():
+        local.join()
+        client.get('/logout')
+
+    request.addfinalizer(fin)
+    return client
+
+
+def uploaded(models, data):
+    """ The submissions of an archive with the passed contents """
+    return (models.Submission.query
+            .filter(models.Submission.archive_digest == hashlib.sha256(data).hexdigest())
+            .all())
+
+
+def test_submit_multipart(logged_in, models):
+    data = make_zip()
+    response = logged_in.post('/submit', data={'project_name': 'project',
+                                               'file': (io.BytesIO(data), 'code.zip')})
+    assert response.status_code == 200
+    submissions = uploaded(models, data)
+    assert len(submissions) == 1
+    with open(submissions[0].archive, 'rb') as f:
+        assert f.read() == data
+
+
+def test_submit_raw_zip(logged_in, models):
+    data = make_zip()
+    before = len(uploaded(models, data))
+    response = logged_in.post('/submit?project_name=project', data=data,
+                              content_type='application/zip')
+    assert response.status_code == 200
+    assert len(uploaded(models, data)) == before + 1
+
+
+def test_submit_rejects_non_zip(logged_in, models):
+    count = models.Submission.query.count()
+    data = b'not a zip' * 1000
+
+    response = logged_in.post('/submit', data={'project_name': 'project',
+                                               'file': (io.BytesIO(data), 'code.txt')})
+    assert response.status_code == 400
+    response = logged_in.post('/submit', data={'project_name': 'project',
+                                               'file': (io.BytesIO(data), 'code.zip')})
+    assert response.status_code == 400
+    assert b'zip archive' in response.data
+    response = logged_in.post('/submit?project_name=project', data=data,
+                              content_type='application/zip')
+    assert response.status_code == 400
+    response = logged_in.post('/submit?project_name=nope', data=make_zip(),
+                              content_type='application/zip')
+    assert response.status_code == 404
+
+    assert models.Submission.query.count() == count
+
+
+def test_submit_limit(logged_in, models):
+    """ Once a student has used up their submissions, nothing more is stored """
+    from autograder import storage
+
+    teacher = models.User.get_user_by_name(u'teacher')
+    unit = models.Unit.query.filter(models.Unit.description == 'Class').one()
+    project = models.Project.add_project('limited', 'python grader.py', teacher)
+    models.Assignment.add_assignment(teacher, unit, project, max_submissions=1)
+
+    response = logged_in.post('/submit?project_name=limited', data=b'not a zip',
+                              content_type='application/zip')
+    assert response.status_code == 400
+    response = logged_in.post('/submit?project_name=limited', data=make_zip(),
+                              content_type='application/zip')
+    assert response.status_code == 200
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('late.py', 'print("too late")\n')
+    data = archive.getvalue()
+    response = logged_in.post('/submit?project_name=limited', data=data,
+                              content_type='application/zip')
+    assert response.status_code == 403
+    assert not os.path.exists(storage.blob_path(hashlib.sha256(data).hexdigest()))
+
+
+def test_concurrent_reservations(models):
+    """ Concurrent submissions cannot take more than the limit between them """
+    teacher = models.User.get_user_by_name(u'teacher')
+    unit = models.Unit.query.filter(models.Unit.description == 'Class').one()
+    project = models.Project.add_project('raced', 'python grader.py', teacher)
+    assignment = models.Assignment.add_assignment(teacher, unit, project, max_submissions=3)
+    assignment_id = assignment.id
+    models.db.session.remove()
+
+    outcomes = []
+
+    def reserve():
+        try:
+            student = models.User.get_user_by_name(u'student')
+            models.Submission.reserve_submission(student,
+                                                 models.Assignment.query.get(assignment_id))
+            outcomes.append(True)
+        except models.SubmissionLimitError:
+            outcomes.append(False)
+        finally:
+            models.db.session.remove()
+
+    threads = [threading.Thread(target=reserve) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(outcomes) == [False] * 7 + [True] * 3
+
+
+def test_submit_rate_limited(logged_in, models, monkeypatch):
+    """ A student submitting too often is told when to come back and nothing is stored """
+    from autograder import ratelimit
+
+    limiter = ratelimit.Limiter(ratelimit.MemoryBuckets(), user_per_minute=1, user_burst=1)
+    monkeypatch.setattr(ratelimit, '_limiter', limiter)
+    count = models.Submission.query.count()
+
+    response = logged_in.post('/submit?project_name=project', data=make_zip(),
+                              content_type='application/zip')
+    assert response.status_code == 200
+    response = logged_in.post('/submit?project_name=project', data=make_zip(),
+                              content_type='application/zip')
+    assert response.status_code == 429
+    assert 0 < int(response.headers['Retry-After']) <= 60
+    assert models.Submission.query.count() == count + 1
@@ -0,0 +1,153 @@
+import gzip
+import io
+import json
+import os
+import socket
+import threading
+
+import pytest
+import requests
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+
+from autograder import worker
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeBrokerHandler(BaseHTTPRequestHandler):
+    """ Stands in for the web broker's worker endpoints. The server's `archives` maps
+    submission keys to their token and archive, and posted results are collected in
+    its `results`. """
+
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write rather than a write per header
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # As servers in front of the broker do, so responses aren't held back by
+        # Nagle's algorithm waiting on a delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.connections += 1
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        token, archive = self.server.archives.get(query['submission_key'][0], (None, None))
+        if url.path != '/worker/code' or query['token'][0] != token:
+            self.respond(404, b'Not found')
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(archive)))
+        self.end_headers()
+        for start in range(0, len(archive), 4096):
+            self.wfile.write(archive[start:start + 4096])
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+        content = json.loads(body.decode('utf-8'))
+        token, _ = self.server.archives.get(content['submission_key'], (None, None))
+        if content['token'] != token:
+            self.respond(404, b'Not found')
+            return
+        self.server.results.append((content, self.headers.get('Content-Encoding')))
+        self.respond(200, b'Submission results accepted')
+
+    def respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def broker(request):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBrokerHandler)
+    server.archives = {}
+    server.results = []
+    server.connections = 0
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def fin():
+        server.shutdown()
+        server.server_close()
+
+    request.addfinalizer(fin)
+    return server
+
+
+@pytest.fixture
+def client(broker, request):
+    client = worker.WorkerClient('http://127.0.0.1:{}/'.format(broker.server_address[1]))
+    request.addfinalizer(client.close)
+    return client
+
+
+def test_grade(broker, client):
+    """ Submissions are downloaded and graded over one kept-alive connection """
+    for n in range(5):
+        broker.archives['key{}'.format(n)] = ('token{}'.format(n), os.urandom(100000))
+
+    def grader(archive):
+        with open(archive, 'rb') as f:
+            return {'size': len(f.read())}
+
+    for n in range(5):
+        assert client.grade('key{}'.format(n), 'token{}'.format(n), grader) == {'size': 100000}
+    assert [content['results'] for content, _ in broker.results] == [{'size': 100000}] * 5
+    assert broker.connections == 1
+
+
+def test_grade_error(broker, client):
+    """ A grader which raises has the error posted as the results """
+    broker.archives['key'] = ('token', b'not a zip')
+
+    def grader(archive):
+        raise ValueError("broken")
+
+    results = client.grade('key', 'token', grader)
+    assert results == {'error': 'ValueError: broken'}
+    assert [content['results'] for content, _ in broker.results] == [results]
+
+    with pytest.raises(requests.HTTPError):
+        client.grade('key', 'nope', grader)
+
+
+def test_download_code(broker, client, tmpdir):
+    archive = os.urandom(1024 * 1024)
+    broker.archives['key'] = ('token', archive)
+    path = str(tmpdir.join('submission.zip'))
+    assert client.download_code('key', 'token', path) == len(archive)
+    assert open(path, 'rb').read() == archive
+
+    with pytest.raises(requests.HTTPError):
+        client.download_code('key', 'nope', path)
+
+
+def test_post_results(broker, client):
+    """ Large results are gzipped and small ones are not """
+    broker.archives['key'] = ('token', b'')
+    client.post_results('key', 'token', {'grade': 'A'})
+    client.post_results('key', 'token', {'grade': 'A', 'log': 'x' * 10000})
+    assert [encoding for _, encoding in broker.results] == [None, 'gzip']
+    assert broker.results[1][0]['results']['log'] == 'x' * 10000
+
+    with pytest.raises(requests.HTTPError):
+        client.post_results('key', 'nope', {})